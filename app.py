@@ -1,136 +1,295 @@
+import hashlib
+import io
+import json
 import os
 import sqlite3
-from datetime import datetime
-from flask import Flask, render_template, request, current_app
+import re
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import date, datetime
+from flask import Flask, render_template, request, current_app, g
 
 # Import the configuration
 from .config import Config
-
-DEFAULT_AWAKE_BUDGET_SEC = 10 * 60 * 60
-
-def get_db_connection():
-    """Establishes a connection to the database and sets the row factory."""
-    db_path = os.path.join(current_app.instance_path, current_app.config['DATABASE'])
-    conn = sqlite3.connect(db_path)
-    # Return rows as objects that can be accessed by column name
-    conn.row_factory = sqlite3.Row
-    return conn
+from .assets import assets_cli, init_assets
+from .broker import format_sse, get_broker, init_broker
+from .cache import get_day_cache, init_day_cache
+from .db import get_pool, get_pools, init_pools
+from .evaluation import plans_cli
+from .event_log import events_cli
+from .history import aggregate_history, daily_history, day_documents, parse_date_range
+from .metrics import get_metrics, init_metrics
+from .migrations import migrate
+from .operations import EventError, apply_event, changed_date, parse_event
+from .shards import shard_paths, shards_cli
+from .transfer import (FORMATS, TABLES, history_cli, import_records, iter_csv, iter_ndjson, parse_export_range,
+                       parse_tables, read_csv, read_ndjson)
+from .writer import get_write_queue, get_write_queues, init_write_queues
+
+# Tenant ids arrive in a header or query string, so keep them to a safe alphabet.
+TENANT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+# Set in the WSGI environ by the ASGI build, which sends /api/day/stream
+# from its event loop; stream_today then leaves the subscription under
+# DAY_STREAM_ENVIRON_KEY instead of returning a blocking generator.
+ASYNC_STREAMS_ENVIRON_KEY = 'nap_plans.async_streams'
+DAY_STREAM_ENVIRON_KEY = 'nap_plans.day_stream'
+
+def current_tenant():
+    """The tenant (household) the current request acts for."""
+    return g.tenant_id
+
+def get_db_connection(tenant_id=None):
+    """
+    Checks a connection out of the pool of the shard holding tenant_id
+    (default: the current request's tenant). The row factory and pragmas are
+    already set; calling close() on it returns it to the pool.
+    """
+    if tenant_id is None:
+        tenant_id = current_tenant()
+    return get_pool(tenant_id).acquire()
 
 def create_db(app):
     """
-    Creates the SQLite database and tables if they don't exist.
-    This new schema is more robust and supports dynamic adjustments.
+    Brings the schema of every shard up to date by running any pending
+    migrations. Returns straight away when the schemas are already current.
     """
-    db_path = os.path.join(app.instance_path, app.config['DATABASE'])
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    # Drop old table for a clean slate during development.
-    # In a production migration, you'd use ALTER TABLE or a migration script.
-    c.execute('DROP TABLE IF EXISTS nap_plans')
-
-    # The 'days' table is the central record for a single day's schedule.
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS days (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT NOT NULL UNIQUE,
-            first_wake_at TEXT,
-            bedtime_start_at TEXT,
-            total_night_sleep_sec INTEGER,
-            daily_awake_budget_sec INTEGER,
-            projected_bedtime_at TEXT
-        )
-    ''')
-
-    # Ensure new columns exist for evolving schema without clobbering data.
-    for ddl in (
-        "ALTER TABLE days ADD COLUMN bedtime_start_at TEXT",
-        "ALTER TABLE days ADD COLUMN total_night_sleep_sec INTEGER",
-        "ALTER TABLE days ADD COLUMN daily_awake_budget_sec INTEGER",
-    ):
-        try:
-            c.execute(ddl)
-        except sqlite3.OperationalError:
-            pass
-
-    # 'nap_slots' holds the plan and actuals for each individual nap.
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS nap_slots (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            day_id INTEGER NOT NULL,
-            nap_index INTEGER NOT NULL,
-            planned_duration_sec INTEGER NOT NULL,
-            adjusted_duration_sec INTEGER, -- This will be updated by the schedule adjustment logic.
-            actual_start_at TEXT,
-            actual_end_at TEXT,
-            status TEXT NOT NULL DEFAULT 'upcoming',
-            FOREIGN KEY (day_id) REFERENCES days (id)
-        )
-    ''')
-
-    # Track bedtime sessions to calculate overnight sleep duration.
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS sleep_sessions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            start_at TEXT NOT NULL,
-            end_at TEXT,
-            total_sleep_sec INTEGER
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    for db_path in shard_paths(app):
+        migrate(db_path, app.logger)
 
-def _adjust_schedule(conn, day_id, finished_nap_index):
+def _load_day_document(conn, tenant_id, date_str):
     """
-    Recalculates the duration of upcoming naps based on the deviation
-    of the nap that just finished.
+    Reads the day record, its nap slots and any open sleep session into the
+    document served by GET /api/day/today.
     """
-    # 1. Get the details of the nap that just finished
-    finished_nap_cursor = conn.execute(
-        'SELECT actual_start_at, actual_end_at, planned_duration_sec FROM nap_slots WHERE day_id = ? AND nap_index = ?',
-        (day_id, finished_nap_index)
+    day_row = conn.execute('SELECT * FROM days WHERE tenant_id = ? AND date = ?', (tenant_id, date_str)).fetchone()
+
+    sleep_row = conn.execute(
+        'SELECT start_at FROM sleep_sessions WHERE tenant_id = ? AND end_at IS NULL ORDER BY id DESC LIMIT 1',
+        (tenant_id,)
+    ).fetchone()
+    sleep_session = dict(sleep_row) if sleep_row else None
+
+    if not day_row:
+        response = {"status": "not_found", "message": "Today's schedule has not been started yet."}
+        if sleep_session:
+            response["sleep_session"] = sleep_session
+        return response
+
+    day_data = dict(day_row)
+    naps_cursor = conn.execute(
+        'SELECT * FROM nap_slots WHERE day_id = ? ORDER BY nap_index',
+        (day_data['id'],)
     )
-    finished_nap = finished_nap_cursor.fetchone()
-
-    if not all([finished_nap, finished_nap['actual_start_at'], finished_nap['actual_end_at']]):
-        # Not enough data to perform adjustment
-        current_app.logger.warning(f"Could not adjust schedule; finished nap {finished_nap_index} lacks start/end times.")
-        return
-
-    # 2. Calculate the time deviation
-    start_time = datetime.fromisoformat(finished_nap['actual_start_at'].replace('Z', '+00:00'))
-    end_time = datetime.fromisoformat(finished_nap['actual_end_at'].replace('Z', '+00:00'))
-    actual_duration_sec = (end_time - start_time).total_seconds()
-    planned_duration_sec = finished_nap['planned_duration_sec']
+    naps_data = [dict(row) for row in naps_cursor.fetchall()]
+
+    response_data = {
+        "day": day_data,
+        "naps": naps_data
+    }
+    if sleep_session:
+        response_data["sleep_session"] = sleep_session
+    return response_data
+
+def _cached_json_response(app, body, etag, status=200):
+    """Builds a JSON response that clients must revalidate with its ETag (None without the day cache)."""
+    response = app.response_class(body, status=status, mimetype='application/json')
+    if etag is not None:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def _day_document_body(tenant_id, date_str):
+    """
+    Returns (etag, body) for a tenant's day document, serving it from the day
+    cache when possible. etag is None when the cache is disabled.
+    """
+    cache = get_day_cache()
+    if cache is not None:
+        cached = cache.get(tenant_id, date_str)
+        if cached:
+            return cached
+        version = cache.version(tenant_id, date_str)
+
+    conn = get_db_connection(tenant_id)
+    try:
+        document = _load_day_document(conn, tenant_id, date_str)
+    finally:
+        conn.close()
 
-    time_delta_sec = actual_duration_sec - planned_duration_sec
+    body = current_app.json.response(document).get_data()
+    if cache is None:
+        return None, body
+    cache.store(tenant_id, date_str, version, body)
+    return cache.etag(tenant_id, date_str, version), body
 
-    # 3. Find all upcoming naps
-    upcoming_naps_cursor = conn.execute(
-        "SELECT id, nap_index, planned_duration_sec, adjusted_duration_sec FROM nap_slots WHERE day_id = ? AND status = 'upcoming' ORDER BY nap_index",
-        (day_id,)
-    )
-    upcoming_naps = upcoming_naps_cursor.fetchall()
+def _notify_day_changed(tenant_id, date_str=None):
+    """
+    Called after a write commits. Bumps the cached document version for the
+    tenant's date_str (or every date when None) and pushes today's document
+    to the tenant's open /api/day/stream listeners.
+    """
+    cache = get_day_cache()
+    if cache is not None:
+        if date_str is None:
+            cache.invalidate_all(tenant_id)
+        else:
+            cache.invalidate(tenant_id, date_str)
 
-    if not upcoming_naps:
-        current_app.logger.info("No upcoming naps to adjust.")
+    broker = get_broker()
+    if not broker.subscriber_count(tenant_id):
         return
+    today_str = datetime.now().strftime('%Y-%m-%d')
+    if date_str is not None and date_str != today_str:
+        return
+    try:
+        etag, body = _day_document_body(tenant_id, today_str)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Database error while publishing day update: {e}")
+        return
+    broker.publish(tenant_id, format_sse(body.decode('utf-8'), event='day', event_id=etag))
+
+# Log label and client-facing message for each write event when the database fails.
+_WRITE_FAILURES = {
+    'sleep': ("log_bedtime sleep", "Failed to log bedtime start."),
+    'wake': ("log_bedtime", "Failed to log wake time."),
+    'nap_start': ("start_nap", "Failed to log nap start."),
+    'nap_stop': ("stop_nap", "Failed to log nap stop."),
+    'nap_update': ("update_nap", "Failed to update nap."),
+}
+
+def _document_version(document):
+    """A short hash identifying a day document's content, used as the base of day deltas."""
+    text = json.dumps(document, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+def _document_delta(before, after):
+    """
+    What changed from one day document to the next: the changed day fields,
+    the changed or added nap rows, the nap indexes removed and, when it
+    changed, the sleep session (null once it ended). None when either
+    document has no day, as a delta cannot express that.
+    """
+    if 'day' not in before or 'day' not in after:
+        return None
+    delta = {
+        "day": {key: value for key, value in after['day'].items() if before['day'].get(key) != value},
+        "naps": [],
+        "removed_naps": [],
+    }
+    old_naps = {nap['nap_index']: nap for nap in before['naps']}
+    new_indexes = set()
+    for nap in after['naps']:
+        new_indexes.add(nap['nap_index'])
+        if old_naps.get(nap['nap_index']) != nap:
+            delta['naps'].append(nap)
+    delta['removed_naps'] = sorted(set(old_naps) - new_indexes)
+    if before.get('sleep_session') != after.get('sleep_session'):
+        delta['sleep_session'] = after.get('sleep_session')
+    return delta
+
+def _apply_write(conn, event, return_state=False, base_version=None):
+    """
+    Applies event on conn, inside the caller's transaction. With return_state,
+    also reads today's document after the change, in the same transaction, and
+    returns it, or its delta from the document the client holds when that
+    matches base_version. Returns (message, day_state or None).
+    """
+    if not return_state:
+        return apply_event(conn, event), None
+    tenant_id = event['tenant_id']
+    today_str = datetime.now().strftime('%Y-%m-%d')
+    before = _load_day_document(conn, tenant_id, today_str) if base_version else None
+    message = apply_event(conn, event)
+    after = _load_day_document(conn, tenant_id, today_str)
+
+    day_state = {"version": _document_version(after)}
+    if before is not None and _document_version(before) == base_version:
+        delta = _document_delta(before, after)
+        if delta is not None:
+            day_state.update(base=base_version, delta=delta)
+            return message, day_state
+    day_state['document'] = after
+    return message, day_state
+
+def _write_options():
+    """
+    Whether the client asked the write to return today's document
+    ('Prefer: return=representation' or ?return=day), and the version of the
+    document it holds (X-Day-Version or ?since=), to get a delta instead.
+    """
+    prefer = request.headers.get('Prefer', '')
+    return_state = 'return=representation' in prefer or request.args.get('return') == 'day'
+    base_version = request.headers.get('X-Day-Version') or request.args.get('since')
+    return return_state, (base_version if return_state else None)
+
+def _write_response(event, message, day_state):
+    _notify_day_changed(event['tenant_id'], changed_date(event))
+    if day_state is None:
+        return {"status": "success", "message": message}
+    response = current_app.json.response({"status": "success", "message": message, "day_state": day_state})
+    response.headers['Preference-Applied'] = 'return=representation'
+    return response
+
+def _handle_write(event_type, data):
+    """Parses and applies one write event in its own transaction, then notifies listeners."""
+    try:
+        event = parse_event(event_type, data, current_tenant())
+    except EventError as e:
+        return e.response()
+    return_state, base_version = _write_options()
 
-    # 4. Distribute the time delta among upcoming naps
-    # A positive delta (long nap) means we need to shorten future naps.
-    adjustment_per_nap = time_delta_sec / len(upcoming_naps)
-    current_app.logger.info(f"Nap {finished_nap_index} was {time_delta_sec:.0f}s off plan. Adjusting {len(upcoming_naps)} upcoming naps by {-adjustment_per_nap:.0f}s each.")
-
-    for nap in upcoming_naps:
-        # The base for adjustment is the previously adjusted duration, or the original plan if never adjusted.
-        base_duration = nap['adjusted_duration_sec'] if nap['adjusted_duration_sec'] is not None else nap['planned_duration_sec']
-        # Subtract the adjustment: if nap was long (positive delta), we shorten future naps.
-        new_adjusted_duration = base_duration - adjustment_per_nap
-        # Sanity check: ensure naps are not adjusted to be too short (e.g., less than 10 minutes)
-        MIN_NAP_DURATION_SEC = 10 * 60
-        final_duration = max(MIN_NAP_DURATION_SEC, new_adjusted_duration)
+    write_queue = get_write_queue(event['tenant_id'])
+    if write_queue is not None:
+        return _handle_queued_write(write_queue, event, return_state, base_version)
 
-        conn.execute('UPDATE nap_slots SET adjusted_duration_sec = ? WHERE id = ?', (final_duration, nap['id']))
-        current_app.logger.info(f"Nap {nap['nap_index']} duration adjusted to {final_duration:.0f} seconds.")
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn:
+            # Take the write lock up front: waiting for it happens here, in
+            # one statement, instead of failing a later lock upgrade.
+            conn.execute('BEGIN IMMEDIATE')
+            message, day_state = _apply_write(conn, event, return_state, base_version)
+    except EventError as e:
+        return e.response()
+    except sqlite3.Error as e:
+        label, failure_message = _WRITE_FAILURES[event_type]
+        current_app.logger.error(f"Database error in {label}: {e}")
+        return {"status": "error", "message": failure_message}, 500
+    finally:
+        if conn:
+            conn.close()
+
+    return _write_response(event, message, day_state)
+
+def _handle_queued_write(write_queue, event, return_state=False, base_version=None):
+    """
+    Hands one parsed write event to its shard's writer thread (WRITE_MODE =
+    'queue') and waits for the group it joined to commit. Responses are the
+    same as for a write applied on the request thread.
+    """
+    future = write_queue.submit(lambda conn: _apply_write(conn, event, return_state, base_version))
+    try:
+        try:
+            message, day_state = future.result(timeout=current_app.config.get('WRITE_QUEUE_TIMEOUT_SEC', 10.0))
+        finally:
+            # The writer thread ran the SQL; count it towards this request's metrics.
+            request_stats = g.get('query_stats')
+            if request_stats is not None and future.done():
+                request_stats.add(future.query_stats)
+    except EventError as e:
+        return e.response()
+    except sqlite3.Error as e:
+        label, failure_message = _WRITE_FAILURES[event['type']]
+        current_app.logger.error(f"Database error in {label}: {e}")
+        return {"status": "error", "message": failure_message}, 500
+    except FutureTimeoutError:
+        # The job stays queued and may still be applied after this response.
+        label, failure_message = _WRITE_FAILURES[event['type']]
+        current_app.logger.error(f"Timed out waiting for the write queue in {label}")
+        return {"status": "error", "message": failure_message}, 503
+
+    return _write_response(event, message, day_state)
 
 def create_app(test_config=None):
     """
@@ -153,6 +312,34 @@ def create_app(test_config=None):
         pass
 
     create_db(app)
+    init_pools(app, shard_paths(app))
+    if app.config.get('DAY_CACHE_ENABLED', False):
+        init_day_cache(app)
+    init_broker(app)
+    if app.config.get('WRITE_MODE', 'direct') == 'queue':
+        init_write_queues(app)
+    app.cli.add_command(shards_cli)
+    app.cli.add_command(plans_cli)
+    app.cli.add_command(events_cli)
+    app.cli.add_command(history_cli)
+    app.cli.add_command(assets_cli)
+    init_assets(app)
+    if app.config.get('METRICS_ENABLED', True):
+        # Registered first so request timing covers the other hooks too.
+        init_metrics(app)
+
+    @app.before_request
+    def resolve_tenant():
+        """
+        Picks the tenant for this request from the X-Tenant-ID header or the
+        'tenant' query parameter, falling back to DEFAULT_TENANT.
+        """
+        tenant_id = (request.headers.get('X-Tenant-ID') or request.args.get('tenant')
+                     or app.config.get('DEFAULT_TENANT', 'default'))
+        if not TENANT_ID_PATTERN.match(tenant_id):
+            return {"status": "error", "message": "Invalid tenant id."}, 400
+        g.tenant_id = tenant_id
+
     @app.route('/')
     def index():
         """
@@ -162,53 +349,183 @@ def create_app(test_config=None):
 
     # --- New API Endpoints ---
 
+    @app.route('/api/db/pool', methods=['GET'])
+    def db_pool_stats():
+        """Reports connection pool counters of every shard so the pool size can be tuned."""
+        return {"shards": [pool.stats() for pool in get_pools()]}
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        """
+        Per-route request latency and SQL counters (statements, SQL time, rows,
+        lock waits) plus pool, cache and stream stats, in Prometheus text format.
+        """
+        metrics = get_metrics()
+        if metrics is None:
+            return {"status": "error", "message": "Metrics are disabled."}, 404
+        cache = get_day_cache()
+        body = metrics.render(
+            pools=get_pools(),
+            cache_stats=cache.stats() if cache is not None else None,
+            broker_stats=get_broker().stats(),
+            writer_stats=[write_queue.stats() for write_queue in get_write_queues() or ()],
+        )
+        return app.response_class(body, mimetype='text/plain; version=0.0.4')
+
+    @app.route('/api/cache/stats', methods=['GET'])
+    def cache_stats():
+        """Reports hit/miss counters of the day document cache."""
+        cache = get_day_cache()
+        if cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **cache.stats()}
+
     @app.route('/api/day/today', methods=['GET'])
     def get_today():
         """
         Fetches the complete schedule for the current day, including the
         day's overall data and the status of all its nap slots.
+        Responses carry a strong ETag; a matching If-None-Match gets a 304.
         """
+        tenant_id = current_tenant()
         today_str = datetime.now().strftime('%Y-%m-%d')
-        conn = get_db_connection()
+        cache = get_day_cache()
+        if cache is not None:
+            for etag in request.if_none_match.as_set():
+                if cache.is_current(tenant_id, today_str, etag):
+                    return _cached_json_response(app, None, etag, status=304)
+
         try:
-            day_cursor = conn.execute('SELECT * FROM days WHERE date = ?', (today_str,))
-            day_row = day_cursor.fetchone()
+            etag, body = _day_document_body(tenant_id, today_str)
+        except sqlite3.Error as e:
+            app.logger.error(f"Database error in get_today: {e}")
+            return {"status": "error", "message": "Failed to fetch today's schedule."}, 500
+        return _cached_json_response(app, body, etag)
 
-            sleep_cursor = conn.execute(
-                'SELECT start_at FROM sleep_sessions WHERE end_at IS NULL ORDER BY id DESC LIMIT 1'
-            )
-            sleep_row = sleep_cursor.fetchone()
-            sleep_session = dict(sleep_row) if sleep_row else None
+    @app.route('/api/day/stream', methods=['GET'])
+    def stream_today():
+        """
+        Streams today's schedule as Server-Sent Events. The current document is
+        sent on connect, then again each time a write endpoint commits a change.
+        Under WSGI each open stream holds a worker thread, so run a threaded
+        server or the ASGI build.
+        """
+        tenant_id = current_tenant()
+        subscription = get_broker().subscribe(tenant_id)
+        today_str = datetime.now().strftime('%Y-%m-%d')
+        try:
+            etag, body = _day_document_body(tenant_id, today_str)
+        except sqlite3.Error as e:
+            subscription.close()
+            app.logger.error(f"Database error in stream_today: {e}")
+            return {"status": "error", "message": "Failed to fetch today's schedule."}, 500
 
-            if not day_row:
-                response = {"status": "not_found", "message": "Today's schedule has not been started yet."}
-                if sleep_session:
-                    response["sleep_session"] = sleep_session
-                return response
+        heartbeat_sec = app.config.get('STREAM_HEARTBEAT_SEC', 15)
+        first_message = format_sse(body.decode('utf-8'), event='day', event_id=etag)
 
-            day_data = dict(day_row)
-            day_id = day_data['id']
+        def generate():
+            try:
+                yield first_message
+                while True:
+                    message = subscription.get(timeout=heartbeat_sec)
+                    # A comment line keeps proxies from closing an idle stream.
+                    yield message if message is not None else ': keepalive\n\n'
+            finally:
+                subscription.close()
 
-            naps_cursor = conn.execute(
-                'SELECT * FROM nap_slots WHERE day_id = ? ORDER BY nap_index',
-                (day_id,)
-            )
-            naps_data = [dict(row) for row in naps_cursor.fetchall()]
+        if request.environ.get(ASYNC_STREAMS_ENVIRON_KEY):
+            # Under the ASGI build (asgi.py) the event loop sends the stream,
+            # so an idle listener does not hold a worker thread.
+            request.environ[DAY_STREAM_ENVIRON_KEY] = (subscription, first_message, heartbeat_sec)
+            response = app.response_class(iter(()), mimetype='text/event-stream')
+        else:
+            response = app.response_class(generate(), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
 
-            response_data = {
-                "day": day_data,
-                "naps": naps_data
-            }
-            if sleep_session:
-                response_data["sleep_session"] = sleep_session
-            return response_data
+    @app.route('/api/days', methods=['GET'])
+    def get_days():
+        """
+        The day documents (day, naps and sleep_sessions) of the recorded days
+        between ?from= and ?to= (YYYY-MM-DD, inclusive; the last 7 days by
+        default), in one round trip. Long ranges are paged: at most ?limit=
+        days are returned, and a non-null next_after is passed back as
+        ?after= to get the following page.
+        """
+        max_page = app.config.get('DAYS_PAGE_MAX', 92)
+        try:
+            from_date, to_date = parse_date_range(request.args, default_days=7,
+                                                  max_days=app.config.get('HISTORY_MAX_DAYS', 366))
+            after = request.args.get('after')
+            if after:
+                after = date.fromisoformat(after).isoformat()
+            limit = int(request.args.get('limit', app.config.get('DAYS_PAGE_SIZE', 31)))
+        except ValueError as e:
+            return {"status": "error", "message": f"Invalid query: {e}"}, 400
+        if not 1 <= limit <= max_page:
+            return {"status": "error", "message": f"limit must be between 1 and {max_page}."}, 400
+
+        conn = None
+        try:
+            conn = get_db_connection()
+            days, next_after = day_documents(conn, current_tenant(), from_date, to_date, limit, after)
+        except sqlite3.Error as e:
+            app.logger.error(f"Database error in get_days: {e}")
+            return {"status": "error", "message": "Failed to fetch days."}, 500
+        finally:
+            if conn:
+                conn.close()
+        return {"from": from_date, "to": to_date, "days": days, "next_after": next_after}
+
+    @app.route('/api/history', methods=['GET'])
+    def get_history():
+        """
+        Lists the per-day sleep rollups between ?from= and ?to= (YYYY-MM-DD,
+        inclusive). Defaults to the last 30 days.
+        """
+        try:
+            from_date, to_date = parse_date_range(request.args, max_days=app.config.get('HISTORY_MAX_DAYS', 366))
+        except ValueError as e:
+            return {"status": "error", "message": f"Invalid date range: {e}"}, 400
 
+        conn = None
+        try:
+            conn = get_db_connection()
+            days = daily_history(conn, current_tenant(), from_date, to_date)
         except sqlite3.Error as e:
-            app.logger.error(f"Database error in get_today: {e}")
-            return {"status": "error", "message": "Failed to fetch today's schedule."}, 500
+            app.logger.error(f"Database error in get_history: {e}")
+            return {"status": "error", "message": "Failed to fetch history."}, 500
+        finally:
+            if conn:
+                conn.close()
+        return {"from": from_date, "to": to_date, "days": days}
+
+    @app.route('/api/history/aggregate', methods=['GET'])
+    def get_history_aggregate():
+        """
+        Sleep totals and averages between ?from= and ?to=, per day or per
+        week (?group=week, weeks starting on Monday).
+        """
+        group = request.args.get('group', 'day')
+        if group not in ('day', 'week'):
+            return {"status": "error", "message": "group must be 'day' or 'week'."}, 400
+        try:
+            from_date, to_date = parse_date_range(request.args, max_days=app.config.get('HISTORY_MAX_DAYS', 366))
+        except ValueError as e:
+            return {"status": "error", "message": f"Invalid date range: {e}"}, 400
+
+        conn = None
+        try:
+            conn = get_db_connection()
+            periods = aggregate_history(conn, current_tenant(), from_date, to_date, group)
+        except sqlite3.Error as e:
+            app.logger.error(f"Database error in get_history_aggregate: {e}")
+            return {"status": "error", "message": "Failed to fetch history."}, 500
         finally:
             if conn:
                 conn.close()
+        return {"from": from_date, "to": to_date, "group": group, "periods": periods}
 
     @app.route('/api/day/bedtime', methods=['POST'])
     def log_bedtime():
@@ -218,142 +535,14 @@ def create_app(test_config=None):
         """
         data = request.json
         event_type = data.get('type')
-        timestamp = data.get('timestamp')
-
-        if event_type == 'sleep' and timestamp:
-            conn = get_db_connection()
-            try:
-                with conn:
-                    open_session = conn.execute(
-                        'SELECT id FROM sleep_sessions WHERE end_at IS NULL ORDER BY id DESC LIMIT 1'
-                    ).fetchone()
-                    if open_session:
-                        conn.execute(
-                            'UPDATE sleep_sessions SET start_at = ?, end_at = NULL, total_sleep_sec = NULL WHERE id = ?',
-                            (timestamp, open_session['id'])
-                        )
-                    else:
-                        conn.execute(
-                            'INSERT INTO sleep_sessions (start_at) VALUES (?)',
-                            (timestamp,)
-                        )
-                return {"status": "success", "message": "Bedtime started."}
-            except sqlite3.Error as e:
-                app.logger.error(f"Database error in log_bedtime sleep: {e}")
-                return {"status": "error", "message": "Failed to log bedtime start."}, 500
-            finally:
-                if conn:
-                    conn.close()
-
-        if event_type == 'wake' and timestamp:
-            # Use the timestamp from the request to determine the date
-            today_str = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).strftime('%Y-%m-%d')
-            conn = get_db_connection()
-            try:
-                with conn:
-                    bedtime_start_at = None
-                    total_sleep_sec = None
-
-                    sleep_row = conn.execute(
-                        'SELECT id, start_at FROM sleep_sessions WHERE end_at IS NULL ORDER BY id DESC LIMIT 1'
-                    ).fetchone()
-
-                    if sleep_row and sleep_row['start_at']:
-                        try:
-                            start_dt = datetime.fromisoformat(sleep_row['start_at'].replace('Z', '+00:00'))
-                            end_dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                            total_sleep_sec = max(0, int((end_dt - start_dt).total_seconds()))
-                            bedtime_start_at = sleep_row['start_at']
-                            conn.execute(
-                                'UPDATE sleep_sessions SET end_at = ?, total_sleep_sec = ? WHERE id = ?',
-                                (timestamp, total_sleep_sec, sleep_row['id'])
-                            )
-                        except ValueError:
-                            current_app.logger.warning("Invalid timestamp encountered while closing sleep session.")
-
-                    # Use "UPSERT" to either insert a new day or update the existing one
-                    awake_budget_sec = app.config.get('DEFAULT_AWAKE_BUDGET_SEC', DEFAULT_AWAKE_BUDGET_SEC)
-
-                    conn.execute('''
-                        INSERT INTO days (date, first_wake_at, bedtime_start_at, total_night_sleep_sec, daily_awake_budget_sec)
-                        VALUES (?, ?, ?, ?, ?)
-                        ON CONFLICT(date) DO UPDATE SET first_wake_at = excluded.first_wake_at,
-                                                      bedtime_start_at = excluded.bedtime_start_at,
-                                                      total_night_sleep_sec = excluded.total_night_sleep_sec,
-                                                      daily_awake_budget_sec = COALESCE(days.daily_awake_budget_sec, excluded.daily_awake_budget_sec)
-                    ''', (today_str, timestamp, bedtime_start_at, total_sleep_sec, awake_budget_sec))
-
-                    # Get the ID of the day we just created/updated
-                    day_cursor = conn.execute('SELECT id FROM days WHERE date = ?', (today_str,))
-                    day_row = day_cursor.fetchone()
-                    if not day_row:
-                        return {"status": "error", "message": "Failed to create or find day record."}, 500
-                    day_id = day_row['id']
-
-                    # --- Initialize Nap Schedule for the Day ---
-                    # First, clear any existing naps for this day to handle updates cleanly.
-                    conn.execute('DELETE FROM nap_slots WHERE day_id = ?', (day_id,))
-
-                    # Define a default nap plan (could be dynamic in the future)
-                    default_nap_plan = [
-                        {'index': 1, 'duration_min': 45},
-                        {'index': 2, 'duration_min': 60},
-                        {'index': 3, 'duration_min': 30},
-                    ]
-
-                    for nap in default_nap_plan:
-                        conn.execute('''
-                            INSERT INTO nap_slots (day_id, nap_index, planned_duration_sec)
-                            VALUES (?, ?, ?)
-                        ''', (day_id, nap['index'], nap['duration_min'] * 60))
-
-                return {"status": "success", "message": f"Wake time for {today_str} logged and nap schedule initialized."}
-            except sqlite3.Error as e:
-                app.logger.error(f"Database error in log_bedtime: {e}")
-                return {"status": "error", "message": "Failed to log wake time."}, 500
-            finally:
-                if conn:
-                    conn.close()
-
-        return {"status": "error", "message": "Invalid event type or missing timestamp."}, 400
+        if event_type not in ('sleep', 'wake'):
+            return {"status": "error", "message": "Invalid event type or missing timestamp."}, 400
+        return _handle_write(event_type, data)
 
     @app.route('/api/naps/start', methods=['POST'])
     def start_nap():
         """Logs the start of a specific nap."""
-        data = request.json
-        nap_index = data.get('index')
-        timestamp = data.get('timestamp')
-
-        if not all([nap_index, timestamp]):
-            return {"status": "error", "message": "Missing nap index or timestamp."}, 400
-
-        today_str = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).strftime('%Y-%m-%d')
-        conn = get_db_connection()
-        try:
-            with conn:
-                day_cursor = conn.execute('SELECT id FROM days WHERE date = ?', (today_str,))
-                day_row = day_cursor.fetchone()
-                if not day_row:
-                    return {"status": "error", "message": "Day not started. Log morning wake time first."}, 404
-                day_id = day_row['id']
-
-                cursor = conn.execute('''
-                    UPDATE nap_slots
-                    SET actual_start_at = ?, status = 'in_progress'
-                    WHERE day_id = ? AND nap_index = ?
-                ''', (timestamp, day_id, nap_index))
-
-                if cursor.rowcount == 0:
-                    return {"status": "error", "message": f"Nap with index {nap_index} not found for today."}, 404
-
-            return {"status": "success", "message": f"Nap {nap_index} start logged."}
-        except sqlite3.Error as e:
-            app.logger.error(f"Database error in start_nap: {e}")
-            return {"status": "error", "message": "Failed to log nap start."}, 500
-        finally:
-            if conn:
-                conn.close()
-
+        return _handle_write('nap_start', request.json)
 
     @app.route('/api/naps/update', methods=['POST'])
     def update_nap():
@@ -363,113 +552,193 @@ def create_app(test_config=None):
         Accepts an optional "date" field so clients in different timezones can
         target the intended day explicitly.
         """
-        data = request.json
-        nap_index = data.get('index')
-        new_duration_min = data.get('duration_min')
-        request_date = data.get('date')
+        return _handle_write('nap_update', request.json)
 
-        if nap_index is None or new_duration_min is None:
-            return {"status": "error", "message": "Missing nap index or duration."}, 400
+    @app.route('/api/naps/stop', methods=['POST'])
+    def stop_nap():
+        """Logs the end of a nap and triggers schedule adjustment logic."""
+        return _handle_write('nap_stop', request.json)
 
-        try:
-            new_duration_sec = int(new_duration_min) * 60
-        except (ValueError, TypeError):
-            return {"status": "error", "message": "Invalid duration format."}, 400
+    @app.route('/api/events/batch', methods=['POST'])
+    def ingest_batch():
+        """
+        Applies an ordered list of write events in a single transaction, for
+        clients replaying what they recorded while offline. Each event is the
+        JSON body of the matching single-event route plus "type" (one of
+        EVENT_TYPES) and a client-generated "idempotency_key":
 
-        if request_date:
-            try:
-                if 'T' in request_date:
-                    target_date = datetime.fromisoformat(request_date.replace('Z', '+00:00')).strftime('%Y-%m-%d')
-                else:
-                    target_date = request_date.strip()
-            except ValueError:
-                return {"status": "error", "message": "Invalid date format."}, 400
-        else:
-            target_date = datetime.now().strftime('%Y-%m-%d')
+            {"events": [{"idempotency_key": "...", "type": "nap_stop", "index": 1, "timestamp": "..."}]}
 
-        conn = get_db_connection()
+        Every event gets its own result. An event that fails is rolled back on
+        its own without affecting the rest. Successful results are stored by
+        key, so replaying a batch returns them again instead of re-applying.
+        """
+        tenant_id = current_tenant()
+        data = request.json or {}
+        events = data.get('events')
+        max_events = app.config.get('BATCH_MAX_EVENTS', 500)
+        if not isinstance(events, list) or not events:
+            return {"status": "error", "message": "Expected a non-empty 'events' list."}, 400
+        if len(events) > max_events:
+            return {"status": "error", "message": f"A batch may contain at most {max_events} events."}, 400
+
+        results = [None] * len(events)
+        parsed = []
+        for position, item in enumerate(events):
+            key = item.get('idempotency_key') if isinstance(item, dict) else None
+            if not key or not isinstance(key, str):
+                results[position] = {"idempotency_key": key, "status": "error", "code": 400,
+                                     "message": "Missing idempotency_key."}
+                continue
+            try:
+                parsed.append((position, key, parse_event(item.get('type'), item, tenant_id)))
+            except EventError as e:
+                results[position] = {"idempotency_key": key, "status": "error", "code": e.status,
+                                     "message": e.message}
+
+        # A wake later in the batch re-seeds its day, so adjusting that day's
+        # schedule for an earlier nap_stop would be wasted work.
+        reseeded_after = {}
+        for position, _, event in parsed:
+            if event['type'] == 'wake':
+                reseeded_after[event['date']] = position
+
+        changed = set()
+        conn = None
         try:
+            conn = get_db_connection()
             with conn:
-                day_row = conn.execute('SELECT id FROM days WHERE date = ?', (target_date,)).fetchone()
-                if not day_row:
-                    return {"status": "error", "message": "Day not started."}, 404
-                day_id = day_row['id']
-
-                # find the nap + its status
-                nap_row = conn.execute(
-                    'SELECT id, status FROM nap_slots WHERE day_id = ? AND nap_index = ?',
-                    (day_id, nap_index)
-                ).fetchone()
-                if not nap_row:
-                    return {"status": "error", "message": f"Nap with index {nap_index} not found."}, 404
-
-                status = nap_row['status']
-                if status == 'in_progress':
-                    # live nap: set adjusted (do not rewrite planned)
-                    cursor = conn.execute(
-                        'UPDATE nap_slots SET adjusted_duration_sec = ? WHERE id = ?',
-                        (new_duration_sec, nap_row['id'])
-                    )
-                elif status == 'upcoming':
-                    # future plan: rewrite planned and clear any prior adjustment
-                    cursor = conn.execute(
-                        'UPDATE nap_slots SET planned_duration_sec = ?, adjusted_duration_sec = NULL WHERE id = ?',
-                        (new_duration_sec, nap_row['id'])
+                conn.execute('BEGIN IMMEDIATE')
+                for position, key, event in parsed:
+                    stored = conn.execute(
+                        'SELECT response FROM processed_events WHERE tenant_id = ? AND idempotency_key = ?',
+                        (tenant_id, key)
+                    ).fetchone()
+                    if stored:
+                        results[position] = {**json.loads(stored['response']), "replayed": True}
+                        continue
+
+                    adjust = reseeded_after.get(event['date'], -1) < position
+                    conn.execute('SAVEPOINT batch_event')
+                    try:
+                        message = apply_event(conn, event, adjust=adjust)
+                    except EventError as e:
+                        conn.execute('ROLLBACK TO batch_event')
+                        conn.execute('RELEASE batch_event')
+                        results[position] = {"idempotency_key": key, "status": "error", "code": e.status,
+                                             "message": e.message}
+                        continue
+                    conn.execute('RELEASE batch_event')
+
+                    result = {"idempotency_key": key, "status": "success", "code": 200, "message": message}
+                    conn.execute(
+                        'INSERT INTO processed_events (tenant_id, idempotency_key, event_type, response, processed_at) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        (tenant_id, key, event['type'], json.dumps(result), datetime.now().isoformat())
                     )
-                else:
-                    return {"status": "error",
-                            "message": f"Upcoming or in-progress nap with index {nap_index} not found or cannot be edited."}, 404
-
-                if cursor.rowcount == 0:
-                    return {"status": "error", "message": "No rows updated."}, 400
-
-            return {"status": "success", "message": f"Nap {nap_index} duration updated."}
+                    results[position] = result
+                    changed.add(changed_date(event))
         except sqlite3.Error as e:
-            current_app.logger.error(f"Database error in update_nap: {e}")
-            return {"status": "error", "message": "Failed to update nap."}, 500
+            app.logger.error(f"Database error in ingest_batch: {e}")
+            return {"status": "error", "message": "Failed to apply event batch."}, 500
         finally:
             if conn:
                 conn.close()
 
-    @app.route('/api/naps/stop', methods=['POST'])
-    def stop_nap():
-        """Logs the end of a nap and triggers schedule adjustment logic."""
-        data = request.json
-        nap_index = data.get('index')
-        timestamp = data.get('timestamp')
-
-        if not all([nap_index, timestamp]):
-            return {"status": "error", "message": "Missing nap index or timestamp."}, 400
+        if None in changed:
+            _notify_day_changed(tenant_id)
+        else:
+            for date_str in changed:
+                _notify_day_changed(tenant_id, date_str)
+        return {"status": "success", "results": results}
 
-        today_str = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).strftime('%Y-%m-%d')
-        conn = get_db_connection()
+    @app.route('/api/export', methods=['GET'])
+    def export_history():
+        """
+        Streams the tenant's days, nap slots and sleep sessions, optionally
+        limited to ?from= and ?to= (YYYY-MM-DD, inclusive). ?format=ndjson (the
+        default) tags every line with its table; ?format=csv needs ?table=.
+        Rows are read in batches, so exports of any size use flat memory.
+        """
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in FORMATS:
+            return {"status": "error", "message": f"format must be one of {', '.join(FORMATS)}."}, 400
         try:
-            with conn:
-                day_row = conn.execute('SELECT id FROM days WHERE date = ?', (today_str,)).fetchone()
-                if not day_row:
-                    return {"status": "error", "message": "Day not started. Log morning wake time first."}, 404
-                day_id = day_row['id']
-
-                cursor = conn.execute('''
-                    UPDATE nap_slots
-                    SET actual_end_at = ?, status = 'finished'
-                    WHERE day_id = ? AND nap_index = ?
-                ''', (timestamp, day_id, nap_index))
+            tables = parse_tables(request.args.get('table'), export_format == 'csv')
+            from_date, to_date = parse_export_range(request.args.get('from'), request.args.get('to'))
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}, 400
+
+        tenant_id = current_tenant()
+        batch_size = app.config.get('EXPORT_BATCH_SIZE', 1000)
+        if export_format == 'csv':
+            mimetype, filename = 'text/csv', f"{tenant_id}-{tables[0]}.csv"
+        else:
+            mimetype, filename = 'application/x-ndjson', f"{tenant_id}-history.ndjson"
+        pool = get_pool(tenant_id)
 
-                if cursor.rowcount == 0:
-                    return {"status": "error", "message": f"Nap with index {nap_index} not found for today."}, 404
+        def generate():
+            # The connection is checked out only once the body is iterated
+            # (never for HEAD) and stays out until the last row is sent.
+            conn = None
+            try:
+                conn = pool.acquire()
+                if export_format == 'csv':
+                    yield from iter_csv(conn, tables[0], tenant_id, from_date, to_date, batch_size)
+                else:
+                    yield from iter_ndjson(conn, tables, tenant_id, from_date, to_date, batch_size)
+            except sqlite3.Error as e:
+                app.logger.error(f"Database error in export_history: {e}")
+            finally:
+                if conn:
+                    conn.close()
 
-                # adjust remaining schedule based on the finished nap
-                _adjust_schedule(conn, day_id, nap_index)
+        response = app.response_class(generate(), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.headers['Cache-Control'] = 'no-store'
+        return response
 
-            return {"status": "success", "message": f"Nap {nap_index} stop logged and schedule adjusted."}
+    @app.route('/api/import', methods=['POST'])
+    def import_history():
+        """
+        Imports an export into the tenant. The body is NDJSON (the default) or,
+        with ?format=csv&table=, one table as CSV. It is read as a stream and
+        written IMPORT_CHUNK_SIZE records per transaction. Days and naps are
+        upserted and known sleep sessions skipped, so an import can be re-run.
+        """
+        import_format = request.args.get('format', 'ndjson')
+        table = request.args.get('table')
+        if import_format not in FORMATS:
+            return {"status": "error", "message": f"format must be one of {', '.join(FORMATS)}."}, 400
+        if import_format == 'csv' and table not in TABLES:
+            return {"status": "error", "message": f"CSV imports need table= ({', '.join(TABLES)})."}, 400
+
+        tenant_id = current_tenant()
+        lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        records = read_csv(lines, table) if import_format == 'csv' else read_ndjson(lines)
+        chunks = []
+        conn = None
+        try:
+            conn = get_db_connection()
+            imported = import_records(
+                conn, tenant_id, records, app.config.get('IMPORT_CHUNK_SIZE', 5000),
+                progress=lambda counts, count: chunks.append(count),
+                alpha=app.config.get('NAP_STATS_ALPHA', 0.3),
+            )
+        except ValueError as e:
+            if chunks:
+                _notify_day_changed(tenant_id)
+            return {"status": "error", "message": str(e)}, 400
         except sqlite3.Error as e:
-            current_app.logger.error(f"Database error in stop_nap: {e}")
-            return {"status": "error", "message": "Failed to log nap stop."}, 500
+            app.logger.error(f"Database error in import_history: {e}")
+            return {"status": "error", "message": "Failed to import history."}, 500
         finally:
             if conn:
                 conn.close()
-            
+
+        _notify_day_changed(tenant_id)
+        return {"status": "success", "imported": imported, "chunks": len(chunks)}
+
     return app
 
 if __name__ == '__main__':
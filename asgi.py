@@ -0,0 +1,213 @@
+"""
+ASGI build of the API, for serving under an ASGI server:
+
+    uvicorn --factory package.asgi:create_asgi_app
+
+The routes are the Flask app from create_app(), so every request and response
+is exactly what the WSGI build produces. The event loop only does the network
+I/O: each request is dispatched on a bounded thread pool (ASGI_EXECUTOR_THREADS
+threads), which is also the most SQLite work that runs at once. Request
+bodies are read from the client as the route consumes them, so an import
+streams through without being held in memory. Streams from
+/api/day/stream are sent from the event loop and hold no thread while idle,
+so a process can keep many more of them open than a threaded WSGI server.
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from .app import ASYNC_STREAMS_ENVIRON_KEY, DAY_STREAM_ENVIRON_KEY, create_app
+
+
+class _RequestBody(io.RawIOBase):
+    """
+    The wsgi.input of an ASGI request. Each read on the app's thread fetches
+    the next http.request message from receive() on the event loop, so only
+    the chunk being read is held in memory. A disconnect ends the body early.
+    """
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._pending = memoryview(b'')
+        self._more_body = True
+        self.disconnected = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending and self._more_body:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                self.disconnected = True
+                self._more_body = False
+            else:
+                self._pending = memoryview(message.get('body', b''))
+                self._more_body = message.get('more_body', False)
+        count = min(len(buffer), len(self._pending))
+        buffer[:count] = self._pending[:count]
+        self._pending = self._pending[count:]
+        return count
+
+
+def _environ(scope, body):
+    """Builds the WSGI environ of an ASGI HTTP request; body is its _RequestBody."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        # WSGI carries the raw path bytes as latin-1 text.
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BufferedReader(body),
+        # The stream ends with the last body message, so chunked uploads are read too.
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        ASYNC_STREAMS_ENVIRON_KEY: True,
+    }
+    for raw_name, raw_value in scope.get('headers', ()):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+            continue
+        key = f'HTTP_{name}'
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call_wsgi(app, environ):
+    """Runs the Flask app on a pool thread; returns (status, headers, body iterable)."""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+    body = app(environ, start_response)
+    return started['status'], started['headers'], body
+
+
+def _next_chunk(iterator):
+    # StopIteration cannot cross an executor future, so the end is signalled with None.
+    return next(iterator, None)
+
+
+class AsgiApp:
+    """An ASGI 3 application serving a Flask app from a thread pool."""
+
+    def __init__(self, app, max_workers=32):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await asyncio.get_running_loop().run_in_executor(None, self.close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def close(self):
+        """Finishes queued writes and closes the pooled connections."""
+        self.executor.shutdown(wait=True)
+        for write_queue in self.app.extensions.get('write_queues') or ():
+            write_queue.close()
+        for pool in self.app.extensions['db_pools']:
+            pool.close_all()
+
+    async def _http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        body = _RequestBody(receive, loop)
+        environ = _environ(scope, body)
+        status, headers, response_body = await loop.run_in_executor(
+            self.executor, _call_wsgi, self.app, environ)
+        if body.disconnected:
+            # The client left mid-upload; there is no one to answer.
+            if hasattr(response_body, 'close'):
+                await loop.run_in_executor(self.executor, response_body.close)
+            return
+
+        day_stream = environ.get(DAY_STREAM_ENVIRON_KEY)
+        if day_stream is not None:
+            await loop.run_in_executor(self.executor, response_body.close)
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            await self._send_day_stream(receive, send, *day_stream)
+            return
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        iterator = iter(response_body)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.executor, _next_chunk, iterator)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            # Runs the response's close callbacks, such as returning an export's connection.
+            if hasattr(response_body, 'close'):
+                await loop.run_in_executor(self.executor, response_body.close)
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    async def _send_day_stream(self, receive, send, subscription, first_message, heartbeat_sec):
+        """Sends a /api/day/stream subscription's events until the client disconnects."""
+        loop = asyncio.get_running_loop()
+        arrived = asyncio.Event()
+        subscription.notify_with(lambda: loop.call_soon_threadsafe(arrived.set))
+        disconnected = asyncio.ensure_future(self._wait_for_disconnect(receive))
+        try:
+            await send({'type': 'http.response.body', 'body': first_message.encode('utf-8'), 'more_body': True})
+            while not disconnected.done():
+                waiter = asyncio.ensure_future(arrived.wait())
+                await asyncio.wait((waiter, disconnected), timeout=heartbeat_sec,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if disconnected.done():
+                    break
+                arrived.clear()
+                messages = []
+                while True:
+                    message = subscription.get_nowait()
+                    if message is None:
+                        break
+                    messages.append(message)
+                # A comment line keeps proxies from closing an idle stream.
+                text = ''.join(messages) or ': keepalive\n\n'
+                await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+        except OSError:
+            # Some servers raise on a send after the client has gone.
+            pass
+        finally:
+            disconnected.cancel()
+            subscription.close()
+
+    async def _wait_for_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+
+def create_asgi_app(test_config=None):
+    """Application factory for the ASGI build; takes the same test_config as create_app()."""
+    app = create_app(test_config)
+    return AsgiApp(app, max_workers=app.config.get('ASGI_EXECUTOR_THREADS', 32))
@@ -0,0 +1,263 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import AppGroup
+
+# Static asset pipeline. `flask assets build` minifies the page's script and
+# stylesheet, names each copy after a hash of its content, precompresses it
+# and records the names in a manifest. Templates link assets with
+# asset_url(), which points at the hashed copy served from /assets/ with a
+# one-year immutable Cache-Control, or at the plain /static/ file when no
+# build exists. A changed file gets a new name, so clients never revalidate.
+
+ASSET_SOURCES = ('js/script.js', 'css/style.css')
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Content-Encoding -> suffix of the precompressed copy, most preferred first.
+_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# A '/' after one of these characters or keywords, or at the start of the
+# source, opens a regex literal; anywhere else it is a division.
+_REGEX_AFTER_CHARS = frozenset('(,=:[!&|?{;+-*%<>~^')
+_REGEX_AFTER_WORDS = frozenset(('return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void',
+                                'throw', 'case', 'do', 'else', 'yield', 'await'))
+_TRAILING_WORD = re.compile(r'[A-Za-z_$][\w$]*$')
+
+
+def _slash_starts_regex(before):
+    """
+    Whether a '/' that follows the text before starts a regex literal. None
+    when that cannot be told without parsing: after '}' it may be either.
+    """
+    before = before.rstrip()
+    if not before or before[-1] in _REGEX_AFTER_CHARS:
+        return True
+    if before[-1] == '}':
+        return None
+    word = _TRAILING_WORD.search(before)
+    return word is not None and word.group() in _REGEX_AFTER_WORDS
+
+
+def _regex_end(source, position):
+    """Index just past the regex literal opening at position, or None when it is unterminated."""
+    in_class = False
+    end = position + 1
+    while end < len(source):
+        char = source[end]
+        if char == '\\':
+            end += 1
+        elif char == '\n':
+            return None
+        elif char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            return end + 1
+        end += 1
+    return None
+
+def minify_js(source):
+    """
+    Conservatively minifies JavaScript: removes comments, indentation and
+    blank lines outside of string, template and regex literals. Line breaks
+    are kept, so automatic semicolon insertion behaves as before. When the
+    scan does not end cleanly, or a '/' could open either a regex or a
+    division, the source is returned unchanged.
+    """
+    out = []
+    line = []
+    position = 0
+    length = len(source)
+
+    def end_line():
+        text = ''.join(line).strip()
+        if text:
+            out.append(text)
+        line.clear()
+
+    while position < length:
+        char = source[position]
+        following = source[position + 1] if position + 1 < length else ''
+        if char in '\'"`':
+            end = position + 1
+            while end < length and source[end] != char:
+                if source[end] == '\\':
+                    end += 1
+                elif source[end] == '\n' and char != '`':
+                    return source
+                end += 1
+            if end >= length:
+                return source
+            line.append(source[position:end + 1])
+            position = end + 1
+        elif char == '/' and following == '/':
+            end = source.find('\n', position)
+            position = length if end == -1 else end
+        elif char == '/' and following == '*':
+            end = source.find('*/', position + 2)
+            if end == -1:
+                return source
+            # A comment between tokens still separates them.
+            line.append(' ')
+            position = end + 2
+        elif char == '/':
+            starts_regex = _slash_starts_regex(''.join(line).strip() or (out[-1] if out else ''))
+            if starts_regex is None:
+                return source
+            end = _regex_end(source, position) if starts_regex else position + 1
+            if end is None:
+                return source
+            line.append(source[position:end])
+            position = end
+        elif char == '\n':
+            end_line()
+            position += 1
+        else:
+            line.append(char)
+            position += 1
+    end_line()
+    return '\n'.join(out) + '\n'
+
+
+def minify_css(source):
+    """Removes comments and collapses whitespace, leaving selectors and values as written."""
+    text = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,])\s*', r'\1', text)
+    return text.strip() + ('\n' if text.strip() else '')
+
+
+_MINIFIERS = {'.js': minify_js, '.css': minify_css}
+
+
+def _compressors():
+    compressors = {'.gz': lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        compressors['.br'] = lambda data: brotli.compress(data, quality=11)
+    return compressors
+
+
+def build_assets(static_folder, sources=ASSET_SOURCES):
+    """
+    Writes the minified, hashed and precompressed copy of each source under
+    static_folder/dist and the manifest mapping source names to hashed
+    names. Brotli copies need the brotli package from requirements.txt;
+    without it only gzip copies are written. Returns the manifest.
+    """
+    dist = os.path.join(static_folder, DIST_DIR)
+    compressors = _compressors()
+    manifest = {}
+    for name in sources:
+        with open(os.path.join(static_folder, name), encoding='utf-8') as f:
+            source = f.read()
+        stem, extension = os.path.splitext(name)
+        data = _MINIFIERS.get(extension, lambda text: text)(source).encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        hashed = f"{stem}.{digest}{extension}"
+
+        path = os.path.join(dist, hashed)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        for suffix, compress in compressors.items():
+            with open(path + suffix, 'wb') as f:
+                f.write(compress(data))
+        manifest[name] = hashed
+
+    # Written last and renamed into place, so a running app never reads half a build.
+    manifest_path = os.path.join(dist, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+
+class AssetManifest:
+    """The build's manifest, reread whenever `flask assets build` replaces it."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._entries = {}
+
+    def get(self, name):
+        """The hashed name of a source asset, or None when it has not been built."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            if mtime != self._mtime:
+                try:
+                    with open(self.path) as f:
+                        self._entries = json.load(f)
+                except (OSError, ValueError):
+                    return None
+                self._mtime = mtime
+            return self._entries.get(name)
+
+
+def asset_url(name):
+    """URL of a static asset: its hashed build when there is one, else the plain static file."""
+    manifest = current_app.extensions.get('assets')
+    hashed = manifest.get(name) if manifest is not None else None
+    if hashed is None:
+        return url_for('static', filename=name)
+    return url_for('built_asset', filename=hashed)
+
+
+def init_assets(app):
+    """Registers the /assets/ route for built assets and the asset_url() template helper."""
+    dist = os.path.join(app.static_folder, DIST_DIR)
+    manifest = AssetManifest(os.path.join(dist, MANIFEST_NAME))
+    app.extensions['assets'] = manifest
+
+    @app.route('/assets/<path:filename>', methods=['GET'])
+    def built_asset(filename):
+        """
+        Serves a hashed build output, precompressed when the client accepts
+        it. The name changes with the content, so it may be cached forever.
+        """
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+        for candidate, suffix in _ENCODINGS:
+            if request.accept_encodings[candidate] > 0 and os.path.isfile(os.path.join(dist, filename + suffix)):
+                encoding, filename = candidate, filename + suffix
+                break
+        response = send_from_directory(dist, filename, mimetype=mimetype, max_age=31536000)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.jinja_env.globals['asset_url'] = asset_url
+    return manifest
+
+
+assets_cli = AppGroup('assets', help='Build the minified, hashed and precompressed static assets.')
+
+
+@assets_cli.command('build')
+def assets_build():
+    """Builds static/dist from the page's script and stylesheet."""
+    manifest = build_assets(current_app.static_folder)
+    for name, hashed in sorted(manifest.items()):
+        click.echo(f"{name} -> {DIST_DIR}/{hashed}")
+    if '.br' not in _compressors():
+        click.echo("brotli is not installed; only gzip copies were written (pip install brotli).")
@@ -0,0 +1,215 @@
+"""
+Side-by-side load test of the WSGI and ASGI builds.
+
+Runs the load_api family workload against create_app() driven through
+Flask's test client and against create_asgi_app() driven through its ASGI
+interface, with the same settings and seed. With --streams, that many
+/api/day/stream listeners stay open on the families' tenants during each
+run; the report then also shows how many threads each build needed and how
+many pushed events the listeners received. Run from the directory above the
+package:
+
+    python -m package.benchmarks.asgi_vs_wsgi --families 16 --concurrency 8 --streams 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from ..app import create_app
+from ..asgi import create_asgi_app
+from .load_api import InProcessClient, compare, print_report, run
+
+
+class AsgiClient:
+    """Drives an ASGI app in-process on an event loop running in a background thread."""
+
+    def __init__(self, asgi_app):
+        self.asgi_app = asgi_app
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='asgi-client', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    def _scope(self, method, path, tenant_id, headers):
+        path, _, query = path.partition('?')
+        headers = dict(headers or {}, **{'X-Tenant-ID': tenant_id})
+        return {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': method, 'scheme': 'http', 'path': path, 'root_path': '',
+            'query_string': query.encode('latin-1'),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()],
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+        }
+
+    async def _request(self, method, path, tenant_id, body, headers):
+        headers = dict(headers or {})
+        data = b''
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        scope = self._scope(method, path, tenant_id, headers)
+        received = [{'type': 'http.request', 'body': data, 'more_body': False}]
+        response = {}
+
+        async def receive():
+            return received.pop() if received else {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = dict(message['headers'])
+
+        await self.asgi_app(scope, receive, send)
+        etag = response['headers'].get(b'etag')
+        return response['status'], etag.decode('latin-1') if etag else None
+
+    def request(self, method, path, tenant_id, body=None, headers=None):
+        """Sends one request and returns (status, etag)."""
+        future = asyncio.run_coroutine_threadsafe(self._request(method, path, tenant_id, body, headers), self.loop)
+        return future.result()
+
+    async def _listen(self, tenant_id, stop, counter):
+        scope = self._scope('GET', '/api/day/stream', tenant_id, None)
+        sent_request = False
+
+        async def receive():
+            nonlocal sent_request
+            if not sent_request:
+                sent_request = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await stop.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.body' and message['body'].startswith(b'id:'):
+                counter[0] += message['body'].count(b'event: day')
+
+        await self.asgi_app(scope, receive, send)
+
+    def open_streams(self, tenant_ids):
+        """Opens one listener per tenant id; returns (close, received event count)."""
+        stop = asyncio.Event()
+        counter = [0]
+        tasks = [asyncio.run_coroutine_threadsafe(self._listen(tenant_id, stop, counter), self.loop)
+                 for tenant_id in tenant_ids]
+
+        def close():
+            self.loop.call_soon_threadsafe(stop.set)
+            for task in tasks:
+                task.result(timeout=10)
+            return counter[0]
+        return close
+
+
+def open_wsgi_streams(app, tenant_ids):
+    """Opens one listener per tenant id, each read by its own thread as a threaded WSGI server would."""
+    stop = threading.Event()
+    counter = [0]
+    lock = threading.Lock()
+    responses = []
+    threads = []
+
+    def listen(tenant_id):
+        response = app.test_client().get('/api/day/stream', headers={'X-Tenant-ID': tenant_id}, buffered=False)
+        responses.append(response)
+        for chunk in response.response:
+            if stop.is_set():
+                break
+            if chunk.startswith(b'id:'):
+                with lock:
+                    counter[0] += chunk.count(b'event: day')
+        response.close()
+
+    for tenant_id in tenant_ids:
+        thread = threading.Thread(target=listen, args=(tenant_id,), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    def close():
+        stop.set()
+        # Wakes each listener blocked on its subscription so it can see stop.
+        broker = app.extensions['day_broker']
+        for tenant_id in set(tenant_ids):
+            broker.publish(tenant_id, ': closing\n\n')
+        for thread in threads:
+            thread.join(timeout=10)
+        return counter[0]
+    return close
+
+
+def run_build(name, args, tmp):
+    config = {
+        'TESTING': True,
+        'DATABASE': os.path.join(tmp, f'{name}.db'),
+        'DB_POOL_SIZE': max(args.concurrency, 8),
+        'DAY_CACHE_ENABLED': True,
+        'STREAM_HEARTBEAT_SEC': 1,
+    }
+    tenants = [f"family-{number % args.families}" for number in range(args.streams)]
+    if name == 'asgi':
+        asgi_app = create_asgi_app(config)
+        client = AsgiClient(asgi_app)
+        close_streams = client.open_streams(tenants) if tenants else None
+    else:
+        app = create_app(config)
+        client = InProcessClient(app)
+        close_streams = open_wsgi_streams(app, tenants) if tenants else None
+
+    time.sleep(0.5 if tenants else 0)
+    peak_threads = threading.active_count()
+    report = run(client, args.families, args.concurrency, args.days, args.reads, args.seed)
+    peak_threads = max(peak_threads, threading.active_count())
+    report['streams'] = {
+        "listeners": args.streams,
+        "threads": peak_threads,
+        "events_received": close_streams() if close_streams else 0,
+    }
+    if name == 'asgi':
+        client.close()
+        asgi_app.close()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--families', type=int, default=16, help='Simulated households (tenants).')
+    parser.add_argument('--concurrency', type=int, default=8, help='Families replayed at once.')
+    parser.add_argument('--days', type=int, default=3, help='Days replayed per family, ending today.')
+    parser.add_argument('--reads', type=int, default=3, help='GET /api/day/today polls after each event.')
+    parser.add_argument('--streams', type=int, default=0, help='/api/day/stream listeners kept open during the run.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the event timings.')
+    parser.add_argument('--save', metavar='PATH', help='Write both reports as JSON.')
+    args = parser.parse_args(argv)
+
+    reports = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ('wsgi', 'asgi'):
+            print(f"== {name.upper()} ==")
+            reports[name] = run_build(name, args, tmp)
+            print_report(reports[name])
+            streams = reports[name]['streams']
+            if streams['listeners']:
+                print(f"{streams['listeners']} stream listeners: {streams['threads']} threads, "
+                      f"{streams['events_received']} events received")
+            print()
+
+    print("== WSGI -> ASGI ==", end='')
+    compare(reports['asgi'], reports['wsgi'], threshold=float('inf'))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(reports, f, indent=2)
+        print(f"\nReports saved to {args.save}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""
+Microbenchmarks for the pure schedule engine.
+
+Run from the directory above the package:
+
+    python -m package.benchmarks.bench_schedule
+"""
+import timeit
+
+from .. import schedule
+
+FIRST_WAKE_MS = 1_760_680_800_000
+
+
+def _day(nap_count, finished):
+    naps = []
+    cursor_ms = FIRST_WAKE_MS
+    for index in range(1, nap_count + 1):
+        nap = {
+            'nap_index': index,
+            'status': 'upcoming',
+            'planned_duration_sec': 45 * 60,
+            'adjusted_duration_sec': None,
+            'actual_start_ms': None,
+            'actual_end_ms': None,
+        }
+        if index <= finished:
+            cursor_ms += 2 * 60 * 60 * 1000
+            nap.update(status='finished', actual_start_ms=cursor_ms, actual_end_ms=cursor_ms + 50 * 60 * 1000)
+            cursor_ms += 50 * 60 * 1000
+        naps.append(nap)
+    return naps
+
+
+def main(number=20000):
+    cases = {
+        "project_day (3 naps)": lambda naps=_day(3, 1): schedule.project_day(FIRST_WAKE_MS, naps),
+        "plan_day after nap 1 (3 naps)": lambda naps=_day(3, 1): schedule.plan_day(FIRST_WAKE_MS, naps, 1),
+        "plan_day after nap 3 (6 naps)": lambda naps=_day(6, 3): schedule.plan_day(FIRST_WAKE_MS, naps, 3),
+    }
+    for name, case in cases.items():
+        seconds = timeit.timeit(case, number=number)
+        print(f"{name:32s} {seconds / number * 1e6:8.2f} us/call")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Load test for the HTTP API: concurrent families replaying realistic days.
+
+Each simulated family is its own tenant. Its days run bedtime, the morning
+wake-up and three naps (start, sometimes an update, stop), with
+GET /api/day/today polled between events the way the page does. Families run
+on a thread pool, so --concurrency families hit the app at once.
+
+By default the app is built with create_app() against a temporary database and
+driven in-process through Flask's test client; --url drives a running server
+instead. Run from the directory above the package:
+
+    python -m package.benchmarks.load_api --families 16 --concurrency 8
+    python -m package.benchmarks.load_api --save baseline.json
+    python -m package.benchmarks.load_api --compare baseline.json
+    python -m package.benchmarks.load_api --write-mode queue --compare baseline.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from ..app import create_app
+
+# Endpoints a regression is reported for when comparing against a baseline.
+WATCHED_ENDPOINTS = ('get_today', 'stop_nap', 'log_bedtime')
+
+
+class InProcessClient:
+    """Drives the app through Flask's test client, one client per thread."""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, tenant_id, body=None, headers=None):
+        """Sends one request and returns (status, etag)."""
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        headers = dict(headers or {}, **{'X-Tenant-ID': tenant_id})
+        response = client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.headers.get('ETag')
+
+
+class HttpClient:
+    """Drives a running server over HTTP with urllib."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, tenant_id, body=None, headers=None):
+        headers = dict(headers or {}, **{'X-Tenant-ID': tenant_id})
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status, response.headers.get('ETag')
+        except urllib.error.HTTPError as e:
+            # urllib reports 304 and every error status as an exception.
+            return e.code, e.headers.get('ETag')
+
+
+def _timestamp(day, hour, minute):
+    return f"{day.isoformat()}T{hour:02d}:{minute:02d}:00.000Z"
+
+
+def family_script(days, reads_per_event, rng):
+    """
+    The requests of one family over the given dates, as (endpoint, method,
+    path, body) tuples. `None` in the body slot of a read means GET.
+    """
+    steps = []
+
+    def reads():
+        for _ in range(reads_per_event):
+            steps.append(('get_today', 'GET', '/api/day/today', None))
+
+    for day in days:
+        evening = day - timedelta(days=1)
+        steps.append(('log_bedtime', 'POST', '/api/day/bedtime',
+                      {'type': 'sleep', 'timestamp': _timestamp(evening, 19, rng.randint(0, 59))}))
+        steps.append(('log_bedtime', 'POST', '/api/day/bedtime',
+                      {'type': 'wake', 'timestamp': _timestamp(day, 6, rng.randint(0, 59))}))
+        reads()
+        hour = 8
+        for nap_index in (1, 2, 3):
+            steps.append(('start_nap', 'POST', '/api/naps/start',
+                          {'index': nap_index, 'timestamp': _timestamp(day, hour, rng.randint(0, 29))}))
+            reads()
+            if rng.random() < 0.3:
+                steps.append(('update_nap', 'POST', '/api/naps/update',
+                              {'index': nap_index, 'duration_min': rng.choice((30, 45, 60)),
+                               'date': day.isoformat()}))
+            steps.append(('stop_nap', 'POST', '/api/naps/stop',
+                          {'index': nap_index, 'timestamp': _timestamp(day, hour + 1, rng.randint(0, 59))}))
+            reads()
+            hour += 3
+    return steps
+
+
+def run_family(client, tenant_id, steps):
+    """Replays one family's steps in order; returns [(endpoint, seconds, status)]."""
+    samples = []
+    etag = None
+    for endpoint, method, path, body in steps:
+        headers = {'If-None-Match': etag} if endpoint == 'get_today' and etag else None
+        started = time.perf_counter()
+        status, response_etag = client.request(method, path, tenant_id, body, headers)
+        samples.append((endpoint, time.perf_counter() - started, status))
+        if endpoint == 'get_today' and response_etag:
+            etag = response_etag
+    return samples
+
+
+def _percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples, wall_sec):
+    """Per-endpoint request counts, errors, throughput and latency percentiles."""
+    by_endpoint = {}
+    for endpoint, seconds, status in samples:
+        by_endpoint.setdefault(endpoint, []).append((seconds, status))
+
+    endpoints = {}
+    for endpoint, values in sorted(by_endpoint.items()):
+        latencies = sorted(seconds * 1000 for seconds, _ in values)
+        endpoints[endpoint] = {
+            "requests": len(values),
+            "errors": sum(1 for _, status in values if status >= 400),
+            "not_modified": sum(1 for _, status in values if status == 304),
+            "rps": len(values) / wall_sec,
+            "p50_ms": _percentile(latencies, 0.50),
+            "p95_ms": _percentile(latencies, 0.95),
+            "p99_ms": _percentile(latencies, 0.99),
+        }
+    return {
+        "requests": len(samples),
+        "wall_sec": wall_sec,
+        "rps": len(samples) / wall_sec,
+        "endpoints": endpoints,
+    }
+
+
+def run(client, families, concurrency, days, reads_per_event, seed):
+    today = date.today()
+    day_list = [today - timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+    rng = random.Random(seed)
+    scripts = {f"family-{number}": family_script(day_list, reads_per_event, rng) for number in range(families)}
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda item: run_family(client, *item), scripts.items()))
+    wall_sec = time.perf_counter() - started
+    return summarize([sample for samples in results for sample in samples], wall_sec)
+
+
+def print_report(report):
+    print(f"{report['requests']} requests in {report['wall_sec']:.2f}s ({report['rps']:.0f} req/s)")
+    print(f"{'endpoint':<12} {'requests':>8} {'errors':>6} {'304':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, stats in report['endpoints'].items():
+        print(f"{endpoint:<12} {stats['requests']:>8} {stats['errors']:>6} {stats['not_modified']:>6} "
+              f"{stats['rps']:>8.0f} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+
+
+def compare(report, baseline, threshold, watched=WATCHED_ENDPOINTS):
+    """
+    Prints each endpoint's p50/p95/p99 and throughput against the baseline.
+    Returns the watched endpoints whose p95 grew, or whose throughput fell,
+    by more than threshold (a fraction).
+    """
+    regressions = []
+    print(f"\n{'endpoint':<12} {'p50':>16} {'p95':>16} {'p99':>16} {'req/s':>14}  (baseline -> now)")
+    for endpoint, stats in report['endpoints'].items():
+        before = baseline['endpoints'].get(endpoint)
+        if before is None:
+            print(f"{endpoint:<12} (not in baseline)")
+            continue
+        columns = [f"{before[key]:.2f}->{stats[key]:.2f}" for key in ('p50_ms', 'p95_ms', 'p99_ms')]
+        print(f"{endpoint:<12} {columns[0]:>16} {columns[1]:>16} {columns[2]:>16} "
+              f"{before['rps']:>6.0f}->{stats['rps']:<6.0f}")
+        slower = stats['p95_ms'] > before['p95_ms'] * (1 + threshold)
+        fewer = stats['rps'] < before['rps'] * (1 - threshold)
+        if endpoint in watched and (slower or fewer):
+            regressions.append(endpoint)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--families', type=int, default=16, help='Simulated households (tenants).')
+    parser.add_argument('--concurrency', type=int, default=8, help='Families replayed at once.')
+    parser.add_argument('--days', type=int, default=3, help='Days replayed per family, ending today.')
+    parser.add_argument('--reads', type=int, default=3, help='GET /api/day/today polls after each event.')
+    parser.add_argument('--shards', type=int, default=1, help='DB_SHARD_COUNT of the in-process app.')
+    parser.add_argument('--write-mode', choices=('direct', 'queue'), default='direct',
+                        help='WRITE_MODE of the in-process app.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the event timings.')
+    parser.add_argument('--url', help='Drive a running server at this base URL instead of an in-process app.')
+    parser.add_argument('--save', metavar='PATH', help='Write the report as a JSON baseline.')
+    parser.add_argument('--compare', metavar='PATH', help='Compare against a saved JSON baseline.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed p95/throughput regression as a fraction (default 0.2).')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.url:
+            client = HttpClient(args.url)
+        else:
+            app = create_app({
+                'TESTING': True,
+                'DATABASE': os.path.join(tmp, 'load.db'),
+                'DB_SHARD_COUNT': args.shards,
+                'DB_POOL_SIZE': max(args.concurrency, 8),
+                'WRITE_MODE': args.write_mode,
+                # One process serves every request, so its day cache is safe to use.
+                'DAY_CACHE_ENABLED': True,
+            })
+            client = InProcessClient(app)
+        report = run(client, args.families, args.concurrency, args.days, args.reads, args.seed)
+
+    report['config'] = {key: getattr(args, key) for key in ('families', 'concurrency', 'days', 'reads', 'shards', 'write_mode', 'seed', 'url')}
+    print_report(report)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != report['config']:
+            print("\nNote: the baseline was recorded with different settings.")
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressed beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
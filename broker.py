@@ -0,0 +1,135 @@
+import queue
+import threading
+
+from flask import current_app
+
+
+class Subscription:
+    """One listener's queue of pending events."""
+
+    def __init__(self, broker, topic, max_pending):
+        self._broker = broker
+        self.topic = topic
+        self._queue = queue.Queue(maxsize=max_pending)
+        # Publishers offer under this lock, so between one making room and
+        # queueing its event another cannot fill the slot.
+        self._offer_lock = threading.Lock()
+        self._notify = None
+
+    def get(self, timeout=None):
+        """Waits for the next event; returns None when timeout passes first."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def get_nowait(self):
+        """The next pending event, or None."""
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def notify_with(self, callback):
+        """
+        Has the publishing thread call callback after queueing each event,
+        for listeners that wait on an event loop rather than in get().
+        """
+        self._notify = callback
+        if not self._queue.empty():
+            callback()
+
+    def _offer(self, event):
+        with self._offer_lock:
+            try:
+                self._queue.put_nowait(event)
+                delivered = True
+            except queue.Full:
+                # A slow listener only needs the latest state: drop its oldest event.
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self._queue.put_nowait(event)
+                delivered = False
+        if self._notify is not None:
+            self._notify()
+        return delivered
+
+    def close(self):
+        self._broker.unsubscribe(self)
+
+
+class EventBroker:
+    """
+    Fans events out to every subscriber of a topic (a tenant) in this process.
+    Publishing never blocks: each subscriber has a small bounded queue and
+    loses its oldest events if it falls behind.
+    """
+
+    def __init__(self, max_pending=16):
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._topics = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, topic):
+        subscription = Subscription(self, topic, self.max_pending)
+        with self._lock:
+            self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._topics.get(subscription.topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._topics[subscription.topic]
+
+    def subscriber_count(self, topic):
+        with self._lock:
+            return len(self._topics.get(topic, ()))
+
+    def publish(self, topic, event):
+        """Delivers event to every current subscriber of topic and returns how many there were."""
+        with self._lock:
+            subscribers = list(self._topics.get(topic, ()))
+            self.published += 1
+        for subscription in subscribers:
+            if not subscription._offer(event):
+                with self._lock:
+                    self.dropped += 1
+        return len(subscribers)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "topics": len(self._topics),
+                "subscribers": sum(len(subscribers) for subscribers in self._topics.values()),
+                "published": self.published,
+                "dropped": self.dropped,
+            }
+
+
+def init_broker(app):
+    broker = EventBroker(max_pending=app.config.get('STREAM_MAX_PENDING_EVENTS', 16))
+    app.extensions['day_broker'] = broker
+    return broker
+
+
+def get_broker():
+    return current_app.extensions['day_broker']
+
+
+def format_sse(data, event=None, event_id=None):
+    """Formats one Server-Sent Events message; multi-line data gets one data: field per line."""
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    for line in data.splitlines() or ['']:
+        lines.append(f"data: {line}")
+    return "\n".join(lines) + "\n\n"
@@ -0,0 +1,116 @@
+import secrets
+import threading
+
+from flask import current_app
+
+
+class DayCache:
+    """
+    In-process cache of serialized day documents, keyed by tenant and date.
+
+    Every tenant's date has a version counter that write endpoints bump after they
+    commit. A cached document is only served while its version matches the
+    current one, and the version is part of the ETag, so a client holding the
+    current ETag can be answered with 304 without reading SQLite.
+
+    The cache lives in one process: when running several workers, each keeps
+    its own copy and only sees the writes it handled itself.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        # Random per-process prefix so ETags issued before a restart never match.
+        self._token = secrets.token_hex(4)
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._generations = {}
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+
+    def version(self, tenant_id, date_str):
+        """The current version of a date's document."""
+        with self._lock:
+            return self._current_version(tenant_id, date_str)
+
+    def _current_version(self, tenant_id, date_str):
+        # The generation is bumped by writes that touch every day (sleep sessions).
+        generation = self._generations.get(tenant_id, 0)
+        return f"{generation}.{self._versions.get((tenant_id, date_str), 0)}"
+
+    def etag(self, tenant_id, date_str, version=None):
+        if version is None:
+            version = self.version(tenant_id, date_str)
+        return f"{self._token}-{tenant_id}-{date_str}-{version}"
+
+    def is_current(self, tenant_id, date_str, etag):
+        """True when etag matches the latest version of the date's document."""
+        current = self.etag(tenant_id, date_str)
+        with self._lock:
+            if etag == current:
+                self.not_modified += 1
+                return True
+            return False
+
+    def get(self, tenant_id, date_str):
+        """Returns (etag, body) for a current cached document, or None."""
+        with self._lock:
+            entry = self._entries.get((tenant_id, date_str))
+            if entry and entry[0] == self._current_version(tenant_id, date_str):
+                self.hits += 1
+                return self.etag(tenant_id, date_str, entry[0]), entry[1]
+            self.misses += 1
+            return None
+
+    def store(self, tenant_id, date_str, version, body):
+        """
+        Caches body as the tenant's document for date_str at version. `version` must be
+        read before the document was loaded, so a write that lands in between
+        leaves the entry stale rather than serving old data as new.
+        """
+        key = (tenant_id, date_str)
+        with self._lock:
+            if version != self._current_version(tenant_id, date_str):
+                return
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (version, body)
+
+    def invalidate(self, tenant_id, date_str):
+        """Bumps the version of one date's document."""
+        key = (tenant_id, date_str)
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._entries.pop(key, None)
+            self.invalidations += 1
+
+    def invalidate_all(self, tenant_id):
+        """Bumps the version of every date's document of a tenant."""
+        with self._lock:
+            self._generations[tenant_id] = self._generations.get(tenant_id, 0) + 1
+            for key in [key for key in self._entries if key[0] == tenant_id]:
+                del self._entries[key]
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "invalidations": self.invalidations,
+            }
+
+
+def init_day_cache(app):
+    cache = DayCache(max_entries=app.config.get('DAY_CACHE_MAX_ENTRIES', 1024))
+    app.extensions['day_cache'] = cache
+    return cache
+
+
+def get_day_cache():
+    """Returns the current app's day cache, or None when caching is disabled."""
+    return current_app.extensions.get('day_cache')
@@ -19,4 +19,85 @@ class Config:
 
     # Define the database file. It's good practice to store this in the
     # instance folder, which is not part of the version-controlled code.
-    DATABASE = 'nap_plans.db'
\ No newline at end of file
+    DATABASE = 'nap_plans.db'
+
+    # SQLite connection pool. Each worker keeps up to DB_POOL_SIZE connections
+    # open and reuses them across requests instead of reconnecting every time.
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+    # How long a request waits for a free connection before failing.
+    DB_POOL_TIMEOUT_SEC = float(os.environ.get('DB_POOL_TIMEOUT_SEC', 5.0))
+    # How long SQLite waits on a locked database before raising "database is locked".
+    DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+    # Number of prepared statements each connection keeps cached.
+    DB_STATEMENT_CACHE_SIZE = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 256))
+
+    # Cache serialized day documents in memory and answer GET /api/day/today
+    # revalidations with 304. Each worker process keeps its own cache and only
+    # sees the writes it handled itself, so with several workers one could
+    # answer 304 for a document another has changed. Off by default; only
+    # enable this when a single process serves the database.
+    DAY_CACHE_ENABLED = os.environ.get('DAY_CACHE_ENABLED', '0') == '1'
+    DAY_CACHE_MAX_ENTRIES = int(os.environ.get('DAY_CACHE_MAX_ENTRIES', 1024))
+
+    # Server-Sent Events stream (/api/day/stream). A keepalive comment is sent
+    # after this many idle seconds; slow listeners keep at most this many events.
+    STREAM_HEARTBEAT_SEC = int(os.environ.get('STREAM_HEARTBEAT_SEC', 15))
+    STREAM_MAX_PENDING_EVENTS = int(os.environ.get('STREAM_MAX_PENDING_EVENTS', 16))
+
+    # Upper bound on the number of events accepted by /api/events/batch.
+    BATCH_MAX_EVENTS = int(os.environ.get('BATCH_MAX_EVENTS', 500))
+
+    # Awake time in minutes before nap 1, 2, 3 and before bedtime, used to
+    # project nap start times and days.projected_bedtime_at.
+    WAKE_WINDOWS_MIN = (120, 150, 150, 180)
+
+    # Data-driven nap plans. Each finished nap updates an exponentially
+    # weighted mean of that nap slot's duration and preceding wake window
+    # (NAP_STATS_ALPHA is the newest nap's weight). Once a slot has
+    # NAP_PLAN_MIN_SAMPLES naps, new days are seeded from it; until then they
+    # use DEFAULT_NAP_PLAN_MIN and WAKE_WINDOWS_MIN. Score alternatives with
+    # `flask plans evaluate` and apply a new alpha with `flask plans rebuild-stats`.
+    DEFAULT_NAP_PLAN_MIN = (45, 60, 30)
+    NAP_STATS_ALPHA = float(os.environ.get('NAP_STATS_ALPHA', 0.3))
+    NAP_PLAN_MIN_SAMPLES = int(os.environ.get('NAP_PLAN_MIN_SAMPLES', 3))
+
+    # Multi-household tenancy. Requests pick a tenant with the X-Tenant-ID
+    # header or ?tenant=; requests without one use DEFAULT_TENANT. Tenants are
+    # spread over DB_SHARD_COUNT SQLite files by a stable hash of their id.
+    # Change the shard count only together with `flask shards rebalance`.
+    DEFAULT_TENANT = os.environ.get('DEFAULT_TENANT', 'default')
+    DB_SHARD_COUNT = int(os.environ.get('DB_SHARD_COUNT', 1))
+
+    # Longest date range, in days, that /api/history may be asked for.
+    HISTORY_MAX_DAYS = int(os.environ.get('HISTORY_MAX_DAYS', 366))
+
+    # Per-route request and SQL metrics, served in Prometheus format at /metrics.
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    # Log every SQL statement slower than this many milliseconds as a warning;
+    # 0 turns the slow-query log off.
+    SLOW_QUERY_LOG_MS = float(os.environ.get('SLOW_QUERY_LOG_MS', 0))
+
+    # Bulk history transfer (/api/export, /api/import, `flask history`).
+    # Exports fetch EXPORT_BATCH_SIZE rows at a time; imports write
+    # IMPORT_CHUNK_SIZE records per transaction.
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 5000))
+
+    # How the single-event write endpoints reach SQLite. 'direct' applies each
+    # write on the request thread in its own transaction. 'queue' hands it to
+    # one writer thread per shard, which commits whatever arrived within
+    # WRITE_GROUP_COMMIT_MS (at most WRITE_BATCH_MAX writes) as one transaction.
+    # The queue serializes writers within a process; run a single process
+    # with threads (e.g. gunicorn --workers 1 --threads 16) to get one writer.
+    WRITE_MODE = os.environ.get('WRITE_MODE', 'direct')
+    WRITE_GROUP_COMMIT_MS = float(os.environ.get('WRITE_GROUP_COMMIT_MS', 2))
+    WRITE_BATCH_MAX = int(os.environ.get('WRITE_BATCH_MAX', 64))
+    WRITE_QUEUE_TIMEOUT_SEC = float(os.environ.get('WRITE_QUEUE_TIMEOUT_SEC', 10.0))
+
+    # ASGI build (asgi.py). Requests run on a pool of this many threads; open
+    # /api/day/stream listeners are served by the event loop and need none.
+    ASGI_EXECUTOR_THREADS = int(os.environ.get('ASGI_EXECUTOR_THREADS', 32))
+
+    # Paging of /api/days: days per page by default, and the largest ?limit=.
+    DAYS_PAGE_SIZE = int(os.environ.get('DAYS_PAGE_SIZE', 31))
+    DAYS_PAGE_MAX = int(os.environ.get('DAYS_PAGE_MAX', 92))
\ No newline at end of file
@@ -0,0 +1,266 @@
+import queue
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+
+from .metrics import current_query_stats
+from .shards import shard_index
+
+# Sleeps (ms) of SQLite's busy handler between attempts to take a lock; after
+# the last one it keeps retrying every 100 ms until busy_timeout runs out.
+_BUSY_DELAYS_MS = (1, 2, 5, 10, 15, 20, 25, 25, 25, 50, 50, 100)
+
+
+def busy_retries(waited_sec):
+    """
+    How many times SQLite's busy handler must have retried a lock for a
+    statement to take waited_sec. Python cannot hook the handler itself, but
+    its backoff schedule is fixed, so the count follows from the wait.
+    """
+    waited_ms = waited_sec * 1000
+    retries = 0
+    for delay_ms in _BUSY_DELAYS_MS:
+        if waited_ms < delay_ms:
+            return retries
+        waited_ms -= delay_ms
+        retries += 1
+    return retries + int(waited_ms // _BUSY_DELAYS_MS[-1])
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    A sqlite3 connection that belongs to a ConnectionPool.
+    Calling close() hands the connection back to its pool instead of closing
+    it, so route handlers can keep their usual try/finally conn.close() shape.
+    """
+    pool = None
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            cursor = super().execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            self._record(sql, started, 0, e)
+            raise
+        self._record(sql, started, cursor.rowcount)
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            cursor = super().executemany(sql, seq_of_parameters)
+        except sqlite3.OperationalError as e:
+            self._record(sql, started, 0, e)
+            raise
+        self._record(sql, started, cursor.rowcount)
+        return cursor
+
+    def commit(self):
+        started = time.perf_counter()
+        super().commit()
+        self._record('COMMIT', started, 0)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # `with conn:` commits in C without going through commit() above.
+        started = time.perf_counter()
+        try:
+            return super().__exit__(exc_type, exc_value, traceback)
+        finally:
+            if exc_type is None:
+                self._record('COMMIT', started, 0)
+
+    def _record(self, sql, started, rowcount, error=None):
+        """Adds a finished statement to the current request's stats and the slow-query log."""
+        elapsed = time.perf_counter() - started
+        stats = current_query_stats()
+        if stats is not None:
+            stats.statements += 1
+            stats.seconds += elapsed
+            if rowcount > 0:
+                stats.rows_written += rowcount
+            # Writers wait for the database lock in BEGIN IMMEDIATE.
+            if sql.lstrip()[:5].upper() == 'BEGIN':
+                stats.lock_wait_seconds += elapsed
+                stats.lock_retries += busy_retries(elapsed)
+            if error is not None and 'locked' in str(error):
+                stats.lock_errors += 1
+        if self.pool is not None and self.pool.slow_query_sec and elapsed >= self.pool.slow_query_sec:
+            self.pool.log_slow_query(sql, elapsed)
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def dispose(self):
+        """Really closes the underlying SQLite handle."""
+        super().close()
+
+
+def _counted_row(cursor, row):
+    """sqlite3.Row factory that also counts the rows a request reads."""
+    stats = current_query_stats()
+    if stats is not None:
+        stats.rows_read += 1
+    return sqlite3.Row(cursor, row)
+
+
+class ConnectionPool:
+    """
+    A bounded pool of SQLite connections for a single database file.
+
+    Each connection is configured once when it is opened (WAL journal,
+    synchronous=NORMAL, busy timeout and a prepared statement cache) and then
+    reused across requests. When every connection is checked out, acquire()
+    waits up to `timeout` seconds before giving up.
+    """
+
+    def __init__(self, db_path, max_size=8, timeout=5.0, busy_timeout_ms=5000, statement_cache_size=256,
+                 slow_query_ms=0, logger=None):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.statement_cache_size = statement_cache_size
+        # Statements slower than this are logged; 0 turns the log off.
+        self.slow_query_sec = slow_query_ms / 1000.0
+        self.logger = logger
+        # LIFO keeps the most recently used (and warmest) connections in play.
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._acquired = 0
+        self._reused = 0
+        self._waits = 0
+        self._timeouts = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            factory=PooledConnection,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size,
+        )
+        # Return rows as objects that can be accessed by column name
+        conn.row_factory = _counted_row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        """Checks a connection out of the pool, opening a new one if there is room."""
+        conn = None
+        try:
+            conn = self._idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            reused = False
+            with self._lock:
+                can_create = self._created < self.max_size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    conn = self._connect()
+                except sqlite3.Error:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                with self._lock:
+                    self._waits += 1
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                    reused = True
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    # Raised as a sqlite3 error so the routes' existing handlers report it.
+                    raise sqlite3.OperationalError('connection pool exhausted')
+
+        with self._lock:
+            self._in_use += 1
+            self._acquired += 1
+            if reused:
+                self._reused += 1
+        return conn
+
+    def release(self, conn):
+        """Returns a connection to the pool, rolling back anything left uncommitted."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # A broken connection is dropped rather than handed to the next request.
+            with self._lock:
+                self._in_use -= 1
+                self._created -= 1
+            conn.dispose()
+            return
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    def log_slow_query(self, sql, elapsed):
+        if self.logger is not None:
+            self.logger.warning(f"Slow query ({elapsed * 1000:.1f} ms) on {self.db_path}: {' '.join(sql.split())}")
+
+    def close_all(self):
+        """Closes every idle connection. Checked-out connections are closed when released."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+            conn.dispose()
+
+    def stats(self):
+        """A snapshot of pool counters, useful for tuning DB_POOL_SIZE."""
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "open": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "acquired": self._acquired,
+                "reused": self._reused,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+            }
+
+
+def init_pools(app, db_paths):
+    """Creates one connection pool per shard file and registers them as an extension."""
+    pools = [
+        ConnectionPool(
+            db_path,
+            max_size=app.config.get('DB_POOL_SIZE', 8),
+            timeout=app.config.get('DB_POOL_TIMEOUT_SEC', 5.0),
+            busy_timeout_ms=app.config.get('DB_BUSY_TIMEOUT_MS', 5000),
+            statement_cache_size=app.config.get('DB_STATEMENT_CACHE_SIZE', 256),
+            slow_query_ms=app.config.get('SLOW_QUERY_LOG_MS', 0),
+            logger=app.logger,
+        )
+        for db_path in db_paths
+    ]
+    app.extensions['db_pools'] = pools
+    return pools
+
+
+def get_pools():
+    """Every shard's pool for the current app, in shard order."""
+    return current_app.extensions['db_pools']
+
+
+def get_pool(tenant_id):
+    """Returns the pool of the shard that stores tenant_id."""
+    pools = get_pools()
+    return pools[shard_index(tenant_id, len(pools))]
@@ -0,0 +1,163 @@
+import itertools
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from . import schedule
+from .nap_stats import fold, observed_durations, rebuild_nap_stats
+from .shards import connect_shard, existing_shard_paths, in_transaction
+
+# Offline evaluation of nap plans. Stored days are replayed in date order; on
+# every day each strategy seeds a plan from what it knew the evening before,
+# the plan is projected with the schedule engine and compared with the naps
+# that really happened. NumPy is only needed here and is imported lazily.
+
+_DAYS_SQL = '''
+    SELECT d.tenant_id, d.id AS day_id, d.first_wake_ms,
+           n.nap_index, n.status, n.actual_start_ms, n.actual_end_ms
+    FROM days d JOIN nap_slots n ON n.day_id = d.id
+    WHERE d.first_wake_ms IS NOT NULL {tenant_filter}
+    ORDER BY d.tenant_id, d.date, n.nap_index
+'''
+
+
+def _stored_days(conn, tenant_id=None):
+    """Yields (tenant_id, first_wake_ms, finished_naps) per recorded day, oldest first."""
+    params = ()
+    tenant_filter = ''
+    if tenant_id is not None:
+        tenant_filter, params = 'AND d.tenant_id = ?', (tenant_id,)
+    rows = conn.execute(_DAYS_SQL.format(tenant_filter=tenant_filter), params)
+    for (tenant, _, first_wake_ms), day_rows in itertools.groupby(
+            rows, key=lambda row: (row['tenant_id'], row['day_id'], row['first_wake_ms'])):
+        finished = []
+        previous_end_ms = first_wake_ms
+        for row in day_rows:
+            if row['status'] != 'finished':
+                continue
+            nap = dict(row, previous_end_ms=previous_end_ms)
+            finished.append(nap)
+            previous_end_ms = row['actual_end_ms']
+        yield tenant, first_wake_ms, finished
+
+
+def _predict(first_wake_ms, plan, wake_windows_min):
+    """Projects a seeded plan from the morning wake-up, as the day would have started."""
+    naps = [
+        dict(nap, status='upcoming', adjusted_duration_sec=None, actual_start_ms=None, actual_end_ms=None)
+        for nap in plan
+    ]
+    projections, _ = schedule.project_day(first_wake_ms, naps, wake_windows_min)
+    return projections
+
+
+def replay(conn, strategies, wake_windows_min, min_samples, tenant_id=None):
+    """
+    Replays every stored day. strategies maps a name to an EWMA alpha, or to
+    None for the fixed default plan. Returns {name: (duration_errors_sec,
+    start_errors_sec)} with one signed error (predicted - actual) per
+    finished nap that the plan also contained.
+    """
+    errors = {name: ([], []) for name in strategies}
+    stats = {name: {} for name in strategies}
+    for tenant, first_wake_ms, finished in _stored_days(conn, tenant_id):
+        for name, alpha in strategies.items():
+            tenant_stats = stats[name].setdefault(tenant, {})
+            plan = schedule.seed_nap_plan(tenant_stats if alpha is not None else {}, min_samples=min_samples)
+            planned = {nap['nap_index']: nap for nap in plan}
+            projections = _predict(first_wake_ms, plan, wake_windows_min)
+            duration_errors, start_errors = errors[name]
+            for nap in finished:
+                nap_sec, wake_sec = observed_durations(nap)
+                if nap['nap_index'] in planned and nap_sec is not None:
+                    duration_errors.append(planned[nap['nap_index']]['planned_duration_sec'] - nap_sec)
+                    start_errors.append((projections[nap['nap_index']][0] - nap['actual_start_ms']) / 1000)
+                if alpha is not None:
+                    tenant_stats[nap['nap_index']] = fold(
+                        tenant_stats.get(nap['nap_index']), nap_sec, wake_sec, alpha)
+    return errors
+
+
+def score(errors_sec):
+    """Summary statistics of signed errors, in minutes."""
+    import numpy as np
+
+    errors = np.asarray(errors_sec, dtype=float) / 60.0
+    if errors.size == 0:
+        return None
+    absolute = np.abs(errors)
+    return {
+        "naps": int(errors.size),
+        "bias_min": float(errors.mean()),
+        "mae_min": float(absolute.mean()),
+        "rmse_min": float(np.sqrt(np.mean(errors ** 2))),
+        "p90_abs_min": float(np.percentile(absolute, 90)),
+    }
+
+
+plans_cli = AppGroup('plans', help='Inspect and evaluate the data-driven nap plans.')
+
+
+@plans_cli.command('evaluate')
+@click.option('--alpha', 'alphas', type=click.FloatRange(0, 1, min_open=True), multiple=True,
+              help='EWMA weight to evaluate; repeat to compare several. Defaults to NAP_STATS_ALPHA.')
+@click.option('--min-samples', type=click.IntRange(min=0), default=None,
+              help='Samples a nap slot needs before its statistics are used. Defaults to NAP_PLAN_MIN_SAMPLES.')
+@click.option('--tenant', default=None, help='Only replay this tenant.')
+def plans_evaluate(alphas, min_samples, tenant):
+    """Scores how well each plan strategy predicts the stored days.
+
+    For every finished nap, the seeded duration and the projected start time
+    are compared with what really happened. Lower is better.
+    """
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        raise click.ClickException("The evaluator needs NumPy: pip install numpy")
+
+    config = current_app.config
+    if not alphas:
+        alphas = (config.get('NAP_STATS_ALPHA', schedule.DEFAULT_STATS_ALPHA),)
+    if min_samples is None:
+        min_samples = config.get('NAP_PLAN_MIN_SAMPLES', schedule.DEFAULT_PLAN_MIN_SAMPLES)
+    wake_windows_min = config.get('WAKE_WINDOWS_MIN', schedule.DEFAULT_WAKE_WINDOWS_MIN)
+
+    strategies = {'default': None}
+    strategies.update({f"ewma alpha={alpha:g}": alpha for alpha in alphas})
+    totals = {name: ([], []) for name in strategies}
+    for path in existing_shard_paths(current_app):
+        conn = connect_shard(path)
+        try:
+            errors = replay(conn, strategies, wake_windows_min, min_samples, tenant)
+        finally:
+            conn.close()
+        for name, (duration_errors, start_errors) in errors.items():
+            totals[name][0].extend(duration_errors)
+            totals[name][1].extend(start_errors)
+
+    click.echo(f"{'strategy':<20} {'metric':<9} {'naps':>6} {'bias':>8} {'mae':>8} {'rmse':>8} {'p90':>8}  (minutes)")
+    for name, (duration_errors, start_errors) in totals.items():
+        for metric, errors in (('duration', duration_errors), ('start', start_errors)):
+            result = score(errors)
+            if result is None:
+                click.echo(f"{name:<20} {metric:<9} {0:>6}")
+                continue
+            click.echo(f"{name:<20} {metric:<9} {result['naps']:>6} {result['bias_min']:>8.1f} "
+                       f"{result['mae_min']:>8.1f} {result['rmse_min']:>8.1f} {result['p90_abs_min']:>8.1f}")
+
+
+@plans_cli.command('rebuild-stats')
+def plans_rebuild_stats():
+    """Recomputes the rolling nap statistics from every stored nap.
+
+    Run it after changing NAP_STATS_ALPHA or importing history.
+    """
+    alpha = current_app.config.get('NAP_STATS_ALPHA', schedule.DEFAULT_STATS_ALPHA)
+    for path in existing_shard_paths(current_app):
+        conn = connect_shard(path)
+        try:
+            slots = in_transaction(conn, lambda: rebuild_nap_stats(conn, alpha))
+        finally:
+            conn.close()
+        click.echo(f"{path}: {slots} nap slot(s) rebuilt.")
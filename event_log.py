@@ -0,0 +1,264 @@
+import json
+import sqlite3
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from . import schedule
+from .shards import connect_shard, existing_shard_paths, in_transaction
+
+# The append-only event log. Every accepted write is stored in `events` as
+# its normalized event (operations.parse_event), enriched with the decisions
+# taken when it was applied (such as the nap plan a wake-up seeded). days,
+# nap_slots and sleep_sessions are projections of this log: the write path
+# updates them incrementally, and `flask events rebuild` can recreate them.
+#
+# A day_snapshots row holds a day's projected day and nap rows as of its
+# last_event_id, so a rebuild restores the snapshot and replays only that
+# day's later events. Days are snapshotted when the next morning starts.
+
+# Columns of the projections that a snapshot leaves out: row ids are
+# reassigned on restore and nap rows point at their day again.
+_DAY_SKIPPED_COLUMNS = ('id',)
+_NAP_SKIPPED_COLUMNS = ('id', 'day_id', 'tenant_id')
+
+# Logged for each day an import wrote: the payload carries the imported day
+# document, which a replay puts back as it is, since the import has no
+# finer-grained events for its naps.
+DAY_IMPORT_EVENT = 'day_import'
+
+
+def append_event(conn, event):
+    """Appends an applied event to the log and returns its id."""
+    cursor = conn.execute(
+        'INSERT INTO events (tenant_id, type, date, payload, recorded_at) VALUES (?, ?, ?, ?, ?)',
+        (event['tenant_id'], event['type'], event['date'], json.dumps(event), datetime.now().isoformat())
+    )
+    return cursor.lastrowid
+
+
+def log_sleep_sessions(conn, tenant_id, sessions):
+    """
+    Logs sleep sessions that were written without events (imports) as their
+    sleep and wake events, so a rebuild recreates them. sessions holds
+    (start_at, start_ms, end_at, end_ms) tuples.
+    """
+    recorded_at = datetime.now().isoformat()
+    rows = []
+    for start_at, start_ms, end_at, end_ms in sessions:
+        for event_type, timestamp, timestamp_ms in (('sleep', start_at, start_ms), ('wake', end_at, end_ms)):
+            if not timestamp:
+                continue
+            event = {'tenant_id': tenant_id, 'type': event_type, 'timestamp': timestamp,
+                     'timestamp_ms': timestamp_ms, 'date': timestamp[:10], 'index': None, 'duration_sec': None}
+            rows.append((tenant_id, event_type, event['date'], json.dumps(event), recorded_at))
+    conn.executemany(
+        'INSERT INTO events (tenant_id, type, date, payload, recorded_at) VALUES (?, ?, ?, ?, ?)', rows
+    )
+
+
+def _row_dicts(conn, sql, params):
+    # Callers include migrations, whose connections have no row factory.
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    return [dict(row) for row in cursor.execute(sql, params)]
+
+
+def day_document(conn, tenant_id, date_str):
+    """A day's stored day and nap rows without their row ids, or None when the day is missing."""
+    days = _row_dicts(conn, 'SELECT * FROM days WHERE tenant_id = ? AND date = ?', (tenant_id, date_str))
+    if not days:
+        return None
+    day = days[0]
+    naps = _row_dicts(conn, 'SELECT * FROM nap_slots WHERE day_id = ? ORDER BY nap_index', (day['id'],))
+    return {
+        "day": {key: value for key, value in day.items() if key not in _DAY_SKIPPED_COLUMNS},
+        "naps": [{key: value for key, value in nap.items() if key not in _NAP_SKIPPED_COLUMNS} for nap in naps],
+    }
+
+
+def log_imported_day(conn, tenant_id, date_str):
+    """
+    Logs a day written without events (imports) as a day_import event
+    carrying its document, so any rebuild recreates it. Returns False when
+    the day is missing.
+    """
+    document = day_document(conn, tenant_id, date_str)
+    if document is None:
+        return False
+    append_event(conn, {'tenant_id': tenant_id, 'type': DAY_IMPORT_EVENT, 'date': date_str, 'document': document})
+    return True
+
+
+def snapshot_day(conn, tenant_id, date_str, force=False):
+    """
+    Stores the projected state of one day as of its latest logged event.
+    Does nothing when the day is missing or, unless force is set (for rows
+    written without events, such as imports), its snapshot is already current.
+    """
+    last_event_id = conn.execute(
+        'SELECT COALESCE(MAX(id), 0) FROM events WHERE tenant_id = ? AND date = ?', (tenant_id, date_str)
+    ).fetchone()[0]
+    current = conn.execute(
+        'SELECT last_event_id FROM day_snapshots WHERE tenant_id = ? AND date = ?', (tenant_id, date_str)
+    ).fetchone()
+    if not force and current is not None and current[0] == last_event_id:
+        return False
+
+    document = day_document(conn, tenant_id, date_str)
+    if document is None:
+        return False
+    conn.execute('''
+        INSERT INTO day_snapshots (tenant_id, date, last_event_id, document, taken_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (tenant_id, date) DO UPDATE SET
+            last_event_id = excluded.last_event_id,
+            document = excluded.document,
+            taken_at = excluded.taken_at
+    ''', (tenant_id, date_str, last_event_id, json.dumps(document), datetime.now().isoformat()))
+    return True
+
+
+def snapshot_previous_day(conn, tenant_id, date_str):
+    """Snapshots the tenant's latest day before date_str, which a new morning has just closed."""
+    row = conn.execute(
+        'SELECT date FROM days WHERE tenant_id = ? AND date < ? ORDER BY date DESC LIMIT 1', (tenant_id, date_str)
+    ).fetchone()
+    if row is not None:
+        snapshot_day(conn, tenant_id, row[0])
+
+
+def _insert(conn, table, values):
+    columns = list(values)
+    placeholders = ', '.join('?' for _ in columns)
+    cursor = conn.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                          [values[column] for column in columns])
+    return cursor.lastrowid
+
+
+def _restore_snapshot(conn, tenant_id, document):
+    day_id = _insert(conn, 'days', document['day'])
+    for nap in document['naps']:
+        _insert(conn, 'nap_slots', dict(nap, tenant_id=tenant_id, day_id=day_id))
+
+
+def replace_day(conn, tenant_id, document):
+    """Replaces the tenant's stored day of the document's date, and its naps, with the document."""
+    day = conn.execute('SELECT id FROM days WHERE tenant_id = ? AND date = ?',
+                       (tenant_id, document['day']['date'])).fetchone()
+    if day is not None:
+        conn.execute('DELETE FROM nap_slots WHERE day_id = ?', (day[0],))
+        conn.execute('DELETE FROM days WHERE id = ?', (day[0],))
+    _restore_snapshot(conn, tenant_id, document)
+
+
+def rebuild_projections(conn, tenant_id=None, use_snapshots=True, batch_size=500, alpha=schedule.DEFAULT_STATS_ALPHA):
+    """
+    Recreates days, nap_slots and sleep_sessions (all tenants, or one) from
+    the log: day snapshots are restored, then the events after each day's
+    snapshot are replayed in order. Sleep and wake events are always replayed
+    for the sleep sessions, which are not snapshotted. Rows are streamed in
+    batches of batch_size, so memory stays flat however long the log is.
+    The derived nap statistics and daily rollups are recomputed at the end.
+    Returns (snapshots_restored, events_replayed). The caller owns the transaction.
+    """
+    from .history import rebuild_daily_rollups
+    from .nap_stats import rebuild_nap_stats
+    from .operations import EventError, replay_event
+
+    tenant_filter, params = ('tenant_id = ?', (tenant_id,)) if tenant_id is not None else ('1', ())
+    conn.execute(f'DELETE FROM nap_slots WHERE {tenant_filter}', params)
+    conn.execute(f'DELETE FROM days WHERE {tenant_filter}', params)
+    conn.execute(f'DELETE FROM sleep_sessions WHERE {tenant_filter}', params)
+
+    restored = 0
+    if use_snapshots:
+        snapshots = conn.cursor()
+        snapshots.execute(f'SELECT tenant_id, document FROM day_snapshots WHERE {tenant_filter}', params)
+        while True:
+            rows = snapshots.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                _restore_snapshot(conn, row[0], json.loads(row[1]))
+            restored += len(rows)
+        watermark = 'COALESCE(s.last_event_id, 0)'
+    else:
+        watermark = '0'
+
+    replayed = 0
+    log = conn.cursor()
+    log.execute(f'''
+        SELECT e.id, e.payload, e.id <= {watermark} AS covered
+        FROM events e
+        LEFT JOIN day_snapshots s ON s.tenant_id = e.tenant_id AND s.date = e.date
+        WHERE {'e.tenant_id = ?' if tenant_id is not None else '1'}
+          AND (e.id > {watermark} OR e.type IN ('sleep', 'wake'))
+        ORDER BY e.id
+    ''', params)
+    while True:
+        rows = log.fetchmany(batch_size)
+        if not rows:
+            break
+        for event_id, payload, covered in rows:
+            try:
+                replay_event(conn, json.loads(payload), project_day=not covered)
+            except EventError as e:
+                current_app.logger.warning(f"Skipped event {event_id} during rebuild: {e.message}")
+            replayed += 1
+
+    rebuild_daily_rollups(conn)
+    rebuild_nap_stats(conn, alpha)
+    return restored, replayed
+
+
+events_cli = AppGroup('events', help='Inspect the event log and rebuild its projections.')
+
+
+@events_cli.command('status')
+def events_status():
+    """Counts the logged events and day snapshots in each shard."""
+    for path in existing_shard_paths(current_app):
+        conn = connect_shard(path)
+        try:
+            events = conn.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+            snapshots = conn.execute('SELECT COUNT(*) FROM day_snapshots').fetchone()[0]
+        finally:
+            conn.close()
+        click.echo(f"{path}: {events} event(s), {snapshots} day snapshot(s)")
+
+
+@events_cli.command('snapshot')
+def events_snapshot():
+    """Snapshots every day whose snapshot is missing or behind the log."""
+    for path in existing_shard_paths(current_app):
+        conn = connect_shard(path)
+        try:
+            days = conn.execute('SELECT tenant_id, date FROM days').fetchall()
+            taken = in_transaction(conn, lambda: sum(snapshot_day(conn, *day) for day in days))
+        finally:
+            conn.close()
+        click.echo(f"{path}: {taken} snapshot(s) taken")
+
+
+@events_cli.command('rebuild')
+@click.option('--tenant', default=None, help='Only rebuild this tenant.')
+@click.option('--from-scratch', is_flag=True, help='Ignore the snapshots and replay the whole log.')
+@click.option('--batch-size', type=click.IntRange(min=1), default=500, show_default=True,
+              help='Rows read from the log at a time.')
+def events_rebuild(tenant, from_scratch, batch_size):
+    """Recreates days, nap slots and sleep sessions from the event log.
+
+    Stop writers first; the rebuild of each shard runs in one transaction.
+    """
+    alpha = current_app.config.get('NAP_STATS_ALPHA', schedule.DEFAULT_STATS_ALPHA)
+    for path in existing_shard_paths(current_app):
+        conn = connect_shard(path)
+        try:
+            restored, replayed = in_transaction(conn, lambda: rebuild_projections(
+                conn, tenant, use_snapshots=not from_scratch, batch_size=batch_size, alpha=alpha))
+        finally:
+            conn.close()
+        click.echo(f"{path}: restored {restored} snapshot(s), replayed {replayed} event(s)")
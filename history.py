@@ -0,0 +1,205 @@
+from datetime import date, datetime, timedelta, timezone
+
+# Per-day sleep rollups. One daily_rollups row per tenant and date is kept up to
+# date by the writes that change its inputs (a nap finishing, the morning
+# wake-up), so history queries read one row per day instead of every nap.
+
+# Durations and wake windows of a day's finished naps, from the epoch columns.
+# A wake window is the gap between the previous nap's end (or the morning
+# wake-up for the first nap) and the nap's start.
+_FINISHED_NAPS_SQL = '''
+    SELECT n.day_id,
+           (n.actual_end_ms - n.actual_start_ms) / 1000 AS nap_sec,
+           MAX(0, n.actual_start_ms - LAG(n.actual_end_ms, 1, d.first_wake_ms)
+                                      OVER (PARTITION BY n.day_id ORDER BY n.nap_index)) / 1000 AS wake_sec
+    FROM nap_slots n JOIN days d ON d.id = n.day_id
+    WHERE n.status = 'finished' AND n.actual_start_ms IS NOT NULL AND n.actual_end_ms IS NOT NULL
+      AND {naps_where}
+'''
+
+_UPSERT_ROLLUPS_SQL = f'''
+    INSERT INTO daily_rollups (tenant_id, date, night_sleep_sec, day_sleep_sec, nap_count,
+                               wake_window_total_sec, wake_window_count)
+    SELECT d.tenant_id, d.date, COALESCE(d.total_night_sleep_sec, 0),
+           COALESCE(SUM(naps.nap_sec), 0), COUNT(naps.day_id),
+           COALESCE(SUM(naps.wake_sec), 0), COUNT(naps.wake_sec)
+    FROM days d LEFT JOIN ({_FINISHED_NAPS_SQL}) naps ON naps.day_id = d.id
+    WHERE {{days_where}}
+    GROUP BY d.id
+    ON CONFLICT (tenant_id, date) DO UPDATE SET
+        night_sleep_sec = excluded.night_sleep_sec,
+        day_sleep_sec = excluded.day_sleep_sec,
+        nap_count = excluded.nap_count,
+        wake_window_total_sec = excluded.wake_window_total_sec,
+        wake_window_count = excluded.wake_window_count
+'''
+
+
+def refresh_daily_rollup(conn, day_id):
+    """Recomputes the rollup row of one day from that day's handful of nap rows."""
+    sql = _UPSERT_ROLLUPS_SQL.format(naps_where='n.day_id = ?', days_where='d.id = ?')
+    conn.execute(sql, (day_id, day_id))
+
+
+def rebuild_daily_rollups(conn):
+    """Recomputes every rollup row; used to backfill existing databases."""
+    conn.execute(_UPSERT_ROLLUPS_SQL.format(naps_where='1', days_where='1'))
+
+
+def parse_date_range(args, default_days=30, max_days=3660):
+    """
+    Reads the 'from' and 'to' YYYY-MM-DD query parameters. 'to' defaults to
+    today and 'from' to default_days before it. Raises ValueError when a date
+    is malformed, the range is reversed or it spans more than max_days.
+    """
+    to_date = date.fromisoformat(args['to']) if args.get('to') else date.today()
+    if args.get('from'):
+        from_date = date.fromisoformat(args['from'])
+    else:
+        from_date = to_date - timedelta(days=default_days - 1)
+    if from_date > to_date:
+        raise ValueError("'from' must not be after 'to'.")
+    if (to_date - from_date).days + 1 > max_days:
+        raise ValueError(f"A history range may span at most {max_days} days.")
+    return from_date.isoformat(), to_date.isoformat()
+
+
+def _average(total, count):
+    return round(total / count) if count else None
+
+
+def daily_history(conn, tenant_id, from_date, to_date):
+    """The rollup of every recorded day in [from_date, to_date], oldest first."""
+    rows = conn.execute('''
+        SELECT date, night_sleep_sec, day_sleep_sec, nap_count, wake_window_total_sec, wake_window_count
+        FROM daily_rollups
+        WHERE tenant_id = ? AND date BETWEEN ? AND ?
+        ORDER BY date
+    ''', (tenant_id, from_date, to_date))
+    return [
+        {
+            "date": row['date'],
+            "night_sleep_sec": row['night_sleep_sec'],
+            "day_sleep_sec": row['day_sleep_sec'],
+            "total_sleep_sec": row['night_sleep_sec'] + row['day_sleep_sec'],
+            "nap_count": row['nap_count'],
+            "avg_wake_window_sec": _average(row['wake_window_total_sec'], row['wake_window_count']),
+        }
+        for row in rows
+    ]
+
+
+# SQL expression for the start of the bucket a rollup date falls into.
+_GROUP_EXPRESSIONS = {
+    'day': 'date',
+    # Monday of the date's week.
+    'week': "date(date, 'weekday 0', '-6 days')",
+}
+
+
+def aggregate_history(conn, tenant_id, from_date, to_date, group='day'):
+    """
+    Totals and averages of the rollups in [from_date, to_date], grouped by
+    'day' or 'week'. Averages per day are over the days recorded in the bucket.
+    """
+    bucket = _GROUP_EXPRESSIONS[group]
+    rows = conn.execute(f'''
+        SELECT {bucket} AS period_start,
+               COUNT(*) AS days,
+               SUM(night_sleep_sec) AS night_sleep_sec,
+               SUM(day_sleep_sec) AS day_sleep_sec,
+               SUM(nap_count) AS nap_count,
+               SUM(wake_window_total_sec) AS wake_window_total_sec,
+               SUM(wake_window_count) AS wake_window_count
+        FROM daily_rollups
+        WHERE tenant_id = ? AND date BETWEEN ? AND ?
+        GROUP BY period_start
+        ORDER BY period_start
+    ''', (tenant_id, from_date, to_date))
+    return [
+        {
+            "period_start": row['period_start'],
+            "days": row['days'],
+            "night_sleep_sec": row['night_sleep_sec'],
+            "day_sleep_sec": row['day_sleep_sec'],
+            "total_sleep_sec": row['night_sleep_sec'] + row['day_sleep_sec'],
+            "nap_count": row['nap_count'],
+            "avg_night_sleep_sec": _average(row['night_sleep_sec'], row['days']),
+            "avg_day_sleep_sec": _average(row['day_sleep_sec'], row['days']),
+            "avg_naps_per_day": round(row['nap_count'] / row['days'], 2),
+            "avg_wake_window_sec": _average(row['wake_window_total_sec'], row['wake_window_count']),
+        }
+        for row in rows
+    ]
+
+
+# Column names of days and nap_slots, read once per process: the range query
+# selects both tables side by side and splits each joined row at the boundary.
+_TABLE_COLUMNS = {}
+
+
+def _columns(conn, table):
+    if table not in _TABLE_COLUMNS:
+        _TABLE_COLUMNS[table] = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    return _TABLE_COLUMNS[table]
+
+
+def _day_start_ms(date_str, offset_days=0):
+    day = date.fromisoformat(date_str) + timedelta(days=offset_days)
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def day_documents(conn, tenant_id, from_date, to_date, limit, after=None):
+    """
+    The day documents (day row, nap slots and sleep sessions) of up to limit
+    recorded days in [from_date, to_date], oldest first, starting after the
+    date `after` when given. Reads one JOIN of days and nap_slots and one
+    sleep_sessions query, whatever the number of days. Returns (documents,
+    next_after): next_after is the date to pass as `after` for the next page,
+    or None on the last page. A night's sleep session belongs to the date it
+    ended on, an ongoing one to the date it started on.
+    """
+    day_columns = _columns(conn, 'days')
+    nap_columns = _columns(conn, 'nap_slots')
+    split = len(day_columns)
+    day_id = day_columns.index('id')
+    select = ', '.join([f'd.{column}' for column in day_columns] + [f'n.{column}' for column in nap_columns])
+
+    # One extra day tells whether another page follows. Rows are read by
+    # position and split into a day and a nap, as both tables have an id.
+    rows = conn.execute(f'''
+        SELECT {select}
+        FROM (SELECT * FROM days WHERE tenant_id = ? AND date BETWEEN ? AND ? AND date > ? ORDER BY date LIMIT ?) d
+        LEFT JOIN nap_slots n ON n.day_id = d.id
+        ORDER BY d.date, n.nap_index
+    ''', (tenant_id, from_date, to_date, after or '', limit + 1))
+
+    documents = []
+    has_more = False
+    for row in rows:
+        if not documents or documents[-1]['day']['id'] != row[day_id]:
+            if len(documents) == limit:
+                has_more = True
+                break
+            documents.append({"day": dict(zip(day_columns, row[:split])), "naps": [], "sleep_sessions": []})
+        # A day without nap slots joins to a row of NULLs.
+        if row[split] is not None:
+            documents[-1]['naps'].append(dict(zip(nap_columns, row[split:])))
+    if not documents:
+        return documents, None
+    next_after = documents[-1]['day']['date'] if has_more else None
+
+    by_date = {document['day']['date']: document for document in documents}
+    # Sessions ending on the first date started the evening before it.
+    sessions = conn.execute('''
+        SELECT start_at, end_at, total_sleep_sec
+        FROM sleep_sessions
+        WHERE tenant_id = ? AND start_ms >= ? AND start_ms < ?
+        ORDER BY start_ms
+    ''', (tenant_id, _day_start_ms(documents[0]['day']['date'], -1),
+          _day_start_ms(documents[-1]['day']['date'], 1)))
+    for session in sessions:
+        document = by_date.get((session['end_at'] or session['start_at'])[:10])
+        if document is not None:
+            document['sleep_sessions'].append(dict(session))
+    return documents, next_after
@@ -0,0 +1,192 @@
+import threading
+import time
+
+from flask import current_app, g, has_app_context, request
+
+# Per-route request and SQL instrumentation, exposed in the Prometheus text
+# format at /metrics. A before_request hook gives every request a QueryStats
+# that the pooled connections (db.PooledConnection) add each statement to;
+# the after_request hook folds it into the per-route totals.
+
+PREFIX = 'nap_plans'
+
+# Upper bounds, in seconds, of the request latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class QueryStats:
+    """SQL work done on behalf of one request."""
+    __slots__ = ('statements', 'seconds', 'rows_read', 'rows_written',
+                 'lock_wait_seconds', 'lock_retries', 'lock_errors')
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.lock_wait_seconds = 0.0
+        self.lock_retries = 0
+        self.lock_errors = 0
+
+    def add(self, other):
+        """Adds other's counts to these."""
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+def current_query_stats():
+    """The QueryStats of the request being handled, or None outside of an instrumented request."""
+    if not has_app_context():
+        return None
+    return g.get('query_stats')
+
+
+class _RouteTotals:
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+        self.sql = QueryStats()
+
+
+class Metrics:
+    """Thread-safe per-route totals, rendered as Prometheus text."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._responses = {}
+
+    def observe(self, route, method, status, wall_sec, stats):
+        with self._lock:
+            key = (route, method, status)
+            self._responses[key] = self._responses.get(key, 0) + 1
+
+            totals = self._routes.get(route)
+            if totals is None:
+                totals = self._routes[route] = _RouteTotals()
+            totals.count += 1
+            totals.seconds += wall_sec
+            for position, bound in enumerate(LATENCY_BUCKETS):
+                if wall_sec <= bound:
+                    totals.buckets[position] += 1
+            if stats is not None:
+                totals.sql.add(stats)
+
+    def render(self, pools=(), cache_stats=None, broker_stats=None, writer_stats=()):
+        """The whole exposition: request and SQL series, then pool, cache, stream and write queue gauges."""
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ','.join(f'{key}="{val}"' for key, val in labels)
+                lines.append(f"{PREFIX}_{name}{suffix}{{{label_text}}} {value}" if label_text
+                             else f"{PREFIX}_{name}{suffix} {value}")
+
+        with self._lock:
+            responses = sorted(self._responses.items())
+            routes = sorted(self._routes.items())
+
+            family('http_requests_total', 'counter', 'Requests handled, by route, method and status.', [
+                ('', (('route', route), ('method', method), ('status', status)), count)
+                for (route, method, status), count in responses
+            ])
+            histogram = []
+            for route, totals in routes:
+                for bound, count in zip(LATENCY_BUCKETS, totals.buckets):
+                    histogram.append(('_bucket', (('route', route), ('le', f"{bound:g}")), count))
+                histogram.append(('_bucket', (('route', route), ('le', '+Inf')), totals.count))
+                histogram.append(('_sum', (('route', route),), f"{totals.seconds:.6f}"))
+                histogram.append(('_count', (('route', route),), totals.count))
+            family('http_request_duration_seconds', 'histogram',
+                   'Wall time from before_request to after_request, including JSON serialization.', histogram)
+
+            sql_series = (
+                ('sql_statements_total', 'statements', 'SQL statements executed.'),
+                ('sql_duration_seconds_total', 'seconds', 'Time spent executing SQL, commits included.'),
+                ('sql_rows_read_total', 'rows_read', 'Rows fetched from SQLite.'),
+                ('sql_rows_written_total', 'rows_written', 'Rows inserted, updated or deleted.'),
+                ('sql_lock_wait_seconds_total', 'lock_wait_seconds', 'Time writers waited for the database lock.'),
+                ('sql_lock_retries_total', 'lock_retries', "Retries of SQLite's busy handler while waiting for the lock."),
+                ('sql_lock_errors_total', 'lock_errors', 'Statements that failed with "database is locked".'),
+            )
+            for name, attribute, help_text in sql_series:
+                value_format = '{:.6f}' if attribute.endswith('seconds') else '{}'
+                family(name, 'counter', f"{help_text} By route.", [
+                    ('', (('route', route),), value_format.format(getattr(totals.sql, attribute)))
+                    for route, totals in routes
+                ])
+
+        pool_stats = [(index, pool.stats()) for index, pool in enumerate(pools)]
+        family('db_pool_connections', 'gauge', 'Pooled SQLite connections, by shard and state.', [
+            ('', (('shard', index), ('state', state)), stats[state])
+            for index, stats in pool_stats for state in ('open', 'in_use', 'idle')
+        ])
+        for counter in ('acquired', 'reused', 'waits', 'timeouts'):
+            family(f'db_pool_{counter}_total', 'counter', f"Pool checkouts: {counter}, by shard.", [
+                ('', (('shard', index),), stats[counter]) for index, stats in pool_stats
+            ])
+
+        if cache_stats is not None:
+            family('day_cache_entries', 'gauge', 'Day documents held by the cache.', [('', (), cache_stats['entries'])])
+            for counter in ('hits', 'misses', 'not_modified', 'invalidations'):
+                family(f'day_cache_{counter}_total', 'counter', f"Day cache {counter.replace('_', ' ')}.",
+                       [('', (), cache_stats[counter])])
+
+        if broker_stats is not None:
+            family('stream_subscribers', 'gauge', 'Open /api/day/stream listeners.', [('', (), broker_stats['subscribers'])])
+            family('stream_published_total', 'counter', 'Day documents published to listeners.',
+                   [('', (), broker_stats['published'])])
+            family('stream_dropped_total', 'counter', 'Events dropped for slow listeners.',
+                   [('', (), broker_stats['dropped'])])
+
+        if writer_stats:
+            family('write_queue_pending', 'gauge', 'Write jobs waiting for the writer thread, by shard.', [
+                ('', (('shard', index),), stats['queued']) for index, stats in enumerate(writer_stats)
+            ])
+            for counter, help_text in (('submitted', 'Write jobs queued'),
+                                       ('batches', 'Groups committed or attempted'),
+                                       ('failed_batches', 'Groups whose transaction failed')):
+                family(f'write_queue_{counter}_total', 'counter', f"{help_text}, by shard.", [
+                    ('', (('shard', index),), stats[counter]) for index, stats in enumerate(writer_stats)
+                ])
+
+        return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app):
+    """Registers the request hooks that collect per-route metrics."""
+    metrics = Metrics()
+    app.extensions['metrics'] = metrics
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_started = time.perf_counter()
+        g.query_stats = QueryStats()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        stats = g.pop('query_stats', None)
+        wall_sec = time.perf_counter() - started
+        metrics.observe(request.endpoint or 'unmatched', request.method, response.status_code, wall_sec, stats)
+        # Lets browser dev tools split a slow request into SQL and app time.
+        if stats is not None:
+            sql_ms = stats.seconds * 1000
+            response.headers['Server-Timing'] = (
+                f'sql;dur={sql_ms:.2f};desc="{stats.statements} statements", '
+                f'app;dur={wall_sec * 1000 - sql_ms:.2f}'
+            )
+        return response
+
+    return metrics
+
+
+def get_metrics():
+    """Returns the current app's metrics, or None when they are disabled."""
+    return current_app.extensions.get('metrics')
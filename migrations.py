@@ -0,0 +1,310 @@
+import json
+import sqlite3
+from datetime import datetime
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version.
+# Append new steps to MIGRATIONS; never edit or reorder a step that has shipped.
+
+
+def _column_names(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def _add_missing_columns(conn, table, columns):
+    existing = _column_names(conn, table)
+    for name, ddl in columns:
+        if name not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}')
+
+
+def _baseline_schema(conn):
+    """
+    The original schema. Databases created before versioning already have
+    these tables, so every statement here tolerates existing objects.
+    """
+    # The pre-release nap_plans table was replaced by days/nap_slots.
+    conn.execute('DROP TABLE IF EXISTS nap_plans')
+
+    # The 'days' table is the central record for a single day's schedule.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS days (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL UNIQUE,
+            first_wake_at TEXT,
+            bedtime_start_at TEXT,
+            total_night_sleep_sec INTEGER,
+            daily_awake_budget_sec INTEGER,
+            projected_bedtime_at TEXT
+        )
+    ''')
+    # Columns added to 'days' after the first release.
+    _add_missing_columns(conn, 'days', (
+        ('bedtime_start_at', 'TEXT'),
+        ('total_night_sleep_sec', 'INTEGER'),
+        ('daily_awake_budget_sec', 'INTEGER'),
+        ('projected_bedtime_at', 'TEXT'),
+    ))
+
+    # 'nap_slots' holds the plan and actuals for each individual nap.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS nap_slots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            day_id INTEGER NOT NULL,
+            nap_index INTEGER NOT NULL,
+            planned_duration_sec INTEGER NOT NULL,
+            adjusted_duration_sec INTEGER, -- This will be updated by the schedule adjustment logic.
+            actual_start_at TEXT,
+            actual_end_at TEXT,
+            status TEXT NOT NULL DEFAULT 'upcoming',
+            FOREIGN KEY (day_id) REFERENCES days (id)
+        )
+    ''')
+
+    # Track bedtime sessions to calculate overnight sleep duration.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sleep_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            start_at TEXT NOT NULL,
+            end_at TEXT,
+            total_sleep_sec INTEGER
+        )
+    ''')
+
+
+def _lookup_indexes(conn):
+    """Indexes for the per-request lookups in get_today, log_bedtime and the nap routes."""
+    # Keep only the newest row of any duplicated nap so the unique index can be built.
+    conn.execute('''
+        DELETE FROM nap_slots
+        WHERE id NOT IN (SELECT MAX(id) FROM nap_slots GROUP BY day_id, nap_index)
+    ''')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_nap_slots_day_nap ON nap_slots (day_id, nap_index)')
+    # Only open sessions are ever looked up, so index just those rows.
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sleep_sessions_open ON sleep_sessions (id) WHERE end_at IS NULL')
+
+
+def _processed_events(conn):
+    """Results of batch events, keyed by the client's idempotency key so replays are safe."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS processed_events (
+            idempotency_key TEXT PRIMARY KEY,
+            event_type TEXT NOT NULL,
+            response TEXT NOT NULL,
+            processed_at TEXT NOT NULL
+        )
+    ''')
+
+
+def _epoch_ms_columns(conn):
+    """
+    Integer epoch-millisecond copies of the ISO timestamp columns, so durations
+    and ranges are computed in SQL. Existing rows are backfilled here.
+    """
+    from .operations import to_epoch_ms
+    conn.create_function('to_epoch_ms', 1, to_epoch_ms, deterministic=True)
+
+    _add_missing_columns(conn, 'days', (('first_wake_ms', 'INTEGER'),))
+    _add_missing_columns(conn, 'nap_slots', (('actual_start_ms', 'INTEGER'), ('actual_end_ms', 'INTEGER')))
+    _add_missing_columns(conn, 'sleep_sessions', (('start_ms', 'INTEGER'), ('end_ms', 'INTEGER')))
+
+    conn.execute('UPDATE days SET first_wake_ms = to_epoch_ms(first_wake_at) WHERE first_wake_at IS NOT NULL')
+    conn.execute('''
+        UPDATE nap_slots
+        SET actual_start_ms = to_epoch_ms(actual_start_at), actual_end_ms = to_epoch_ms(actual_end_at)
+        WHERE actual_start_at IS NOT NULL OR actual_end_at IS NOT NULL
+    ''')
+    conn.execute('UPDATE sleep_sessions SET start_ms = to_epoch_ms(start_at), end_ms = to_epoch_ms(end_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sleep_sessions_start_ms ON sleep_sessions (start_ms)')
+
+
+def _tenant_columns(conn):
+    """
+    Adds tenant_id to every table so one database can hold several households.
+    Existing rows belong to the 'default' tenant. days and processed_events are
+    rebuilt because their uniqueness now includes the tenant.
+    """
+    days_columns = ', '.join(sorted(_column_names(conn, 'days')))
+    conn.execute('''
+        CREATE TABLE days_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            date TEXT NOT NULL,
+            first_wake_at TEXT,
+            bedtime_start_at TEXT,
+            total_night_sleep_sec INTEGER,
+            daily_awake_budget_sec INTEGER,
+            projected_bedtime_at TEXT,
+            first_wake_ms INTEGER,
+            UNIQUE (tenant_id, date)
+        )
+    ''')
+    conn.execute(f'INSERT INTO days_new ({days_columns}) SELECT {days_columns} FROM days')
+    conn.execute('DROP TABLE days')
+    conn.execute('ALTER TABLE days_new RENAME TO days')
+
+    conn.execute('''
+        CREATE TABLE processed_events_new (
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            idempotency_key TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            response TEXT NOT NULL,
+            processed_at TEXT NOT NULL,
+            PRIMARY KEY (tenant_id, idempotency_key)
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO processed_events_new (idempotency_key, event_type, response, processed_at)
+        SELECT idempotency_key, event_type, response, processed_at FROM processed_events
+    ''')
+    conn.execute('DROP TABLE processed_events')
+    conn.execute('ALTER TABLE processed_events_new RENAME TO processed_events')
+
+    _add_missing_columns(conn, 'nap_slots', (('tenant_id', "TEXT NOT NULL DEFAULT 'default'"),))
+    _add_missing_columns(conn, 'sleep_sessions', (('tenant_id', "TEXT NOT NULL DEFAULT 'default'"),))
+
+    # Sleep session lookups are now per tenant.
+    conn.execute('DROP INDEX IF EXISTS idx_sleep_sessions_open')
+    conn.execute('DROP INDEX IF EXISTS idx_sleep_sessions_start_ms')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sleep_sessions_open
+        ON sleep_sessions (tenant_id, id) WHERE end_at IS NULL
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sleep_sessions_start_ms ON sleep_sessions (tenant_id, start_ms)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_nap_slots_tenant ON nap_slots (tenant_id)')
+
+
+def _daily_rollups(conn):
+    """
+    Per-day sleep totals for the history API, maintained by the nap stop and
+    wake writes and backfilled here from the existing days.
+    """
+    from .history import rebuild_daily_rollups
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_rollups (
+            tenant_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            night_sleep_sec INTEGER NOT NULL DEFAULT 0,
+            day_sleep_sec INTEGER NOT NULL DEFAULT 0,
+            nap_count INTEGER NOT NULL DEFAULT 0,
+            wake_window_total_sec INTEGER NOT NULL DEFAULT 0,
+            wake_window_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (tenant_id, date)
+        )
+    ''')
+    rebuild_daily_rollups(conn)
+
+
+def _nap_stats(conn):
+    """
+    Rolling per-slot nap statistics that seed each day's plan, backfilled by
+    replaying the finished naps already stored, and the seeded wake window of
+    each nap slot.
+    """
+    from .nap_stats import rebuild_nap_stats
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS nap_stats (
+            tenant_id TEXT NOT NULL,
+            nap_index INTEGER NOT NULL,
+            duration_samples INTEGER NOT NULL DEFAULT 0,
+            duration_ewma_sec REAL,
+            wake_window_samples INTEGER NOT NULL DEFAULT 0,
+            wake_window_ewma_sec REAL,
+            PRIMARY KEY (tenant_id, nap_index)
+        )
+    ''')
+    _add_missing_columns(conn, 'nap_slots', (('planned_wake_window_sec', 'INTEGER'),))
+    rebuild_nap_stats(conn)
+
+
+def _event_log(conn):
+    """
+    The append-only event log and per-day snapshots. Existing databases have
+    no log yet: their sleep sessions are recorded as sleep and wake events,
+    and every existing day is snapshotted, so a rebuild reproduces them.
+    """
+    from .event_log import snapshot_day
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL,
+            type TEXT NOT NULL,
+            date TEXT,
+            payload TEXT NOT NULL,
+            recorded_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_events_tenant_date ON events (tenant_id, date, id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS day_snapshots (
+            tenant_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            last_event_id INTEGER NOT NULL,
+            document TEXT NOT NULL,
+            taken_at TEXT NOT NULL,
+            PRIMARY KEY (tenant_id, date)
+        )
+    ''')
+
+    sessions = conn.execute(
+        'SELECT tenant_id, start_at, start_ms, end_at, end_ms FROM sleep_sessions ORDER BY id'
+    ).fetchall()
+    for tenant_id, start_at, start_ms, end_at, end_ms in sessions:
+        for event_type, timestamp, timestamp_ms in (('sleep', start_at, start_ms), ('wake', end_at, end_ms)):
+            if not timestamp:
+                continue
+            event = {'tenant_id': tenant_id, 'type': event_type, 'timestamp': timestamp,
+                     'timestamp_ms': timestamp_ms, 'date': timestamp[:10], 'index': None, 'duration_sec': None}
+            conn.execute(
+                'INSERT INTO events (tenant_id, type, date, payload, recorded_at) VALUES (?, ?, ?, ?, ?)',
+                (tenant_id, event_type, event['date'], json.dumps(event), datetime.now().isoformat())
+            )
+    for tenant_id, date_str in conn.execute('SELECT tenant_id, date FROM days').fetchall():
+        snapshot_day(conn, tenant_id, date_str)
+
+
+MIGRATIONS = [
+    _baseline_schema,
+    _lookup_indexes,
+    _processed_events,
+    _epoch_ms_columns,
+    _tenant_columns,
+    _daily_rollups,
+    _nap_stats,
+    _event_log,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(db_path, logger=None):
+    """
+    Applies any pending migrations to the database at db_path.
+    Returns the number of steps applied; when the schema is already current
+    this is a single PRAGMA read and no write lock is taken.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        if get_schema_version(conn) >= SCHEMA_VERSION:
+            return 0
+
+        # Take the write lock, then re-check: another worker may have migrated meanwhile.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = get_schema_version(conn)
+            pending = MIGRATIONS[version:]
+            for step, migration in enumerate(pending, start=version + 1):
+                if logger:
+                    logger.info(f"Applying schema migration {step}: {migration.__name__}")
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {step}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return len(pending)
+    finally:
+        conn.close()
@@ -0,0 +1,122 @@
+import sqlite3
+
+from . import schedule
+
+# Rolling per-child nap statistics. nap_stats keeps, for every tenant and nap
+# slot, an exponentially weighted mean of the real nap duration and of the
+# wake window before it. Each finished nap folds into its slot's row in
+# constant time, so seeding tomorrow's plan reads a few rows, not history.
+
+# The finished nap and the end of the awake stretch before it: the previous
+# finished nap of the day, or the morning wake-up for the first one.
+_FINISHED_NAP_SQL = '''
+    SELECT n.nap_index, n.actual_start_ms, n.actual_end_ms,
+           COALESCE((SELECT p.actual_end_ms FROM nap_slots p
+                     WHERE p.day_id = n.day_id AND p.nap_index < n.nap_index AND p.status = 'finished'
+                     ORDER BY p.nap_index DESC LIMIT 1),
+                    d.first_wake_ms) AS previous_end_ms
+    FROM nap_slots n JOIN days d ON d.id = n.day_id
+    WHERE n.day_id = ? AND n.nap_index = ?
+'''
+
+# Every finished nap of every tenant, in the order they happened.
+_ALL_FINISHED_NAPS_SQL = '''
+    SELECT d.tenant_id, n.nap_index, n.actual_start_ms, n.actual_end_ms,
+           LAG(n.actual_end_ms, 1, d.first_wake_ms)
+               OVER (PARTITION BY n.day_id ORDER BY n.nap_index) AS previous_end_ms
+    FROM nap_slots n JOIN days d ON d.id = n.day_id
+    WHERE n.status = 'finished' AND {tenant_filter}
+    ORDER BY d.tenant_id, d.date, n.nap_index
+'''
+
+_UPSERT_STATS_SQL = '''
+    INSERT INTO nap_stats (tenant_id, nap_index, duration_samples, duration_ewma_sec,
+                           wake_window_samples, wake_window_ewma_sec)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (tenant_id, nap_index) DO UPDATE SET
+        duration_samples = excluded.duration_samples,
+        duration_ewma_sec = excluded.duration_ewma_sec,
+        wake_window_samples = excluded.wake_window_samples,
+        wake_window_ewma_sec = excluded.wake_window_ewma_sec
+'''
+
+
+def observed_durations(nap):
+    """(nap_sec, wake_window_sec) of a finished nap row; either is None when its times are missing."""
+    nap_sec = wake_sec = None
+    if nap['actual_start_ms'] is not None and nap['actual_end_ms'] is not None:
+        nap_sec = max(0, (nap['actual_end_ms'] - nap['actual_start_ms']) // 1000)
+    if nap['actual_start_ms'] is not None and nap['previous_end_ms'] is not None:
+        wake_sec = max(0, (nap['actual_start_ms'] - nap['previous_end_ms']) // 1000)
+    return nap_sec, wake_sec
+
+
+def fold(slot, nap_sec, wake_sec, alpha=schedule.DEFAULT_STATS_ALPHA):
+    """Returns a copy of a slot's statistics with one finished nap folded in."""
+    slot = dict(slot or {})
+    if nap_sec is not None:
+        slot['duration_ewma_sec'], slot['duration_samples'] = schedule.ewma_update(
+            slot.get('duration_ewma_sec'), slot.get('duration_samples', 0), nap_sec, alpha)
+    if wake_sec is not None:
+        slot['wake_window_ewma_sec'], slot['wake_window_samples'] = schedule.ewma_update(
+            slot.get('wake_window_ewma_sec'), slot.get('wake_window_samples', 0), wake_sec, alpha)
+    return slot
+
+
+def _upsert(conn, tenant_id, nap_index, slot):
+    conn.execute(_UPSERT_STATS_SQL, (
+        tenant_id, nap_index,
+        slot.get('duration_samples', 0), slot.get('duration_ewma_sec'),
+        slot.get('wake_window_samples', 0), slot.get('wake_window_ewma_sec'),
+    ))
+
+
+def load_nap_stats(conn, tenant_id):
+    """The tenant's statistics as {nap_index: {...}}, the shape schedule.seed_nap_plan takes."""
+    rows = conn.execute('''
+        SELECT nap_index, duration_samples, duration_ewma_sec, wake_window_samples, wake_window_ewma_sec
+        FROM nap_stats WHERE tenant_id = ?
+    ''', (tenant_id,))
+    return {row['nap_index']: dict(row) for row in rows}
+
+
+def record_finished_nap(conn, tenant_id, day_id, nap_index, alpha=schedule.DEFAULT_STATS_ALPHA):
+    """Folds a nap that has just finished into its slot's statistics."""
+    nap = conn.execute(_FINISHED_NAP_SQL, (day_id, nap_index)).fetchone()
+    if nap is None:
+        return
+    nap_sec, wake_sec = observed_durations(nap)
+    if nap_sec is None and wake_sec is None:
+        return
+    slot = conn.execute('''
+        SELECT duration_samples, duration_ewma_sec, wake_window_samples, wake_window_ewma_sec
+        FROM nap_stats WHERE tenant_id = ? AND nap_index = ?
+    ''', (tenant_id, nap_index)).fetchone()
+    _upsert(conn, tenant_id, nap_index, fold(dict(slot) if slot else None, nap_sec, wake_sec, alpha))
+
+
+def rebuild_nap_stats(conn, alpha=schedule.DEFAULT_STATS_ALPHA, tenant_id=None, nap_index=None):
+    """
+    Recomputes the statistics of every tenant (or one, and optionally only
+    one of its nap slots) by replaying their finished naps in order.
+    """
+    tenant_filter, params = ('d.tenant_id = ?', (tenant_id,)) if tenant_id is not None else ('1', ())
+    stats = {}
+    cursor = conn.cursor()
+    # Migrations call this on a plain connection; name the columns either way.
+    cursor.row_factory = sqlite3.Row
+    for nap in cursor.execute(_ALL_FINISHED_NAPS_SQL.format(tenant_filter=tenant_filter), params):
+        # Filtered here rather than in SQL: the wake window needs the day's other naps.
+        if nap_index is not None and nap['nap_index'] != nap_index:
+            continue
+        key = (nap['tenant_id'], nap['nap_index'])
+        stats[key] = fold(stats.get(key), *observed_durations(nap), alpha=alpha)
+    if tenant_id is None:
+        conn.execute('DELETE FROM nap_stats')
+    elif nap_index is None:
+        conn.execute('DELETE FROM nap_stats WHERE tenant_id = ?', (tenant_id,))
+    else:
+        conn.execute('DELETE FROM nap_stats WHERE tenant_id = ? AND nap_index = ?', (tenant_id, nap_index))
+    for (tenant_id, nap_index), slot in stats.items():
+        _upsert(conn, tenant_id, nap_index, slot)
+    return len(stats)
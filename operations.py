@@ -0,0 +1,408 @@
+from datetime import datetime, timezone
+
+from flask import current_app
+
+from . import schedule
+from .event_log import DAY_IMPORT_EVENT, append_event, replace_day, snapshot_previous_day
+from .history import refresh_daily_rollup
+from .nap_stats import load_nap_stats, rebuild_nap_stats, record_finished_nap
+
+# Write operations shared by the single-event routes and /api/events/batch.
+# parse_event() validates a request payload into a normalized event dict and
+# apply_event() performs it on a connection inside the caller's transaction:
+# the event is projected onto days/nap_slots/sleep_sessions and appended to
+# the event log (see event_log.py). replay_event() re-projects a logged event
+# when the projections are rebuilt.
+
+DEFAULT_AWAKE_BUDGET_SEC = 10 * 60 * 60
+
+EVENT_TYPES = ('sleep', 'wake', 'nap_start', 'nap_stop', 'nap_update')
+
+
+class EventError(ValueError):
+    """A write that cannot be applied; carries the HTTP status to report."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+    def response(self):
+        return {"status": "error", "message": self.message}, self.status
+
+
+def to_epoch_ms(timestamp):
+    """
+    Converts a client ISO timestamp to integer epoch milliseconds, the form
+    stored in the *_ms columns for SQL-side arithmetic. Timestamps without an
+    offset are taken as UTC. Returns None for missing or unparseable values.
+    """
+    if not timestamp:
+        return None
+    try:
+        dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    except (ValueError, AttributeError, TypeError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(round(dt.timestamp() * 1000))
+
+
+def from_epoch_ms(epoch_ms):
+    """Formats epoch milliseconds the way browsers' toISOString() does, or None."""
+    if epoch_ms is None:
+        return None
+    dt = datetime.fromtimestamp(epoch_ms / 1000, tz=timezone.utc)
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + f"{dt.microsecond // 1000:03d}Z"
+
+
+def _date_of(timestamp):
+    """The YYYY-MM-DD date a client ISO timestamp belongs to."""
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).strftime('%Y-%m-%d')
+
+
+def parse_event(event_type, data, tenant_id):
+    """
+    Validates a write payload (the JSON body of the matching route) for a
+    tenant and returns a normalized event: {'tenant_id', 'type', 'timestamp',
+    'timestamp_ms', 'date', 'index', 'duration_sec'}.
+    """
+    timestamp = data.get('timestamp')
+    nap_index = data.get('index')
+    event = {'tenant_id': tenant_id, 'type': event_type, 'timestamp': timestamp, 'timestamp_ms': None,
+             'date': None, 'index': nap_index, 'duration_sec': None}
+
+    if event_type in ('sleep', 'wake'):
+        if not timestamp:
+            raise EventError("Invalid event type or missing timestamp.")
+    elif event_type in ('nap_start', 'nap_stop'):
+        if not all([nap_index, timestamp]):
+            raise EventError("Missing nap index or timestamp.")
+    elif event_type == 'nap_update':
+        new_duration_min = data.get('duration_min')
+        if nap_index is None or new_duration_min is None:
+            raise EventError("Missing nap index or duration.")
+        try:
+            event['duration_sec'] = int(new_duration_min) * 60
+        except (ValueError, TypeError):
+            raise EventError("Invalid duration format.")
+
+        # An explicit "date" lets clients in other timezones target the intended day.
+        request_date = data.get('date')
+        if request_date:
+            try:
+                if 'T' in request_date:
+                    event['date'] = _date_of(request_date)
+                else:
+                    event['date'] = request_date.strip()
+            except ValueError:
+                raise EventError("Invalid date format.")
+        else:
+            event['date'] = datetime.now().strftime('%Y-%m-%d')
+        return event
+    else:
+        raise EventError("Invalid event type or missing timestamp.")
+
+    try:
+        event['date'] = _date_of(timestamp)
+    except (ValueError, AttributeError):
+        raise EventError("Invalid timestamp format.")
+    event['timestamp_ms'] = to_epoch_ms(timestamp)
+    return event
+
+
+def changed_date(event):
+    """
+    The date whose day document an applied event changes, or None when it
+    changes every date (sleep and wake events open or close the sleep session).
+    """
+    if event['type'] in ('sleep', 'wake'):
+        return None
+    return event['date']
+
+
+def apply_event(conn, event, adjust=True):
+    """
+    Applies a parsed event on conn, logs it, and returns the success message.
+    Raises EventError when the event does not fit the stored state; nothing
+    is logged then. The caller owns the transaction. With adjust=False a
+    nap_stop skips re-planning the day.
+    """
+    message = _project(conn, event, adjust=adjust)
+    append_event(conn, event)
+    return message
+
+
+def replay_event(conn, event, project_day=True):
+    """
+    Projects an event read back from the log, without logging it again or
+    updating the nap statistics and rollups (a rebuild recomputes those).
+    With project_day=False a wake only closes the sleep session, for days
+    restored from a snapshot.
+    """
+    return _project(conn, event, live=False, project_day=project_day)
+
+
+def _project(conn, event, adjust=True, live=True, project_day=True):
+    event_type = event['type']
+    if event_type == 'sleep':
+        return _apply_sleep(conn, event)
+    if event_type == 'wake':
+        return _apply_wake(conn, event, live, project_day)
+    if event_type == 'nap_start':
+        return _apply_nap_start(conn, event, live)
+    if event_type == 'nap_stop':
+        return _apply_nap_stop(conn, event, adjust, live)
+    if event_type == 'nap_update':
+        return _apply_nap_update(conn, event)
+    if event_type == DAY_IMPORT_EVENT:
+        # Only ever read back from the log; parse_event() does not accept it.
+        replace_day(conn, event['tenant_id'], event['document'])
+        return f"Imported day {event['date']} restored."
+    raise EventError("Invalid event type or missing timestamp.")
+
+
+def _get_day_id(conn, tenant_id, date_str, missing_message):
+    day_row = conn.execute('SELECT id FROM days WHERE tenant_id = ? AND date = ?', (tenant_id, date_str)).fetchone()
+    if not day_row:
+        raise EventError(missing_message, 404)
+    return day_row['id']
+
+
+def _apply_sleep(conn, event):
+    timestamp = event['timestamp']
+    open_session = conn.execute(
+        'SELECT id FROM sleep_sessions WHERE tenant_id = ? AND end_at IS NULL ORDER BY id DESC LIMIT 1',
+        (event['tenant_id'],)
+    ).fetchone()
+    if open_session:
+        conn.execute(
+            'UPDATE sleep_sessions SET start_at = ?, start_ms = ?, end_at = NULL, end_ms = NULL, total_sleep_sec = NULL WHERE id = ?',
+            (timestamp, event['timestamp_ms'], open_session['id'])
+        )
+    else:
+        conn.execute(
+            'INSERT INTO sleep_sessions (tenant_id, start_at, start_ms) VALUES (?, ?, ?)',
+            (event['tenant_id'], timestamp, event['timestamp_ms'])
+        )
+    return "Bedtime started."
+
+
+def _apply_wake(conn, event, live=True, project_day=True):
+    """
+    Closes the open sleep session and initializes the nap schedule for the day.
+    A live wake records the plan it seeded and the awake budget in the event,
+    so replaying it later rebuilds the same day whatever the statistics are then.
+    """
+    tenant_id = event['tenant_id']
+    timestamp = event['timestamp']
+    today_str = event['date']
+    bedtime_start_at = None
+    total_sleep_sec = None
+
+    # The duration is integer arithmetic on the stored epoch columns, done in SQL.
+    sleep_row = conn.execute(
+        'SELECT id, start_at, MAX(0, (? - start_ms) / 1000) AS total_sleep_sec '
+        'FROM sleep_sessions WHERE tenant_id = ? AND end_at IS NULL ORDER BY id DESC LIMIT 1',
+        (event['timestamp_ms'], tenant_id)
+    ).fetchone()
+
+    if sleep_row and sleep_row['start_at']:
+        if sleep_row['total_sleep_sec'] is None:
+            current_app.logger.warning("Invalid timestamp encountered while closing sleep session.")
+        else:
+            total_sleep_sec = sleep_row['total_sleep_sec']
+            bedtime_start_at = sleep_row['start_at']
+            conn.execute(
+                'UPDATE sleep_sessions SET end_at = ?, end_ms = ?, total_sleep_sec = ? WHERE id = ?',
+                (timestamp, event['timestamp_ms'], total_sleep_sec, sleep_row['id'])
+            )
+    if not project_day:
+        return f"Wake time for {today_str} logged."
+
+    config = current_app.config
+    if live:
+        # The day before is complete now; snapshot it for faster rebuilds.
+        snapshot_previous_day(conn, tenant_id, today_str)
+        # Seed the plan from the child's rolling nap statistics; slots without
+        # enough history yet keep the default durations.
+        event['plan'] = schedule.seed_nap_plan(
+            load_nap_stats(conn, tenant_id),
+            default_plan_min=config.get('DEFAULT_NAP_PLAN_MIN', schedule.DEFAULT_NAP_PLAN_MIN),
+            min_samples=config.get('NAP_PLAN_MIN_SAMPLES', schedule.DEFAULT_PLAN_MIN_SAMPLES),
+        )
+        event['awake_budget_sec'] = config.get('DEFAULT_AWAKE_BUDGET_SEC', DEFAULT_AWAKE_BUDGET_SEC)
+    nap_plan = event.get('plan') or schedule.seed_nap_plan({})
+    awake_budget_sec = event.get('awake_budget_sec', DEFAULT_AWAKE_BUDGET_SEC)
+
+    # Use "UPSERT" to either insert a new day or update the existing one
+    conn.execute('''
+        INSERT INTO days (tenant_id, date, first_wake_at, first_wake_ms, bedtime_start_at, total_night_sleep_sec, daily_awake_budget_sec)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(tenant_id, date) DO UPDATE SET first_wake_at = excluded.first_wake_at,
+                                      first_wake_ms = excluded.first_wake_ms,
+                                      bedtime_start_at = excluded.bedtime_start_at,
+                                      total_night_sleep_sec = excluded.total_night_sleep_sec,
+                                      daily_awake_budget_sec = COALESCE(days.daily_awake_budget_sec, excluded.daily_awake_budget_sec)
+    ''', (tenant_id, today_str, timestamp, event['timestamp_ms'], bedtime_start_at, total_sleep_sec, awake_budget_sec))
+
+    # Get the ID of the day we just created/updated
+    day_row = conn.execute('SELECT id FROM days WHERE tenant_id = ? AND date = ?', (tenant_id, today_str)).fetchone()
+    if not day_row:
+        raise EventError("Failed to create or find day record.", 500)
+    day_id = day_row['id']
+
+    # --- Initialize Nap Schedule for the Day ---
+    # Reset the day's slots in place (a repeated wake-up restarts the day)
+    # and drop any the new plan no longer has.
+    conn.executemany('''
+        INSERT INTO nap_slots (tenant_id, day_id, nap_index, planned_duration_sec, planned_wake_window_sec)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (day_id, nap_index) DO UPDATE SET
+            planned_duration_sec = excluded.planned_duration_sec,
+            planned_wake_window_sec = excluded.planned_wake_window_sec,
+            adjusted_duration_sec = NULL,
+            actual_start_at = NULL, actual_start_ms = NULL,
+            actual_end_at = NULL, actual_end_ms = NULL,
+            status = 'upcoming'
+    ''', [(tenant_id, day_id, nap['nap_index'], nap['planned_duration_sec'], nap['planned_wake_window_sec'])
+          for nap in nap_plan])
+    conn.execute('DELETE FROM nap_slots WHERE day_id = ? AND nap_index > ?', (day_id, len(nap_plan)))
+
+    _replan_day(conn, day_id)
+    if live:
+        refresh_daily_rollup(conn, day_id)
+    return f"Wake time for {today_str} logged and nap schedule initialized."
+
+
+def _apply_nap_start(conn, event, live=True):
+    nap_index = event['index']
+    day_id = _get_day_id(conn, event['tenant_id'], event['date'], "Day not started. Log morning wake time first.")
+    previous = conn.execute(
+        'SELECT status FROM nap_slots WHERE day_id = ? AND nap_index = ?', (day_id, nap_index)
+    ).fetchone()
+
+    cursor = conn.execute('''
+        UPDATE nap_slots
+        SET actual_start_at = ?, actual_start_ms = ?, status = 'in_progress'
+        WHERE day_id = ? AND nap_index = ?
+    ''', (event['timestamp'], event['timestamp_ms'], day_id, nap_index))
+
+    if cursor.rowcount == 0:
+        raise EventError(f"Nap with index {nap_index} not found for today.", 404)
+    _replan_day(conn, day_id)
+    # Restarting a finished nap takes it back out of the day's totals and
+    # its slot's statistics; the next stop folds it in again.
+    if live and previous['status'] == 'finished':
+        refresh_daily_rollup(conn, day_id)
+        alpha = current_app.config.get('NAP_STATS_ALPHA', schedule.DEFAULT_STATS_ALPHA)
+        rebuild_nap_stats(conn, alpha, event['tenant_id'], nap_index)
+    return f"Nap {nap_index} start logged."
+
+
+def _apply_nap_update(conn, event):
+    """
+    Updates the duration of a specific nap.
+    - upcoming  -> planned_duration_sec
+    - in_progress -> adjusted_duration_sec (affects the live timer)
+    """
+    nap_index = event['index']
+    new_duration_sec = event['duration_sec']
+    day_id = _get_day_id(conn, event['tenant_id'], event['date'], "Day not started.")
+
+    # find the nap + its status
+    nap_row = conn.execute(
+        'SELECT id, status FROM nap_slots WHERE day_id = ? AND nap_index = ?',
+        (day_id, nap_index)
+    ).fetchone()
+    if not nap_row:
+        raise EventError(f"Nap with index {nap_index} not found.", 404)
+
+    status = nap_row['status']
+    if status == 'in_progress':
+        # live nap: set adjusted (do not rewrite planned)
+        cursor = conn.execute(
+            'UPDATE nap_slots SET adjusted_duration_sec = ? WHERE id = ?',
+            (new_duration_sec, nap_row['id'])
+        )
+    elif status == 'upcoming':
+        # future plan: rewrite planned and clear any prior adjustment
+        cursor = conn.execute(
+            'UPDATE nap_slots SET planned_duration_sec = ?, adjusted_duration_sec = NULL WHERE id = ?',
+            (new_duration_sec, nap_row['id'])
+        )
+    else:
+        raise EventError(
+            f"Upcoming or in-progress nap with index {nap_index} not found or cannot be edited.", 404)
+
+    if cursor.rowcount == 0:
+        raise EventError("No rows updated.")
+
+    _replan_day(conn, day_id)
+    return f"Nap {nap_index} duration updated."
+
+
+def _apply_nap_stop(conn, event, adjust=True, live=True):
+    nap_index = event['index']
+    day_id = _get_day_id(conn, event['tenant_id'], event['date'], "Day not started. Log morning wake time first.")
+    previous = conn.execute(
+        'SELECT status FROM nap_slots WHERE day_id = ? AND nap_index = ?', (day_id, nap_index)
+    ).fetchone()
+
+    cursor = conn.execute('''
+        UPDATE nap_slots
+        SET actual_end_at = ?, actual_end_ms = ?, status = 'finished'
+        WHERE day_id = ? AND nap_index = ?
+    ''', (event['timestamp'], event['timestamp_ms'], day_id, nap_index))
+
+    if cursor.rowcount == 0:
+        raise EventError(f"Nap with index {nap_index} not found for today.", 404)
+
+    # adjust remaining schedule based on the finished nap
+    if adjust:
+        _replan_day(conn, day_id, nap_index)
+    # Only the first stop of a nap feeds the statistics; a corrected end time
+    # would otherwise count the same nap twice.
+    if live and previous['status'] != 'finished':
+        alpha = current_app.config.get('NAP_STATS_ALPHA', schedule.DEFAULT_STATS_ALPHA)
+        record_finished_nap(conn, event['tenant_id'], day_id, nap_index, alpha)
+    if live:
+        refresh_daily_rollup(conn, day_id)
+    return f"Nap {nap_index} stop logged and schedule adjusted."
+
+
+def _replan_day(conn, day_id, finished_nap_index=None):
+    """
+    Runs the schedule engine over the day's stored state and persists the
+    result: adjusted durations for the upcoming naps (when a nap just finished)
+    and the projected bedtime.
+    """
+    day = conn.execute('SELECT first_wake_ms FROM days WHERE id = ?', (day_id,)).fetchone()
+    naps = [dict(row) for row in conn.execute(
+        'SELECT id, nap_index, status, planned_duration_sec, adjusted_duration_sec, planned_wake_window_sec, '
+        'actual_start_ms, actual_end_ms FROM nap_slots WHERE day_id = ? ORDER BY nap_index',
+        (day_id,)
+    )]
+    wake_windows_min = current_app.config.get('WAKE_WINDOWS_MIN', schedule.DEFAULT_WAKE_WINDOWS_MIN)
+    plan = schedule.plan_day(day['first_wake_ms'] if day else None, naps, finished_nap_index, wake_windows_min)
+
+    if finished_nap_index is not None:
+        if plan['time_delta_sec'] is None:
+            # Not enough data to perform adjustment
+            current_app.logger.warning(f"Could not adjust schedule; finished nap {finished_nap_index} lacks start/end times.")
+        elif not plan['adjusted']:
+            current_app.logger.info("No upcoming naps to adjust.")
+        else:
+            current_app.logger.info(
+                f"Nap {finished_nap_index} was {plan['time_delta_sec']:.0f}s off plan. "
+                f"Adjusted {len(plan['adjusted'])} upcoming naps: {plan['adjusted']}.")
+
+    if plan['adjusted']:
+        conn.executemany(
+            'UPDATE nap_slots SET adjusted_duration_sec = ? WHERE id = ?',
+            [(nap['adjusted_duration_sec'], nap['id']) for nap in plan['naps'] if nap['nap_index'] in plan['adjusted']]
+        )
+    conn.execute(
+        'UPDATE days SET projected_bedtime_at = ? WHERE id = ?',
+        (from_epoch_ms(plan['projected_bedtime_ms']), day_id)
+    )
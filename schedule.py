@@ -0,0 +1,161 @@
+# Pure schedule engine. Functions here take a day's state as plain dicts and
+# return new values without touching the database, so the request handlers,
+# the batch path and offline replays can all share them.
+#
+# A nap dict carries: nap_index, status, planned_duration_sec,
+# adjusted_duration_sec, actual_start_ms and actual_end_ms, and optionally
+# planned_wake_window_sec (the awake time before it, seeded from the child's
+# history; None falls back to the configured wake windows).
+
+# Naps are never adjusted below this length.
+MIN_NAP_DURATION_SEC = 10 * 60
+
+# Awake time before nap 1, 2, 3 and before bedtime. The last entry repeats for
+# any further naps. Kept in step with WAKE_WINDOWS_MIN in static/js/script.js.
+DEFAULT_WAKE_WINDOWS_MIN = (120, 150, 150, 180)
+
+# Nap durations a day is seeded with until the child has enough history.
+DEFAULT_NAP_PLAN_MIN = (45, 60, 30)
+
+# Weight of the newest sample in the rolling nap statistics, and how many
+# samples a nap slot needs before its statistics replace the defaults.
+DEFAULT_STATS_ALPHA = 0.3
+DEFAULT_PLAN_MIN_SAMPLES = 3
+
+
+def effective_duration_sec(nap):
+    """The duration a nap is expected to last: its adjustment if any, else its plan."""
+    if nap.get('adjusted_duration_sec') is not None:
+        return nap['adjusted_duration_sec']
+    return nap['planned_duration_sec']
+
+
+def adjust_durations(naps, finished_nap_index, min_duration_sec=MIN_NAP_DURATION_SEC):
+    """
+    Spreads the deviation of a finished nap across the naps still upcoming:
+    a nap that ran long shortens the rest by the same total, a short one
+    lengthens them. Returns (time_delta_sec, {nap_index: new_adjusted_duration_sec});
+    the mapping is empty when the finished nap lacks start/end times or
+    nothing is upcoming.
+    """
+    finished = next((nap for nap in naps if nap['nap_index'] == finished_nap_index), None)
+    if not finished or finished.get('actual_start_ms') is None or finished.get('actual_end_ms') is None:
+        return None, {}
+
+    actual_duration_sec = (finished['actual_end_ms'] - finished['actual_start_ms']) / 1000.0
+    time_delta_sec = actual_duration_sec - finished['planned_duration_sec']
+
+    upcoming = [nap for nap in naps if nap['status'] == 'upcoming']
+    if not upcoming:
+        return time_delta_sec, {}
+
+    adjustment_per_nap = time_delta_sec / len(upcoming)
+    adjusted = {}
+    for nap in upcoming:
+        # The base for adjustment is the previously adjusted duration, or the original plan if never adjusted.
+        new_duration = effective_duration_sec(nap) - adjustment_per_nap
+        adjusted[nap['nap_index']] = max(min_duration_sec, new_duration)
+    return time_delta_sec, adjusted
+
+
+def project_day(first_wake_ms, naps, wake_windows_min=DEFAULT_WAKE_WINDOWS_MIN):
+    """
+    Walks the day from the first wake-up: each nap starts at its actual start
+    or one wake window (its planned_wake_window_sec, else the configured one)
+    after the previous event ended, and ends at its actual
+    end or after its effective duration. Returns (projections, bedtime_ms),
+    where projections maps nap_index to (start_ms, end_ms). bedtime_ms is None
+    when the day has no wake time yet.
+    """
+    if first_wake_ms is None:
+        return {}, None
+
+    def window_ms(position, nap=None):
+        if nap is not None and nap.get('planned_wake_window_sec') is not None:
+            return int(nap['planned_wake_window_sec'] * 1000)
+        minutes = wake_windows_min[min(position, len(wake_windows_min) - 1)]
+        return minutes * 60 * 1000
+
+    projections = {}
+    last_end_ms = first_wake_ms
+    ordered = sorted(naps, key=lambda nap: nap['nap_index'])
+    for position, nap in enumerate(ordered):
+        start_ms = nap.get('actual_start_ms')
+        if start_ms is None:
+            start_ms = last_end_ms + window_ms(position, nap)
+        end_ms = nap.get('actual_end_ms')
+        if end_ms is None:
+            end_ms = start_ms + int(effective_duration_sec(nap) * 1000)
+        projections[nap['nap_index']] = (start_ms, end_ms)
+        last_end_ms = end_ms
+    return projections, last_end_ms + window_ms(len(ordered))
+
+
+def plan_day(first_wake_ms, naps, finished_nap_index=None, wake_windows_min=DEFAULT_WAKE_WINDOWS_MIN,
+             min_duration_sec=MIN_NAP_DURATION_SEC):
+    """
+    Produces the full adjusted plan for a day. When finished_nap_index is
+    given, upcoming naps are first adjusted for that nap's deviation. Returns a
+    dict with the updated copies of the naps, the changed durations, the
+    deviation and the projected bedtime in epoch milliseconds. The input is
+    never modified.
+    """
+    time_delta_sec, adjusted = None, {}
+    if finished_nap_index is not None:
+        time_delta_sec, adjusted = adjust_durations(naps, finished_nap_index, min_duration_sec)
+
+    planned = []
+    for nap in naps:
+        nap = dict(nap)
+        if nap['nap_index'] in adjusted:
+            nap['adjusted_duration_sec'] = adjusted[nap['nap_index']]
+        planned.append(nap)
+
+    _, bedtime_ms = project_day(first_wake_ms, planned, wake_windows_min)
+    return {
+        "naps": planned,
+        "adjusted": adjusted,
+        "time_delta_sec": time_delta_sec,
+        "projected_bedtime_ms": bedtime_ms,
+    }
+
+
+def ewma_update(mean, samples, value, alpha=DEFAULT_STATS_ALPHA):
+    """
+    Folds one observation into an exponentially weighted mean in constant
+    time. Until 1/samples drops below alpha the samples are averaged plainly,
+    so a child's first nap does not outweigh the next few. Returns
+    (new_mean, new_samples).
+    """
+    samples += 1
+    if mean is None:
+        return float(value), samples
+    weight = max(alpha, 1.0 / samples)
+    return mean + weight * (value - mean), samples
+
+
+def seed_nap_plan(stats, default_plan_min=DEFAULT_NAP_PLAN_MIN, min_samples=DEFAULT_PLAN_MIN_SAMPLES,
+                  min_duration_sec=MIN_NAP_DURATION_SEC):
+    """
+    Builds a new day's nap slots from the child's rolling statistics. stats
+    maps nap_index to a dict with duration_ewma_sec, duration_samples,
+    wake_window_ewma_sec and wake_window_samples; slots with fewer than
+    min_samples observations keep the default duration and leave their wake
+    window to the configured one. Returns nap dicts with nap_index,
+    planned_duration_sec and planned_wake_window_sec.
+    """
+    plan = []
+    for nap_index, default_min in enumerate(default_plan_min, start=1):
+        slot = stats.get(nap_index) or {}
+        duration_sec = default_min * 60
+        if slot.get('duration_samples', 0) >= min_samples:
+            duration_sec = max(min_duration_sec, round(slot['duration_ewma_sec']))
+        wake_window_sec = None
+        if slot.get('wake_window_samples', 0) >= min_samples:
+            wake_window_sec = round(slot['wake_window_ewma_sec'])
+        plan.append({
+            'nap_index': nap_index,
+            'planned_duration_sec': duration_sec,
+            'planned_wake_window_sec': wake_window_sec,
+        })
+    return plan
@@ -0,0 +1,194 @@
+import glob
+import hashlib
+import os
+import sqlite3
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from .migrations import migrate
+
+# Tenants (households) are spread over DB_SHARD_COUNT SQLite files so that a
+# write lock taken for one household never blocks another. Shard 0 is the
+# original DATABASE file; shard N lives next to it as <name>.shardN<ext>.
+
+# Tables holding tenant rows, in copy order. Row ids change when a tenant
+# moves, so the references to them are remapped while copying: nap_slots
+# point at days, and day_snapshots at the last event of the log they cover.
+TENANT_TABLES = ('days', 'nap_slots', 'sleep_sessions', 'processed_events', 'daily_rollups',
+                 'nap_stats', 'events', 'day_snapshots')
+
+
+def shard_index(tenant_id, shard_count):
+    """Stable tenant -> shard mapping; the same across processes and restarts."""
+    if shard_count <= 1:
+        return 0
+    digest = hashlib.sha1(tenant_id.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+
+def shard_path(app, index):
+    db_path = os.path.join(app.instance_path, app.config['DATABASE'])
+    if index == 0:
+        return db_path
+    stem, ext = os.path.splitext(db_path)
+    return f"{stem}.shard{index}{ext}"
+
+
+def shard_paths(app, shard_count=None):
+    if shard_count is None:
+        shard_count = app.config.get('DB_SHARD_COUNT', 1)
+    return [shard_path(app, index) for index in range(shard_count)]
+
+
+def existing_shard_paths(app):
+    """Every shard file present on disk, whatever the configured shard count."""
+    base = shard_path(app, 0)
+    stem, ext = os.path.splitext(base)
+    paths = [base] if os.path.exists(base) else []
+    extra = glob.glob(f"{glob.escape(stem)}.shard*{ext}")
+    extra.sort(key=lambda path: int(path[len(stem) + len('.shard'):len(path) - len(ext)]))
+    return paths + extra
+
+
+def connect_shard(path):
+    """
+    Opens a shard outside of the app's pools, for CLI commands. Autocommit
+    mode: statements run in transactions only inside in_transaction().
+    """
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA busy_timeout=5000')
+    return conn
+
+
+def in_transaction(conn, work):
+    """Calls work() inside a write transaction on conn, committing its changes or rolling back if it raises."""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        result = work()
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return result
+
+
+def list_tenants(conn):
+    tenants = set()
+    for table in TENANT_TABLES:
+        tenants.update(row[0] for row in conn.execute(f'SELECT DISTINCT tenant_id FROM {table}'))
+    return sorted(tenants)
+
+
+def _copy_columns(conn, table):
+    """Every column but the rowid alias, which the target assigns afresh."""
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})') if row[1] != 'id']
+
+
+def move_tenant(source, target, tenant_id):
+    """
+    Copies every row of tenant_id from the source connection to the target,
+    then deletes them from the source. Safe to re-run after a crash: the
+    target's copy is replaced and the source is only cleared once the target
+    has committed.
+    """
+    def copy():
+        for table in reversed(TENANT_TABLES):
+            target.execute(f'DELETE FROM {table} WHERE tenant_id = ?', (tenant_id,))
+
+        day_ids = {}
+        event_ids = {0: 0}
+        for table in TENANT_TABLES:
+            columns = _copy_columns(target, table)
+            placeholders = ', '.join('?' for _ in columns)
+            insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+            # The event log must keep its order in the target.
+            order = ' ORDER BY id' if table == 'events' else ''
+            for row in source.execute(f'SELECT * FROM {table} WHERE tenant_id = ?{order}', (tenant_id,)):
+                values = [row[column] for column in columns]
+                if table == 'nap_slots':
+                    values[columns.index('day_id')] = day_ids[row['day_id']]
+                elif table == 'day_snapshots':
+                    values[columns.index('last_event_id')] = event_ids[row['last_event_id']]
+                cursor = target.execute(insert, values)
+                if table == 'days':
+                    day_ids[row['id']] = cursor.lastrowid
+                elif table == 'events':
+                    event_ids[row['id']] = cursor.lastrowid
+
+    def delete():
+        for table in reversed(TENANT_TABLES):
+            source.execute(f'DELETE FROM {table} WHERE tenant_id = ?', (tenant_id,))
+
+    in_transaction(target, copy)
+    in_transaction(source, delete)
+
+
+def rebalance(app, shard_count, dry_run=False, echo=print):
+    """
+    Moves every tenant found in any shard file to the shard it hashes to
+    under shard_count. Returns the list of (tenant_id, from_path, to_path) moves.
+    Run it with writers stopped, then set DB_SHARD_COUNT to shard_count.
+    """
+    targets = shard_paths(app, shard_count)
+    if not dry_run:
+        for path in targets:
+            migrate(path, app.logger)
+
+    moves = []
+    for source_path in existing_shard_paths(app):
+        migrate(source_path, app.logger)
+        source = connect_shard(source_path)
+        try:
+            for tenant_id in list_tenants(source):
+                target_path = targets[shard_index(tenant_id, shard_count)]
+                if os.path.abspath(target_path) == os.path.abspath(source_path):
+                    continue
+                moves.append((tenant_id, source_path, target_path))
+                echo(f"{'Would move' if dry_run else 'Moving'} tenant {tenant_id!r}: "
+                     f"{os.path.basename(source_path)} -> {os.path.basename(target_path)}")
+                if dry_run:
+                    continue
+                target = connect_shard(target_path)
+                try:
+                    move_tenant(source, target, tenant_id)
+                finally:
+                    target.close()
+        finally:
+            source.close()
+    return moves
+
+
+shards_cli = AppGroup('shards', help='Inspect and rebalance tenant shards.')
+
+
+@shards_cli.command('status')
+def shards_status():
+    """Lists the tenants stored in each shard file."""
+    configured = current_app.config.get('DB_SHARD_COUNT', 1)
+    click.echo(f"DB_SHARD_COUNT = {configured}")
+    for path in existing_shard_paths(current_app):
+        conn = connect_shard(path)
+        try:
+            migrate(path, current_app.logger)
+            tenants = list_tenants(conn)
+        finally:
+            conn.close()
+        misplaced = [t for t in tenants if shard_path(current_app, shard_index(t, configured)) != path]
+        click.echo(f"{os.path.basename(path)}: {len(tenants)} tenant(s), {len(misplaced)} misplaced")
+
+
+@shards_cli.command('rebalance')
+@click.option('--shards', 'shard_count', type=click.IntRange(min=1), required=True,
+              help='The shard count to rebalance to.')
+@click.option('--dry-run', is_flag=True, help='Only print the moves.')
+def shards_rebalance(shard_count, dry_run):
+    """Moves tenants so each lives in the shard it hashes to under --shards.
+
+    Use it to split (raise the count) or merge shards. Stop the app first and
+    set DB_SHARD_COUNT to the new count afterwards.
+    """
+    moves = rebalance(current_app, shard_count, dry_run=dry_run, echo=click.echo)
+    click.echo(f"{len(moves)} tenant(s) {'to move' if dry_run else 'moved'}.")
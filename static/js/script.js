@@ -16,6 +16,13 @@ document.addEventListener('DOMContentLoaded', function() {
     let isBedtimeActive = false;
     let setBedtimeUIState = () => {};
     let summaryTicker = null;
+    let scheduleStreamConnected = false;
+    let schedulePollInterval = null;
+    const SCHEDULE_POLL_INTERVAL_MS = 30000;
+    // The last day document applied, and its version when a write response
+    // reported one. Writes send the version back to receive only what changed.
+    let lastDayDocument = null;
+    let dayVersion = null;
 
 
     // Global dev clock (0 by default). Positive = pretend it's later.
@@ -30,6 +37,14 @@ document.addEventListener('DOMContentLoaded', function() {
 
 
 
+    // Household to act for. Opening the page with ?tenant=<id> scopes every
+    // API call to that tenant; without it the server's default tenant is used.
+    const tenantId = new URLSearchParams(window.location.search).get('tenant');
+
+    function apiUrl(path) {
+        return tenantId ? `${path}?tenant=${encodeURIComponent(tenantId)}` : path;
+    }
+
     // Prevents repeated "Nap time is over!" alerts
     let napOverNotified = false;
 
@@ -167,15 +182,11 @@ document.addEventListener('DOMContentLoaded', function() {
           updateSleepSummary();
           updateTodaySummary();
 
-          fetch('/api/day/bedtime', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ type: 'sleep', timestamp })
-          })
-          .then(res => res.json())
+          postWrite('/api/day/bedtime', { type: 'sleep', timestamp })
           .then(data => {
             if (data.status !== 'success') throw new Error(data.message || 'Failed to start bedtime');
             isBedtimeActive = true;
+            applyDayState(data.day_state);
           })
           .catch(err => {
             console.error(err);
@@ -190,16 +201,11 @@ document.addEventListener('DOMContentLoaded', function() {
           setBabyStatus(false, null);
           updateBedtimeUI(false);
 
-          fetch('/api/day/bedtime', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ type: 'wake', timestamp })
-          })
-          .then(res => res.json())
+          postWrite('/api/day/bedtime', { type: 'wake', timestamp })
           .then(data => {
             if (data.status !== 'success') throw new Error(data.message || 'Failed to end bedtime');
             isBedtimeActive = false;
-            fetchTodaySchedule();
+            applyDayState(data.day_state);
           })
           .catch(err => {
             console.error(err);
@@ -276,16 +282,11 @@ document.addEventListener('DOMContentLoaded', function() {
             appState.currentNap &&
             Number(appState.currentNap.nap_index) === editingIndexNum;
 
-        fetch('/api/naps/update', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                index: editingIndexNum,
-                duration_min: newDurationMin,
-                date: appState.day?.date || undefined,
-            })
+        postWrite('/api/naps/update', {
+            index: editingIndexNum,
+            duration_min: newDurationMin,
+            date: appState.day?.date || undefined,
         })
-        .then(res => res.json())
         .then(data => {
             if (data.status !== 'success') {
             alert(`Error: ${data.message || 'Update failed'}`);
@@ -308,37 +309,139 @@ document.addEventListener('DOMContentLoaded', function() {
             setBabyStatus(true, new Date(napEndTime));
             }
 
-            // Pull fresh schedule to sync list + summary
-            fetchTodaySchedule();
+            // Sync list + summary from the document the write returned
+            applyDayState(data.day_state);
         })
         .catch(console.error);
         }
 
     async function fetchTodaySchedule() {
         try {
-            const response = await fetch('/api/day/today');
+            const response = await fetch(apiUrl('/api/day/today'));
             const data = await response.json();
-            appState.sleepSession = data.sleep_session || null;
-            if (data.status === 'not_found') {
-                console.log("No schedule found for today. Ready to start a new day.");
-                appState.day = null;
-                appState.naps = [];
-                appState.currentNap = null;
-                appState.nextNap = null;
-                renderSchedule();
-                return;
-            }
-            console.log("Received schedule data:", data);
-            appState.day = data.day;
-            appState.naps = data.naps;
-            appState.currentNap = appState.naps.find(nap => nap.status === 'in_progress');
-            appState.nextNap = appState.naps.find(nap => nap.status === 'upcoming');
-            renderSchedule();
+            applySchedule(data);
         } catch (error) {
             console.error("Failed to fetch schedule:", error);
         }
     }
 
+    /**
+     * Re-syncs after a successful write. While the live stream is connected
+     * the server pushes the new schedule itself, so no GET is needed.
+     */
+    function refreshSchedule() {
+        if (!scheduleStreamConnected) fetchTodaySchedule();
+    }
+
+    /**
+     * POSTs a write event and asks for today's schedule in the response:
+     * the whole document, or only what changed since dayVersion.
+     */
+    function postWrite(path, body) {
+        const headers = { 'Content-Type': 'application/json', 'Prefer': 'return=representation' };
+        if (dayVersion) headers['X-Day-Version'] = dayVersion;
+        return fetch(apiUrl(path), {
+            method: 'POST',
+            headers,
+            body: JSON.stringify(body),
+        })
+        .then(res => res.json());
+    }
+
+    /**
+     * Renders the day_state of a write response. A delta is only applied on
+     * top of the document it was computed from; otherwise the schedule is
+     * fetched again.
+     */
+    function applyDayState(state) {
+        if (!state) return refreshSchedule();
+        if (state.document) {
+            applySchedule(state.document);
+        } else if (state.delta && lastDayDocument && state.base === dayVersion) {
+            applySchedule(mergeDayDelta(lastDayDocument, state.delta));
+        } else {
+            return fetchTodaySchedule();
+        }
+        dayVersion = state.version;
+    }
+
+    function mergeDayDelta(documentData, delta) {
+        const naps = new Map(documentData.naps.map(nap => [nap.nap_index, nap]));
+        delta.naps.forEach(nap => naps.set(nap.nap_index, nap));
+        delta.removed_naps.forEach(napIndex => naps.delete(napIndex));
+        const merged = {
+            ...documentData,
+            day: { ...documentData.day, ...delta.day },
+            naps: [...naps.values()].sort((a, b) => a.nap_index - b.nap_index),
+        };
+        if ('sleep_session' in delta) {
+            if (delta.sleep_session) merged.sleep_session = delta.sleep_session;
+            else delete merged.sleep_session;
+        }
+        return merged;
+    }
+
+    function startSchedulePolling() {
+        if (schedulePollInterval) return;
+        schedulePollInterval = setInterval(fetchTodaySchedule, SCHEDULE_POLL_INTERVAL_MS);
+    }
+
+    function stopSchedulePolling() {
+        if (schedulePollInterval) {
+            clearInterval(schedulePollInterval);
+            schedulePollInterval = null;
+        }
+    }
+
+    /**
+     * Subscribes to /api/day/stream. Polling only runs while the stream is
+     * down; EventSource reconnects on its own and polling stops once it does.
+     */
+    function connectScheduleStream() {
+        if (!window.EventSource) {
+            startSchedulePolling();
+            return;
+        }
+        const stream = new EventSource(apiUrl('/api/day/stream'));
+        stream.addEventListener('day', (event) => {
+            try {
+                applySchedule(JSON.parse(event.data));
+            } catch (error) {
+                console.error("Failed to apply streamed schedule:", error);
+            }
+        });
+        stream.onopen = () => {
+            scheduleStreamConnected = true;
+            stopSchedulePolling();
+        };
+        stream.onerror = () => {
+            scheduleStreamConnected = false;
+            startSchedulePolling();
+        };
+    }
+
+    function applySchedule(data) {
+        // Documents from a GET or the stream carry no version.
+        lastDayDocument = data;
+        dayVersion = null;
+        appState.sleepSession = data.sleep_session || null;
+        if (data.status === 'not_found') {
+            console.log("No schedule found for today. Ready to start a new day.");
+            appState.day = null;
+            appState.naps = [];
+            appState.currentNap = null;
+            appState.nextNap = null;
+            renderSchedule();
+            return;
+        }
+        console.log("Received schedule data:", data);
+        appState.day = data.day;
+        appState.naps = data.naps;
+        appState.currentNap = appState.naps.find(nap => nap.status === 'in_progress');
+        appState.nextNap = appState.naps.find(nap => nap.status === 'upcoming');
+        renderSchedule();
+    }
+
     function renderSchedule() {
         if (!scheduleList || !scheduleSummary || !statusMessage || !nextNapContainer) return;
         const bedtimeActive = Boolean(appState.sleepSession && !appState.sleepSession.end_at && appState.sleepSession.start_at);
@@ -380,7 +483,10 @@ document.addEventListener('DOMContentLoaded', function() {
             li.className = "flex items-center justify-between p-4 bg-gray-50 rounded-xl";
             const durationSec = nap.adjusted_duration_sec || nap.planned_duration_sec;
             const durationMin = Math.round(durationSec / 60);
-            const wakeWindowMs = (WAKE_WINDOWS_MIN[index] || WAKE_WINDOWS_MIN[WAKE_WINDOWS_MIN.length - 1]) * 60 * 1000;
+            // Days seeded from the child's history carry their own wake windows.
+            const wakeWindowMs = nap.planned_wake_window_sec != null
+                ? nap.planned_wake_window_sec * 1000
+                : (WAKE_WINDOWS_MIN[index] || WAKE_WINDOWS_MIN[WAKE_WINDOWS_MIN.length - 1]) * 60 * 1000;
             const projectedStartAt = new Date(lastEventEndTime.getTime() + wakeWindowMs);
             const displayTime = nap.actual_start_at ? new Date(nap.actual_start_at) : projectedStartAt;
             if (nap.status === 'upcoming' && !nextUpcomingNapTime) {
@@ -420,6 +526,11 @@ document.addEventListener('DOMContentLoaded', function() {
             if (napTimerContainer) napTimerContainer.style.display = 'block';
         } else {
             setBabyStatus(false, nextUpcomingNapTime);
+            if (!appState.nextNap && appState.day.projected_bedtime_at) {
+                // All naps done: the server projects bedtime from the last wake window.
+                if (nextEventLabel) nextEventLabel.textContent = 'Bedtime at';
+                if (nextEventTime) nextEventTime.textContent = formatTime(appState.day.projected_bedtime_at);
+            }
             napControlBtn.textContent = appState.nextNap ? 'Start Nap' : 'All Naps Finished';
             napControlBtn.className = 'w-full bg-green-500 text-white font-bold py-4 px-6 rounded-2xl shadow-lg hover:bg-green-600 transition-colors';
             if (napTimerContainer) napTimerContainer.style.display = 'none';
@@ -469,17 +580,12 @@ document.addEventListener('DOMContentLoaded', function() {
     function startNap() {
         if (!appState.nextNap) return alert("No upcoming nap to start!");
         const napIndex = appState.nextNap.nap_index;
-        fetch('/api/naps/start', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ index: napIndex, timestamp: nowIso() }),
-        })
-        .then(res => res.json())
+        postWrite('/api/naps/start', { index: napIndex, timestamp: nowIso() })
         .then(data => {
             console.log('API /api/naps/start response:', data);
             if (data.status === 'success') {
                 napOverNotified = false;
-                fetchTodaySchedule();
+                applyDayState(data.day_state);
             }
         })
         .catch(console.error);
@@ -488,15 +594,10 @@ document.addEventListener('DOMContentLoaded', function() {
     function stopNap() {
         if (!appState.currentNap) return fetchTodaySchedule();
         const napIndex = appState.currentNap.nap_index;
-        fetch('/api/naps/stop', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ index: napIndex, timestamp: nowIso() }),
-        })
-        .then(res => res.json())
+        postWrite('/api/naps/stop', { index: napIndex, timestamp: nowIso() })
         .then(data => {
             console.log('API /api/naps/stop response:', data);
-            if (data.status === 'success') fetchTodaySchedule();
+            if (data.status === 'success') applyDayState(data.day_state);
         })
         .catch(console.error);
     }
@@ -519,7 +620,7 @@ document.addEventListener('DOMContentLoaded', function() {
         if (appState.currentNap) {
             stopNap();   // this will refresh schedule
         } else {
-            fetchTodaySchedule();
+            refreshSchedule();
         }
         alert("Nap time is over!");
         }
@@ -789,6 +890,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // --- Initial Load ---
     fetchTodaySchedule();
+    connectScheduleStream();
 
     // --- Keyboard Shortcuts ---
     document.addEventListener('keydown', (e) => {
@@ -0,0 +1,60 @@
+import gzip
+
+import brotli
+from flask import Flask
+
+from ..assets import build_assets, init_assets, minify_css, minify_js
+
+
+def test_minify_js_strips_comments_and_indentation():
+    source = "// header\nfunction f(a) {\n    /* note */\n    return a + 1; // trailing\n}\n\n"
+    assert minify_js(source) == "function f(a) {\nreturn a + 1;\n}\n"
+
+
+def test_minify_js_keeps_comment_markers_in_strings():
+    source = "const url = 'http://example.com'; /* x */\nconst t = `a\n  // b`;\n"
+    assert minify_js(source) == "const url = 'http://example.com';\nconst t = `a\n  // b`;\n"
+
+
+def test_minify_js_keeps_regex_literals():
+    source = "x.split(/[/*]/);\nconst b = 1; /* n */\nconst c = 2;\n"
+    assert minify_js(source) == "x.split(/[/*]/);\nconst b = 1;\nconst c = 2;\n"
+    source = "function f(s) {\n  return /\\/\\/ (.*)/.exec(s); // comment\n}\n"
+    assert minify_js(source) == "function f(s) {\nreturn /\\/\\/ (.*)/.exec(s);\n}\n"
+
+
+def test_minify_js_keeps_division():
+    source = "const half = total / 2; // half\nconst ratio = (a + b) / c / d;\n"
+    assert minify_js(source) == "const half = total / 2;\nconst ratio = (a + b) / c / d;\n"
+
+
+def test_minify_js_returns_unclear_source_unchanged():
+    for source in ("const s = 'unterminated;\n", "/* open comment\n", "x = /unterminated\n", "if (a) {}\n/b/.test(c)\n"):
+        assert minify_js(source) == source
+
+
+def test_minify_css():
+    assert minify_css("/* c */\nbody {\n  color: red;\n  margin: 0 auto;\n}\n") == "body{color: red;margin: 0 auto;}\n"
+
+
+def test_built_assets_are_served_precompressed(tmp_path):
+    (tmp_path / 'js').mkdir()
+    (tmp_path / 'js' / 'script.js').write_text("// comment\nconst a = 1;\n")
+    manifest = build_assets(str(tmp_path), sources=('js/script.js',))
+    hashed = manifest['js/script.js']
+    dist = tmp_path / 'dist'
+    assert (dist / (hashed + '.br')).is_file()
+    assert (dist / (hashed + '.gz')).is_file()
+
+    app = Flask(__name__, static_folder=str(tmp_path))
+    init_assets(app)
+    client = app.test_client()
+    response = client.get(f'/assets/{hashed}', headers={'Accept-Encoding': 'br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data) == b"const a = 1;\n"
+    response = client.get(f'/assets/{hashed}', headers={'Accept-Encoding': 'gzip, br;q=0'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == b"const a = 1;\n"
+    response = client.get(f'/assets/{hashed}')
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
@@ -0,0 +1,81 @@
+import threading
+
+from ..broker import EventBroker, format_sse
+
+
+def test_publish_reaches_only_the_topic_subscribers():
+    broker = EventBroker()
+    first = broker.subscribe('family-a')
+    second = broker.subscribe('family-a')
+    other = broker.subscribe('family-b')
+
+    assert broker.publish('family-a', 'update') == 2
+    assert first.get_nowait() == 'update'
+    assert second.get(timeout=0) == 'update'
+    assert other.get_nowait() is None
+    assert broker.publish('family-c', 'update') == 0
+
+
+def test_get_times_out_with_none():
+    subscription = EventBroker().subscribe('family-a')
+    assert subscription.get(timeout=0.01) is None
+
+
+def test_slow_subscriber_loses_oldest_events():
+    broker = EventBroker(max_pending=2)
+    subscription = broker.subscribe('family-a')
+    for number in range(4):
+        broker.publish('family-a', number)
+
+    assert [subscription.get_nowait() for _ in range(3)] == [2, 3, None]
+    assert broker.stats()['published'] == 4
+    assert broker.stats()['dropped'] == 2
+
+
+def test_concurrent_publishers_never_fail_on_a_full_queue():
+    broker = EventBroker(max_pending=1)
+    subscription = broker.subscribe('family-a')
+    errors = []
+
+    def publish():
+        try:
+            for number in range(2000):
+                broker.publish('family-a', number)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=publish) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert subscription.get_nowait() is not None
+    assert broker.stats()['published'] == 8 * 2000
+
+
+def test_close_unsubscribes():
+    broker = EventBroker()
+    subscription = broker.subscribe('family-a')
+    assert broker.subscriber_count('family-a') == 1
+    subscription.close()
+    assert broker.subscriber_count('family-a') == 0
+    assert broker.stats()['topics'] == 0
+    assert broker.publish('family-a', 'update') == 0
+
+
+def test_notify_with_is_called_per_event_and_for_pending_ones():
+    broker = EventBroker()
+    subscription = broker.subscribe('family-a')
+    broker.publish('family-a', 'first')
+    calls = []
+    subscription.notify_with(lambda: calls.append(True))
+    assert calls == [True]
+    broker.publish('family-a', 'second')
+    assert len(calls) == 2
+
+
+def test_format_sse():
+    assert format_sse('{"a": 1}', event='day', event_id='abc') == 'id: abc\nevent: day\ndata: {"a": 1}\n\n'
+    assert format_sse('one\ntwo') == 'data: one\ndata: two\n\n'
+    assert format_sse('') == 'data: \n\n'
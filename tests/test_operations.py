@@ -0,0 +1,49 @@
+from datetime import date
+
+import pytest
+
+from ..app import create_app
+from ..nap_stats import load_nap_stats, rebuild_nap_stats
+
+HEADERS = {'X-Tenant-ID': 'family'}
+
+
+@pytest.fixture
+def app(tmp_path):
+    return create_app({'TESTING': True, 'DATABASE': str(tmp_path / 'operations.db')})
+
+
+def _post(client, path, **body):
+    response = client.post(path, json=body, headers=HEADERS)
+    assert response.status_code == 200, response.get_json()
+
+
+def _nap_stats(app):
+    conn = app.extensions['db_pools'][0].acquire()
+    try:
+        return load_nap_stats(conn, 'family')
+    finally:
+        conn.close()
+
+
+def test_restarted_nap_is_counted_once_in_the_statistics(app):
+    client = app.test_client()
+    today = date.today().isoformat()
+    _post(client, '/api/day/bedtime', type='wake', timestamp=f'{today}T07:00:00')
+    _post(client, '/api/naps/start', index=1, timestamp=f'{today}T09:00:00')
+    _post(client, '/api/naps/stop', index=1, timestamp=f'{today}T09:05:00')
+    _post(client, '/api/naps/start', index=1, timestamp=f'{today}T09:00:00')
+    assert 1 not in _nap_stats(app)
+    _post(client, '/api/naps/stop', index=1, timestamp=f'{today}T10:00:00')
+
+    live = _nap_stats(app)[1]
+    assert live['duration_samples'] == 1
+    assert live['duration_ewma_sec'] == 3600
+
+    conn = app.extensions['db_pools'][0].acquire()
+    try:
+        rebuild_nap_stats(conn, tenant_id='family')
+        conn.commit()
+    finally:
+        conn.close()
+    assert _nap_stats(app)[1] == live
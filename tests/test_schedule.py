@@ -0,0 +1,155 @@
+import copy
+
+from .. import schedule
+
+FIRST_WAKE_MS = 1_760_680_800_000
+MINUTE_MS = 60 * 1000
+
+
+def _nap(index, status='upcoming', planned_min=45, adjusted_sec=None, start_ms=None, end_ms=None):
+    return {
+        'nap_index': index,
+        'status': status,
+        'planned_duration_sec': planned_min * 60,
+        'adjusted_duration_sec': adjusted_sec,
+        'actual_start_ms': start_ms,
+        'actual_end_ms': end_ms,
+    }
+
+
+def _day_after_long_first_nap():
+    # Nap 1 was planned at 45 minutes and ran 75: 30 minutes over.
+    start_ms = FIRST_WAKE_MS + 120 * MINUTE_MS
+    return [
+        _nap(1, 'finished', start_ms=start_ms, end_ms=start_ms + 75 * MINUTE_MS),
+        _nap(2, planned_min=60),
+        _nap(3, planned_min=30),
+    ]
+
+
+def test_effective_duration_prefers_adjustment():
+    assert schedule.effective_duration_sec(_nap(1)) == 45 * 60
+    assert schedule.effective_duration_sec(_nap(1, adjusted_sec=600)) == 600
+
+
+def test_adjust_durations_spreads_overrun_across_upcoming_naps():
+    time_delta_sec, adjusted = schedule.adjust_durations(_day_after_long_first_nap(), 1)
+    assert time_delta_sec == 30 * 60
+    assert adjusted == {2: 45 * 60, 3: 15 * 60}
+
+
+def test_adjust_durations_lengthens_after_short_nap():
+    naps = _day_after_long_first_nap()
+    naps[0]['actual_end_ms'] = naps[0]['actual_start_ms'] + 25 * MINUTE_MS
+    time_delta_sec, adjusted = schedule.adjust_durations(naps, 1)
+    assert time_delta_sec == -20 * 60
+    assert adjusted == {2: 70 * 60, 3: 40 * 60}
+
+
+def test_adjust_durations_builds_on_previous_adjustment():
+    naps = _day_after_long_first_nap()
+    naps[1]['adjusted_duration_sec'] = 50 * 60
+    _, adjusted = schedule.adjust_durations(naps, 1)
+    assert adjusted[2] == 35 * 60
+
+
+def test_adjust_durations_respects_minimum():
+    _, adjusted = schedule.adjust_durations(_day_after_long_first_nap(), 1, min_duration_sec=20 * 60)
+    assert adjusted == {2: 45 * 60, 3: 20 * 60}
+
+
+def test_adjust_durations_without_times_or_upcoming_naps():
+    assert schedule.adjust_durations([_nap(1, 'in_progress')], 1) == (None, {})
+    assert schedule.adjust_durations([_nap(1)], 2) == (None, {})
+    naps = _day_after_long_first_nap()[:1]
+    assert schedule.adjust_durations(naps, 1) == (30 * 60, {})
+
+
+def test_project_day_without_wake_time():
+    assert schedule.project_day(None, [_nap(1)]) == ({}, None)
+
+
+def test_project_day_uses_wake_windows_and_durations():
+    projections, bedtime_ms = schedule.project_day(FIRST_WAKE_MS, [_nap(1), _nap(2, planned_min=60)],
+                                                   wake_windows_min=(120, 150, 180))
+    nap_1_start = FIRST_WAKE_MS + 120 * MINUTE_MS
+    nap_2_start = nap_1_start + 45 * MINUTE_MS + 150 * MINUTE_MS
+    assert projections == {
+        1: (nap_1_start, nap_1_start + 45 * MINUTE_MS),
+        2: (nap_2_start, nap_2_start + 60 * MINUTE_MS),
+    }
+    assert bedtime_ms == nap_2_start + 60 * MINUTE_MS + 180 * MINUTE_MS
+
+
+def test_project_day_follows_actual_times_and_seeded_wake_windows():
+    nap_1 = _nap(1, 'finished', start_ms=FIRST_WAKE_MS + 90 * MINUTE_MS, end_ms=FIRST_WAKE_MS + 150 * MINUTE_MS)
+    nap_2 = dict(_nap(2), planned_wake_window_sec=100 * 60)
+    projections, _ = schedule.project_day(FIRST_WAKE_MS, [nap_2, nap_1])
+    assert projections[1] == (nap_1['actual_start_ms'], nap_1['actual_end_ms'])
+    assert projections[2][0] == nap_1['actual_end_ms'] + 100 * MINUTE_MS
+
+
+def test_project_day_repeats_last_wake_window():
+    naps = [_nap(index) for index in range(1, 4)]
+    projections, _ = schedule.project_day(FIRST_WAKE_MS, naps, wake_windows_min=(60,))
+    assert projections[3][0] - projections[2][1] == 60 * MINUTE_MS
+
+
+def test_plan_day_applies_adjustments_to_copies():
+    naps = _day_after_long_first_nap()
+    original = copy.deepcopy(naps)
+    plan = schedule.plan_day(FIRST_WAKE_MS, naps, finished_nap_index=1)
+
+    assert naps == original
+    assert plan['adjusted'] == {2: 45 * 60, 3: 15 * 60}
+    assert plan['time_delta_sec'] == 30 * 60
+    assert [nap['adjusted_duration_sec'] for nap in plan['naps']] == [None, 45 * 60, 15 * 60]
+    assert all(planned is not nap for planned, nap in zip(plan['naps'], naps))
+    _, bedtime_ms = schedule.project_day(FIRST_WAKE_MS, plan['naps'])
+    assert plan['projected_bedtime_ms'] == bedtime_ms
+
+
+def test_plan_day_without_finished_nap_only_projects():
+    naps = _day_after_long_first_nap()
+    plan = schedule.plan_day(FIRST_WAKE_MS, naps)
+    assert plan['adjusted'] == {}
+    assert plan['time_delta_sec'] is None
+    assert plan['naps'] == naps
+
+
+def test_ewma_update_averages_first_samples():
+    mean, samples = schedule.ewma_update(None, 0, 60)
+    assert (mean, samples) == (60.0, 1)
+    mean, samples = schedule.ewma_update(mean, samples, 30)
+    assert (mean, samples) == (45.0, 2)
+    mean, samples = schedule.ewma_update(mean, samples, 30)
+    assert (mean, samples) == (40.0, 3)
+
+
+def test_ewma_update_switches_to_alpha():
+    mean, samples = schedule.ewma_update(40.0, 9, 140, alpha=0.3)
+    assert samples == 10
+    assert mean == 40.0 + 0.3 * 100
+
+
+def test_seed_nap_plan_defaults_without_history():
+    plan = schedule.seed_nap_plan({})
+    assert plan == [
+        {'nap_index': index, 'planned_duration_sec': minutes * 60, 'planned_wake_window_sec': None}
+        for index, minutes in enumerate(schedule.DEFAULT_NAP_PLAN_MIN, start=1)
+    ]
+
+
+def test_seed_nap_plan_uses_established_statistics():
+    stats = {
+        1: {'duration_ewma_sec': 3000.4, 'duration_samples': 3,
+            'wake_window_ewma_sec': 7199.6, 'wake_window_samples': 3},
+        2: {'duration_ewma_sec': 3000.0, 'duration_samples': 2,
+            'wake_window_ewma_sec': 9000.0, 'wake_window_samples': 5},
+        3: {'duration_ewma_sec': 120.0, 'duration_samples': 8},
+    }
+    plan = schedule.seed_nap_plan(stats, min_samples=3)
+    assert plan[0] == {'nap_index': 1, 'planned_duration_sec': 3000, 'planned_wake_window_sec': 7200}
+    assert plan[1] == {'nap_index': 2, 'planned_duration_sec': 60 * 60, 'planned_wake_window_sec': 9000}
+    assert plan[2]['planned_duration_sec'] == schedule.MIN_NAP_DURATION_SEC
+    assert plan[2]['planned_wake_window_sec'] is None
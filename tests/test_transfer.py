@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from ..app import create_app
+from ..event_log import rebuild_projections
+from ..transfer import import_records, read_ndjson
+
+
+@pytest.fixture
+def app(tmp_path):
+    return create_app({'TESTING': True, 'DATABASE': str(tmp_path / 'transfer.db')})
+
+
+def _ndjson(*records):
+    return [json.dumps(record) + '\n' for record in records]
+
+
+DAYS = (
+    {'table': 'days', 'date': '2026-01-01', 'first_wake_at': '2026-01-01T07:00:00'},
+    {'table': 'nap_slots', 'date': '2026-01-01', 'nap_index': 1, 'planned_duration_sec': 2700,
+     'status': 'finished', 'actual_start_at': '2026-01-01T09:00:00', 'actual_end_at': '2026-01-01T10:00:00'},
+)
+
+
+def _stored(conn, tenant_id):
+    days = [row[0] for row in conn.execute('SELECT date FROM days WHERE tenant_id = ? ORDER BY date', (tenant_id,))]
+    naps = conn.execute('SELECT COUNT(*) FROM nap_slots WHERE tenant_id = ?', (tenant_id,)).fetchone()[0]
+    return days, naps
+
+
+def test_failed_import_completes_the_committed_chunks(app):
+    client = app.test_client()
+    body = ''.join(_ndjson(*DAYS, {'table': 'days'}))
+    app.config['IMPORT_CHUNK_SIZE'] = 2
+    response = client.post('/api/import', data=body, headers={'X-Tenant-ID': 'family'})
+    assert response.status_code == 400
+    assert '2 record(s) were imported' in response.get_json()['message']
+
+    history = client.get('/api/history?from=2026-01-01&to=2026-01-01', headers={'X-Tenant-ID': 'family'})
+    assert [day['date'] for day in history.get_json()['days']] == ['2026-01-01']
+    assert history.get_json()['days'][0]['day_sleep_sec'] == 3600
+
+    conn = app.extensions['db_pools'][0].acquire()
+    try:
+        snapshots = conn.execute("SELECT COUNT(*) FROM day_snapshots WHERE tenant_id = 'family'").fetchone()[0]
+        stats = conn.execute("SELECT duration_samples FROM nap_stats WHERE tenant_id = 'family'").fetchall()
+        assert snapshots == 1
+        assert [row[0] for row in stats] == [1]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('use_snapshots', [True, False])
+def test_imported_days_survive_a_rebuild(app, use_snapshots):
+    conn = app.extensions['db_pools'][0].acquire()
+    try:
+        with app.app_context():
+            records = read_ndjson(_ndjson(
+                {'table': 'sleep_sessions', 'start_at': '2025-12-31T19:00:00', 'end_at': '2026-01-01T07:00:00'},
+                *DAYS,
+            ))
+            import_records(conn, 'family', records, chunk_size=2)
+            before = _stored(conn, 'family')
+
+            conn.execute('BEGIN IMMEDIATE')
+            rebuild_projections(conn, 'family', use_snapshots=use_snapshots)
+            conn.commit()
+        assert before == (['2026-01-01'], 1)
+        assert _stored(conn, 'family') == before
+        nap = conn.execute("SELECT planned_duration_sec, status FROM nap_slots WHERE tenant_id = 'family'").fetchone()
+        assert tuple(nap) == (2700, 'finished')
+    finally:
+        conn.close()
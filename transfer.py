@@ -0,0 +1,396 @@
+import csv
+import io
+import json
+from datetime import date, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from . import schedule
+from .event_log import log_imported_day, log_sleep_sessions, snapshot_day
+from .history import refresh_daily_rollup
+from .nap_stats import rebuild_nap_stats
+from .operations import to_epoch_ms
+
+# Bulk export and import of a tenant's sleep history. Records are portable:
+# they carry no row ids or tenant, and nap slots name their day by date. An
+# export streams rows off a cursor in batches; an import buffers at most one
+# chunk of records before writing it with executemany in one transaction.
+
+TABLES = ('days', 'nap_slots', 'sleep_sessions')
+FORMATS = ('ndjson', 'csv')
+
+# Columns that are never exported: ids are reassigned and the tenant comes
+# from the request.
+_SKIPPED_COLUMNS = ('id', 'tenant_id', 'day_id')
+
+# Epoch columns filled from their ISO twin when an imported record lacks them.
+_EPOCH_COLUMNS = {
+    'first_wake_ms': 'first_wake_at',
+    'actual_start_ms': 'actual_start_at',
+    'actual_end_ms': 'actual_end_at',
+    'start_ms': 'start_at',
+    'end_ms': 'end_at',
+}
+
+# Columns an imported record of each table must have.
+_REQUIRED_COLUMNS = {
+    'days': ('date',),
+    'nap_slots': ('date', 'nap_index', 'planned_duration_sec'),
+    'sleep_sessions': ('start_at',),
+}
+
+
+def export_columns(conn, table):
+    """The portable columns of table, in export order; nap slots lead with their day's date."""
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})') if row[1] not in _SKIPPED_COLUMNS]
+    return ['date'] + columns if table == 'nap_slots' else columns
+
+
+def _export_query(conn, table, tenant_id, from_date, to_date):
+    columns = export_columns(conn, table)
+    params = [tenant_id]
+    if table == 'days':
+        sql = f"SELECT {', '.join(columns)} FROM days WHERE tenant_id = ?"
+        if from_date:
+            sql += ' AND date BETWEEN ? AND ?'
+            params += [from_date, to_date]
+        sql += ' ORDER BY date'
+    elif table == 'nap_slots':
+        select = ', '.join(['d.date'] + [f'n.{column}' for column in columns[1:]])
+        sql = f"SELECT {select} FROM nap_slots n JOIN days d ON d.id = n.day_id WHERE d.tenant_id = ?"
+        if from_date:
+            sql += ' AND d.date BETWEEN ? AND ?'
+            params += [from_date, to_date]
+        sql += ' ORDER BY d.date, n.nap_index'
+    else:
+        sql = f"SELECT {', '.join(columns)} FROM sleep_sessions WHERE tenant_id = ?"
+        if from_date:
+            # Sessions belong to the UTC date they started on.
+            end = date.fromisoformat(to_date) + timedelta(days=1)
+            sql += ' AND start_ms >= ? AND start_ms < ?'
+            params += [to_epoch_ms(f'{from_date}T00:00:00Z'), to_epoch_ms(f'{end.isoformat()}T00:00:00Z')]
+        sql += ' ORDER BY start_ms'
+    return columns, sql, params
+
+
+def export_rows(conn, table, tenant_id, from_date=None, to_date=None, batch_size=1000):
+    """Yields the tenant's rows of table as tuples, batch_size rows per fetch. The first item is the column list."""
+    columns, sql, params = _export_query(conn, table, tenant_id, from_date, to_date)
+    yield columns
+    cursor = conn.cursor()
+    # Plain tuples: building sqlite3.Row objects is wasted work here.
+    cursor.row_factory = None
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def iter_ndjson(conn, tables, tenant_id, from_date=None, to_date=None, batch_size=1000):
+    """Yields one JSON line per row, tagged with its table, table by table."""
+    for table in tables:
+        rows = export_rows(conn, table, tenant_id, from_date, to_date, batch_size)
+        columns = next(rows)
+        for row in rows:
+            record = {"table": table, **dict(zip(columns, row))}
+            yield json.dumps(record) + '\n'
+
+
+def iter_csv(conn, table, tenant_id, from_date=None, to_date=None, batch_size=1000):
+    """Yields a CSV export of one table, a header line then one chunk of text per batch of rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    rows = export_rows(conn, table, tenant_id, from_date, to_date, batch_size)
+    writer.writerow(next(rows))
+    pending = 0
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+def read_ndjson(lines):
+    """Parses NDJSON lines into (table, record) pairs; blank lines are skipped."""
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ValueError(f"Line {number} is not valid JSON.")
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {number} is not a JSON object.")
+        yield record.pop('table', None), record
+
+
+def read_csv(lines, table):
+    """Parses CSV lines with a header row into (table, record) pairs; empty cells become NULL."""
+    for row in csv.DictReader(lines):
+        yield table, {key: (value if value != '' else None) for key, value in row.items()}
+
+
+class _Importer:
+    """Buffers records per table and column set and writes them a chunk at a time."""
+
+    def __init__(self, conn, tenant_id, chunk_size, progress):
+        self.conn = conn
+        self.tenant_id = tenant_id
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.columns = {table: set(export_columns(conn, table)) for table in TABLES}
+        self.buffers = {}
+        self.pending = 0
+        self.imported = dict.fromkeys(TABLES, 0)
+        self.chunks = 0
+        # Dates whose day or naps a committed chunk changed, kept until the
+        # end to log and snapshot them, and those of the chunk being written.
+        self.touched_dates = set()
+        self.chunk_dates = set()
+
+    def add(self, number, table, record):
+        if table not in TABLES:
+            raise ValueError(f"Record {number}: unknown table {table!r}.")
+        unknown = set(record) - self.columns[table]
+        if unknown:
+            raise ValueError(f"Record {number}: unknown {table} column(s) {', '.join(sorted(unknown))}.")
+        missing = [column for column in _REQUIRED_COLUMNS[table] if record.get(column) in (None, '')]
+        if missing:
+            raise ValueError(f"Record {number}: {table} record lacks {', '.join(missing)}.")
+        for epoch_column, iso_column in _EPOCH_COLUMNS.items():
+            if epoch_column in self.columns[table] and record.get(epoch_column) is None and record.get(iso_column):
+                record[epoch_column] = to_epoch_ms(record[iso_column])
+
+        columns = tuple(sorted(record))
+        self.buffers.setdefault((table, columns), []).append(tuple(record[column] for column in columns))
+        self.pending += 1
+        if self.pending >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Writes every buffered record in one transaction: days first, so nap slots find their day."""
+        if not self.pending:
+            return
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for table in TABLES:
+                for (buffered_table, columns), rows in self.buffers.items():
+                    if buffered_table == table:
+                        getattr(self, f'_write_{table}')(columns, rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            self.chunk_dates.clear()
+            raise
+        self.touched_dates |= self.chunk_dates
+        self.chunk_dates.clear()
+        self.buffers = {}
+        self.pending = 0
+        self.chunks += 1
+        if self.progress:
+            self.progress(self.imported, self.chunks)
+
+    def _write_days(self, columns, rows):
+        updates = ', '.join(f'{column} = excluded.{column}' for column in columns if column != 'date')
+        self.conn.executemany(f'''
+            INSERT INTO days (tenant_id, {', '.join(columns)}) VALUES (?, {', '.join('?' for _ in columns)})
+            ON CONFLICT (tenant_id, date) DO {f'UPDATE SET {updates}' if updates else 'NOTHING'}
+        ''', [(self.tenant_id, *row) for row in rows])
+        self.chunk_dates.update(row[columns.index('date')] for row in rows)
+        self.imported['days'] += len(rows)
+
+    def _write_nap_slots(self, columns, rows):
+        nap_columns = [column for column in columns if column != 'date']
+        date_position = columns.index('date')
+        updates = ', '.join(f'{column} = excluded.{column}' for column in nap_columns if column != 'nap_index')
+        # Naps whose day is neither in the import nor stored already are skipped by the join.
+        cursor = self.conn.executemany(f'''
+            INSERT INTO nap_slots (tenant_id, day_id, {', '.join(nap_columns)})
+            SELECT d.tenant_id, d.id, {', '.join('?' for _ in nap_columns)}
+            FROM days d WHERE d.tenant_id = ? AND d.date = ?
+            ON CONFLICT (day_id, nap_index) DO UPDATE SET {updates}
+        ''', [
+            (*(value for position, value in enumerate(row) if position != date_position),
+             self.tenant_id, row[date_position])
+            for row in rows
+        ])
+        self.chunk_dates.update(row[date_position] for row in rows)
+        self.imported['nap_slots'] += max(cursor.rowcount, 0)
+
+    def _write_sleep_sessions(self, columns, rows):
+        # Re-importing a file must not duplicate sessions: skip starts already stored.
+        start_position = columns.index('start_at')
+        starts = [row[start_position] for row in rows]
+        existing = {
+            row[0] for row in self.conn.execute(
+                f"SELECT start_at FROM sleep_sessions WHERE tenant_id = ? AND start_at IN ({', '.join('?' for _ in starts)})",
+                (self.tenant_id, *starts)
+            )
+        }
+        new_rows = []
+        for row in rows:
+            if row[start_position] not in existing:
+                existing.add(row[start_position])
+                new_rows.append(row)
+        self.conn.executemany(f'''
+            INSERT INTO sleep_sessions (tenant_id, {', '.join(columns)}) VALUES (?, {', '.join('?' for _ in columns)})
+        ''', [(self.tenant_id, *row) for row in new_rows])
+
+        def value(row, column):
+            return row[columns.index(column)] if column in columns else None
+        log_sleep_sessions(self.conn, self.tenant_id, [
+            (value(row, 'start_at'), value(row, 'start_ms'), value(row, 'end_at'), value(row, 'end_ms'))
+            for row in new_rows
+        ])
+        self.imported['sleep_sessions'] += len(new_rows)
+
+    def finalize(self, alpha):
+        """
+        Logs, snapshots and re-rolls the days of every committed chunk and
+        rebuilds the nap statistics. Runs even when the import stops early,
+        so the chunks already written are complete.
+        """
+        conn = self.conn
+        dates = sorted(self.touched_dates)
+        if not dates:
+            return
+        for start in range(0, len(dates), self.chunk_size):
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for date_str in dates[start:start + self.chunk_size]:
+                    # Logged after the chunks' sleep and wake events, so a
+                    # replay restores the imported day over any day they seeded.
+                    log_imported_day(conn, self.tenant_id, date_str)
+                    snapshot_day(conn, self.tenant_id, date_str, force=True)
+                    day = conn.execute('SELECT id FROM days WHERE tenant_id = ? AND date = ?',
+                                       (self.tenant_id, date_str)).fetchone()
+                    if day is not None:
+                        refresh_daily_rollup(conn, day[0])
+                if start + self.chunk_size >= len(dates):
+                    rebuild_nap_stats(conn, alpha, self.tenant_id)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+
+def import_records(conn, tenant_id, records, chunk_size=5000, progress=None,
+                   alpha=schedule.DEFAULT_STATS_ALPHA):
+    """
+    Imports (table, record) pairs into tenant_id, chunk_size records per
+    transaction. Days and nap slots are upserted by date and nap index and
+    sleep sessions already stored are skipped, so re-running an import is
+    safe. Imported sessions are logged as sleep and wake events and each
+    imported day as a day_import event carrying its rows, so `flask events
+    rebuild` restores them, with or without snapshots. progress, if given,
+    is called with the per-table counts and the chunk count after each chunk.
+    Raises ValueError on a malformed record; chunks before it stay imported,
+    logged and snapshotted. Returns the per-table counts.
+    """
+    importer = _Importer(conn, tenant_id, chunk_size, progress)
+    try:
+        for number, (table, record) in enumerate(records, start=1):
+            importer.add(number, table, record)
+        importer.flush()
+    except ValueError as e:
+        raise ValueError(f"{e} {sum(importer.imported.values())} record(s) were imported before it.")
+    finally:
+        importer.finalize(alpha)
+    return importer.imported
+
+
+def parse_tables(value, csv_format):
+    """Validates the table selection of an export: one table for CSV, any subset for NDJSON."""
+    tables = [table.strip() for table in value.split(',')] if value else list(TABLES)
+    unknown = [table for table in tables if table not in TABLES]
+    if unknown:
+        raise ValueError(f"Unknown table(s): {', '.join(unknown)}. Choose from {', '.join(TABLES)}.")
+    if csv_format and len(tables) != 1:
+        raise ValueError("CSV exports one table at a time; pass table=days, nap_slots or sleep_sessions.")
+    return tables
+
+
+history_cli = AppGroup('history', help='Export and import sleep history.')
+
+
+@history_cli.command('export')
+@click.option('--tenant', default=None, help='The tenant to export. Defaults to DEFAULT_TENANT.')
+@click.option('--format', 'export_format', type=click.Choice(FORMATS), default='ndjson', show_default=True)
+@click.option('--table', 'tables', default=None, help='Comma-separated tables (exactly one for CSV).')
+@click.option('--from', 'from_date', default=None, help='First date (YYYY-MM-DD) to export.')
+@click.option('--to', 'to_date', default=None, help='Last date (YYYY-MM-DD) to export.')
+@click.option('--output', type=click.File('w'), default='-', help='File to write; stdout by default.')
+def history_export(tenant, export_format, tables, from_date, to_date, output):
+    """Streams a tenant's days, nap slots and sleep sessions as NDJSON or CSV."""
+    from .db import get_pool
+
+    tenant = tenant or current_app.config.get('DEFAULT_TENANT', 'default')
+    try:
+        tables = parse_tables(tables, export_format == 'csv')
+        from_date, to_date = parse_export_range(from_date, to_date)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    batch_size = current_app.config.get('EXPORT_BATCH_SIZE', 1000)
+    conn = get_pool(tenant).acquire()
+    try:
+        if export_format == 'csv':
+            chunks = iter_csv(conn, tables[0], tenant, from_date, to_date, batch_size)
+        else:
+            chunks = iter_ndjson(conn, tables, tenant, from_date, to_date, batch_size)
+        for chunk in chunks:
+            output.write(chunk)
+    finally:
+        conn.close()
+
+
+@history_cli.command('import')
+@click.argument('source', type=click.File('r'))
+@click.option('--tenant', default=None, help='The tenant to import into. Defaults to DEFAULT_TENANT.')
+@click.option('--format', 'import_format', type=click.Choice(FORMATS), default='ndjson', show_default=True)
+@click.option('--table', default=None, help='The table a CSV file holds.')
+@click.option('--chunk-size', type=click.IntRange(min=1), default=None,
+              help='Records per transaction. Defaults to IMPORT_CHUNK_SIZE.')
+def history_import(source, tenant, import_format, table, chunk_size):
+    """Imports an NDJSON or CSV export ('-' reads stdin) into a tenant."""
+    from .db import get_pool
+
+    tenant = tenant or current_app.config.get('DEFAULT_TENANT', 'default')
+    if import_format == 'csv' and table not in TABLES:
+        raise click.BadParameter(f"CSV imports need --table ({', '.join(TABLES)}).")
+    records = read_csv(source, table) if import_format == 'csv' else read_ndjson(source)
+    chunk_size = chunk_size or current_app.config.get('IMPORT_CHUNK_SIZE', 5000)
+
+    def progress(imported, chunks):
+        counts = ', '.join(f"{count} {name}" for name, count in imported.items())
+        click.echo(f"chunk {chunks}: {counts}", err=True)
+
+    conn = get_pool(tenant).acquire()
+    try:
+        imported = import_records(conn, tenant, records, chunk_size, progress,
+                                  current_app.config.get('NAP_STATS_ALPHA', schedule.DEFAULT_STATS_ALPHA))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+    click.echo(f"Imported into {tenant!r}: " + ', '.join(f"{count} {name}" for name, count in imported.items()),
+               err=True)
+
+
+def parse_export_range(from_date, to_date):
+    """Validates optional YYYY-MM-DD bounds; a single bound leaves the other side open."""
+    if not from_date and not to_date:
+        return None, None
+    start = date.fromisoformat(from_date) if from_date else date.min
+    end = date.fromisoformat(to_date) if to_date else date.max - timedelta(days=1)
+    if start > end:
+        raise ValueError("'from' must not be after 'to'.")
+    return start.isoformat(), end.isoformat()
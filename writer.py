@@ -0,0 +1,168 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import current_app, g
+
+from .metrics import QueryStats
+from .shards import shard_index
+
+# Single-writer group commit (WRITE_MODE = 'queue'). Instead of every request
+# thread taking the SQLite write lock and committing on its own, write
+# endpoints hand their work to one writer thread per shard and wait on a
+# future. The writer drains whatever has queued up within
+# WRITE_GROUP_COMMIT_MS, runs each job in its own savepoint and commits the
+# whole group at once: one lock acquisition and one WAL sync per group.
+
+
+class WriteQueue:
+    """A writer thread that applies queued jobs to one shard and group-commits them."""
+
+    def __init__(self, app, pool, window_ms=2, max_batch=64):
+        self.app = app
+        self.pool = pool
+        self.window_sec = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._submitted = 0
+        self._batches = 0
+        self._failed_batches = 0
+        self._largest_batch = 0
+
+    def submit(self, work):
+        """
+        Queues work, a function of a connection, to run inside the writer's
+        transaction. Returns a Future with its result, or with the exception
+        it raised; a failing job is rolled back without affecting the others.
+        Once it is done, the future's query_stats holds the SQL work the job
+        did, for the request that submitted it to count as its own.
+        """
+        future = Future()
+        with self._lock:
+            self._submitted += 1
+            if self._thread is None:
+                # Started on first use, so CLI commands never spawn a writer.
+                self._thread = threading.Thread(target=self._run, name=f'writer-{self.pool.db_path}', daemon=True)
+                self._thread.start()
+        self._jobs.put((work, future))
+        return future
+
+    def close(self):
+        """Stops the writer once the jobs queued so far are applied."""
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            self._jobs.put(None)
+            thread.join()
+
+    def _next_batch(self):
+        batch = [self._jobs.get()]
+        deadline = time.monotonic() + self.window_sec
+        while batch[-1] is not None and len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._jobs.get(timeout=remaining) if remaining > 0 else self._jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                batch = self._next_batch()
+                stop = batch[-1] is None
+                jobs = [job for job in batch if job is not None]
+                if jobs:
+                    self._apply(jobs)
+                if stop:
+                    return
+
+    def _apply(self, jobs):
+        results = []
+        # The pooled connection records into g.query_stats: each job's own
+        # statements go to its stats, the group's BEGIN and COMMIT, which
+        # every job waited on, to all of them.
+        job_stats = [QueryStats() for _ in jobs]
+        group_stats = g.query_stats = QueryStats()
+        committed = False
+        conn = None
+        try:
+            conn = self.pool.acquire()
+            conn.execute('BEGIN IMMEDIATE')
+            for (work, _), stats in zip(jobs, job_stats):
+                g.query_stats = stats
+                conn.execute('SAVEPOINT write_job')
+                try:
+                    results.append((True, work(conn)))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write_job')
+                    results.append((False, e))
+                conn.execute('RELEASE write_job')
+            g.query_stats = group_stats
+            conn.commit()
+            committed = True
+        except sqlite3.Error as e:
+            # The group shares one transaction, so a failed commit fails every job in it.
+            current_app.logger.error(f"Database error in the write queue for {self.pool.db_path}: {e}")
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+            results = [(False, e)] * len(jobs)
+        finally:
+            g.pop('query_stats', None)
+            if conn is not None:
+                conn.close()
+
+        with self._lock:
+            self._batches += 1
+            self._largest_batch = max(self._largest_batch, len(jobs))
+            if not committed:
+                self._failed_batches += 1
+        for (_, future), (ok, value), stats in zip(jobs, results, job_stats):
+            stats.add(group_stats)
+            future.query_stats = stats
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self._jobs.qsize(),
+                "submitted": self._submitted,
+                "batches": self._batches,
+                "failed_batches": self._failed_batches,
+                "largest_batch": self._largest_batch,
+            }
+
+
+def init_write_queues(app):
+    """Creates one write queue per shard pool and registers them as an extension."""
+    queues = [
+        WriteQueue(
+            app,
+            pool,
+            window_ms=app.config.get('WRITE_GROUP_COMMIT_MS', 2),
+            max_batch=app.config.get('WRITE_BATCH_MAX', 64),
+        )
+        for pool in app.extensions['db_pools']
+    ]
+    app.extensions['write_queues'] = queues
+    return queues
+
+
+def get_write_queues():
+    """Every shard's write queue, or None when writes are not queued."""
+    return current_app.extensions.get('write_queues')
+
+
+def get_write_queue(tenant_id):
+    """Returns the write queue of the shard that stores tenant_id, or None when writes are not queued."""
+    queues = get_write_queues()
+    if queues is None:
+        return None
+    return queues[shard_index(tenant_id, len(queues))]